@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, url_for
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context, url_for
 from flask_cors import CORS
 import hashlib
 import json
@@ -8,7 +8,15 @@ from urllib.parse import urlparse
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 
-from langchain_utils import extract_text_from_pdf, extract_page_text, mcq_quiz_generator, chat_with_document, summarize_page
+from langchain_utils import llm_flights, iter_extracted_pages, extract_page_text, extract_pages_text, generate_quiz_cached, generate_quizzes_cached, chat_with_document, stream_chat_with_document, summarize_page, quiz_cache_key, summary_cache_key, QUIZ_MIN_WORDS, CHAT_ERROR_REPLY
+from extraction_jobs import ExtractionJobQueue
+import precompute
+from page_cache import hot_pages
+from retrieval import refresh_index_async, search_document
+from context_packer import CHAT_CONTEXT_TOKENS, CHAT_CURRENT_PAGE_TOKENS, ContextPacker
+from single_flight import SingleFlight
+from search_index import SEARCH_MAX_RESULTS, get_lexical_index, make_snippet
+from page_store import PageStore, PageStoreError
 from logger import get_logger
 from dotenv import load_dotenv
 
@@ -367,7 +375,6 @@ ai_logger = get_logger('AI')
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx'}
-EXTRACTION_CACHE_SUFFIX = '.pages.json'
 UNRESOLVED_TEXT_LAYER_SENTINEL = '[[DOCSENSEI_UNRESOLVED_TEXT_LAYER]]'
 
 app = Flask(__name__)
@@ -382,6 +389,21 @@ EXTRACTION_BATCH_TIME_BUDGET_SEC = max(
     2.0,
     float(os.environ.get('EXTRACTION_BATCH_TIME_BUDGET_SEC', '12')),
 )
+EXTRACTION_CACHE_FLUSH_PAGES = max(1, int(os.environ.get('EXTRACTION_CACHE_FLUSH_PAGES', '8')))
+# Background /extract jobs are not bound to a request, so they get a much larger budget.
+EXTRACTION_JOB_TIME_BUDGET_SEC = max(
+    5.0,
+    float(os.environ.get('EXTRACTION_JOB_TIME_BUDGET_SEC', '600')),
+)
+# A blocking /extract that finds a background job running waits this long for it, then
+# answers 202 with the job's status; it must stay well under gunicorn's 240s timeout.
+EXTRACTION_JOB_WAIT_SEC = max(1.0, float(os.environ.get('EXTRACTION_JOB_WAIT_SEC', '60')))
+# Queue summaries/quizzes for the first pages as soon as a document is extracted.
+PRECOMPUTE_ON_EXTRACT = os.environ.get('PRECOMPUTE_ON_EXTRACT', 'true').lower() == 'true'
+# Pages per /generate-quiz-batch request.
+QUIZ_BATCH_MAX_PAGES = max(1, int(os.environ.get('QUIZ_BATCH_MAX_PAGES', '50')))
+# /chat requests that carry a fileUrl are grounded on the document's retrieval index.
+RETRIEVAL_ENABLED = os.environ.get('RETRIEVAL_ENABLED', 'true').lower() == 'true'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB
 
@@ -432,32 +454,91 @@ def resolve_uploaded_file_path(file_url):
     return os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
 
-def get_extraction_cache_path(file_path):
-    return f'{file_path}{EXTRACTION_CACHE_SUFFIX}'
+def get_page_store(file_path):
+    # Deferred pages ('') rank below pages whose text layer was tried and left unresolved.
+    store = PageStore(file_path, placeholders=('', UNRESOLVED_TEXT_LAYER_SENTINEL))
+    if not store.exists():
+        store.import_legacy_json()
+    return store
 
 
 def load_extraction_cache(file_path):
-    cache_path = get_extraction_cache_path(file_path)
-    if not os.path.exists(cache_path):
-        return None
+    """All cached pages, or None unless an extraction has finished writing them."""
+    pages, _ = load_cached_page_range(file_path, 1, None, complete_only=True)
+    return pages
+
+
+def load_cached_page_range(file_path, start_page, end_page, complete_only=False):
+    """
+    Cached texts of pages [start_page, end_page] (1-based, end_page=None for the rest of
+    the document) and the page count, or (None, None). Served from the in-process hot
+    page cache when possible. With complete_only, a store an extraction is still
+    flushing into (or crashed while flushing) counts as not cached.
+    """
     try:
-        with open(cache_path, 'r', encoding='utf-8') as cache_file:
-            cached_payload = json.load(cache_file)
-        pages = cached_payload.get('pages')
-        if isinstance(pages, list) and all(isinstance(page, str) for page in pages):
-            return pages
-    except (OSError, json.JSONDecodeError) as exc:
+        store = get_page_store(file_path)
+        # Signature before pages: a write that lands mid-read changes the signature, so the
+        # pages cached below are dropped on the next lookup rather than served stale.
+        state = store.state()
+        if state is None:
+            return None, None
+        signature, complete = state
+        if complete_only and not complete:
+            return None, None
+        doc_key = os.path.abspath(file_path)
+        cached = hot_pages.get_range(doc_key, signature, start_page - 1, end_page)
+        if cached is not None:
+            return cached
+        total_pages = store.page_count()
+        if total_pages is None:
+            return None, None
+        pages = store.read_page_range(start_page - 1, end_page)
+        hot_pages.put_range(doc_key, signature, start_page - 1, pages, total_pages)
+        return pages, total_pages
+    except (OSError, UnicodeDecodeError, PageStoreError) as exc:
         system_logger.warning('Failed to read extraction cache for %s: %s', file_path, exc)
-    return None
+    return None, None
 
 
-def save_extraction_cache(file_path, pages):
-    cache_path = get_extraction_cache_path(file_path)
+def save_extraction_cache(file_path, pages, complete=True):
     try:
-        with open(cache_path, 'w', encoding='utf-8') as cache_file:
-            json.dump({'pages': pages}, cache_file, ensure_ascii=False)
-    except OSError as exc:
+        get_page_store(file_path).write_pages(pages, complete)
+    except (OSError, UnicodeDecodeError, PageStoreError) as exc:
         system_logger.warning('Failed to write extraction cache for %s: %s', file_path, exc)
+    hot_pages.invalidate(os.path.abspath(file_path))
+
+
+def update_extraction_cache(file_path, updates, complete=None):
+    """
+    Write {page_index: text} into an existing cache without rewriting the other pages;
+    `complete` is passed to PageStore.update_pages.
+    """
+    updated = False
+    try:
+        updated = get_page_store(file_path).update_pages(updates, complete)
+    except (OSError, IndexError, PageStoreError) as exc:
+        system_logger.warning('Failed to update extraction cache for %s: %s', file_path, exc)
+    hot_pages.invalidate(os.path.abspath(file_path))
+    if updated and RETRIEVAL_ENABLED:
+        refresh_index_async(file_path, lambda known: read_changed_client_pages(file_path, known))
+    return updated
+
+
+def read_changed_client_pages(file_path, known_records=None):
+    """PageStore.read_changed_pages with texts as the client sees them (retrieval indexing)."""
+    changes = get_page_store(file_path).read_changed_pages(known_records)
+    if changes is None:
+        return None
+    records, texts = changes
+    return records, {page_index: to_client_page_text(text) for page_index, text in texts.items()}
+
+
+def delete_extraction_cache(file_path):
+    try:
+        get_page_store(file_path).delete()
+    except OSError as exc:
+        system_logger.warning('Failed to delete extraction cache for %s: %s', file_path, exc)
+    hot_pages.invalidate(os.path.abspath(file_path))
 
 
 def is_successful_extraction(pages):
@@ -483,6 +564,223 @@ def to_client_pages(pages):
         return []
     return [to_client_page_text(page) for page in pages]
 
+
+def iter_and_cache_extraction(file_path, time_budget_sec=None):
+    """
+    Wrap iter_extracted_pages, writing the extraction cache incrementally: the page
+    store is created at the first flush and then updated in place every
+    EXTRACTION_CACHE_FLUSH_PAGES pages and once more when extraction finishes.
+    The store stays marked incomplete until that last flush, so load_extraction_cache
+    never serves a partly extracted document as a cached result.
+    Yields (page_index, page_text, total_pages) as they arrive.
+    """
+    pages = []
+    unflushed = {}
+    store_created = False
+
+    def flush(final=False):
+        nonlocal store_created
+        if not store_created:
+            save_extraction_cache(file_path, pages, complete=final)
+            store_created = True
+        else:
+            update_extraction_cache(file_path, unflushed, complete=True if final else None)
+        unflushed.clear()
+
+    for idx, page_text, total_pages in iter_extracted_pages(file_path, time_budget_sec):
+        if len(pages) != total_pages:
+            pages = [''] * total_pages
+            store_created = False
+        pages[idx] = page_text
+        unflushed[idx] = page_text
+        yield idx, page_text, total_pages
+        if len(unflushed) >= EXTRACTION_CACHE_FLUSH_PAGES and is_successful_extraction(pages):
+            flush()
+
+    if is_successful_extraction(pages):
+        flush(final=True)
+        ai_logger.info('Extraction cache saved for %s (pages=%d)', file_path, len(pages))
+        if RETRIEVAL_ENABLED:
+            refresh_index_async(file_path, lambda known: read_changed_client_pages(file_path, known), build=True)
+        if PRECOMPUTE_ON_EXTRACT:
+            precompute.schedule_pages(to_client_pages(pages))
+    else:
+        if store_created:
+            delete_extraction_cache(file_path)
+        ai_logger.warning('Extraction returned errors for %s; skipping cache write', file_path)
+
+
+# Concurrent requests for the same upload's extraction share one run (see single_flight.py).
+extraction_flights = SingleFlight('extraction')
+
+
+def extraction_flight_key(file_path):
+    return ('extract', get_extraction_job_id(file_path))
+
+
+def extract_and_cache_pages(file_path):
+    content = []
+    for idx, page_text, total_pages in iter_and_cache_extraction(file_path):
+        if len(content) != total_pages:
+            content = [''] * total_pages
+        content[idx] = page_text
+    return content
+
+
+def extract_document_pages(file_path):
+    """
+    (pages, shared): the full extraction of `file_path`, cached on success. A request
+    that arrives while the same upload is being extracted waits for that run.
+    """
+    content, shared = extraction_flights.do(extraction_flight_key(file_path), extract_and_cache_pages, file_path)
+    if content is None:
+        # The run we joined was a streamed extraction whose client went away.
+        content, shared = extract_and_cache_pages(file_path), False
+    return content, shared
+
+
+def run_extraction_job(job):
+    """
+    Extract in the background, persisting the cache as pages finish. The job shares
+    the upload's extraction flight with /extract requests: if a request is already
+    extracting it, the job waits for that run instead of starting a second one.
+    """
+    flight_key = extraction_flight_key(job.file_path)
+    while True:
+        future, leader = extraction_flights.claim(flight_key)
+        if leader:
+            break
+        ai_logger.info('Extraction job %s waits for the extraction already in flight', job.id)
+        content = future.result()
+        if content is not None:
+            job.record_progress(len(content), len(content))
+            raise_extraction_error(content)
+            return
+        # The run we joined was a streamed extraction whose client went away.
+
+    content = []
+    pages_done = 0
+    try:
+        for idx, page_text, total_pages in iter_and_cache_extraction(job.file_path, EXTRACTION_JOB_TIME_BUDGET_SEC):
+            if len(content) != total_pages:
+                content = [''] * total_pages
+            content[idx] = page_text
+            pages_done += 1
+            job.record_progress(total_pages, pages_done)
+    except BaseException as exc:
+        extraction_flights.release(flight_key, future, error=exc)
+        raise
+    extraction_flights.release(flight_key, future, content)
+    raise_extraction_error(content)
+
+
+def raise_extraction_error(pages):
+    for page_text in pages:
+        if page_text.startswith('[Error '):
+            raise RuntimeError(page_text)
+
+
+def to_ndjson_line(payload):
+    return json.dumps(payload, ensure_ascii=False) + '\n'
+
+
+def cached_page_lines(pages):
+    for idx, page_text in enumerate(pages):
+        yield to_ndjson_line({
+            'type': 'page',
+            'pageNumber': idx + 1,
+            'totalPages': len(pages),
+            'text': to_client_page_text(page_text),
+        })
+    yield to_ndjson_line({'type': 'done', 'totalPages': len(pages), 'cached': True})
+
+
+def stream_extraction(file_path, endpoint_start):
+    """NDJSON body for /extract {'stream': true}: one 'page' line per page, then a 'done' line."""
+    cached_pages = load_extraction_cache(file_path)
+    if cached_pages is not None:
+        yield from cached_page_lines(cached_pages)
+        return
+
+    flight_key = extraction_flight_key(file_path)
+    future, leader = extraction_flights.claim(flight_key)
+    if not leader:
+        ai_logger.info('Streaming extraction of %s waits for the run already in flight', file_path)
+        try:
+            future.result()
+        except Exception:
+            pass
+        cached_pages = load_extraction_cache(file_path)
+        if cached_pages is not None:
+            yield from cached_page_lines(cached_pages)
+            return
+
+    content = []
+    finished = False
+    try:
+        yield from stream_fresh_extraction(file_path, endpoint_start, content)
+        finished = True
+    finally:
+        if leader:
+            # An abandoned stream hands followers None so they extract themselves.
+            extraction_flights.release(flight_key, future, content if finished else None)
+
+
+def stream_fresh_extraction(file_path, endpoint_start, content):
+    total = 0
+    first_page_logged = False
+    error = None
+    for idx, page_text, total_pages in iter_and_cache_extraction(file_path):
+        total = total_pages
+        if len(content) != total_pages:
+            content[:] = [''] * total_pages
+        content[idx] = page_text
+        if page_text.startswith('[Error '):
+            error = page_text
+        if not first_page_logged:
+            first_page_logged = True
+            ai_logger.info('Streaming extraction first page ready for %s (elapsed=%.2fs)',
+                           file_path, time.monotonic() - endpoint_start)
+        yield to_ndjson_line({'type': 'page', 'pageNumber': idx + 1, 'totalPages': total_pages, 'text': page_text})
+
+    ai_logger.info(
+        'Streaming extraction complete for %s (pages=%d, elapsed=%.2fs)',
+        file_path,
+        total,
+        time.monotonic() - endpoint_start,
+    )
+    done = {'type': 'done', 'totalPages': total, 'cached': False}
+    if error:
+        done['error'] = error
+    yield to_ndjson_line(done)
+
+
+extraction_jobs = ExtractionJobQueue(run_extraction_job)
+
+
+def get_extraction_job_id(file_path):
+    return os.path.basename(file_path)
+
+
+def cached_extraction_status(job_id, pages):
+    # Every page of a complete store has been through extraction, including blank ones.
+    return {
+        'jobId': job_id,
+        'status': 'done',
+        'totalPages': len(pages),
+        'pagesDone': len(pages),
+        'pagesPending': 0,
+        'error': None,
+        'cached': True,
+    }
+
+
+def extraction_job_accepted(job):
+    """202 response with a job's status and the URL to poll it at."""
+    payload = job.to_dict()
+    payload['statusUrl'] = url_for('extraction_status', job_id=job.id, _external=True)
+    return jsonify(payload), 202
+
 # Serve uploaded files
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
@@ -571,6 +869,30 @@ def extract_content():
         file_size_bytes / (1024 * 1024) if file_size_bytes else 0,
     )
 
+    job_id = get_extraction_job_id(file_path)
+    if bool(data.get('background', False)):
+        active_job = extraction_jobs.active_job(job_id)
+        if active_job is None:
+            cached_pages = load_extraction_cache(file_path)
+            if cached_pages is not None:
+                return jsonify(cached_extraction_status(job_id, cached_pages))
+        return extraction_job_accepted(active_job or extraction_jobs.submit(job_id, file_path))
+
+    active_job = extraction_jobs.active_job(job_id)
+    if active_job is not None:
+        ai_logger.info('Waiting for running extraction job %s before serving %s', job_id, file_path)
+        if not active_job.wait(EXTRACTION_JOB_WAIT_SEC):
+            ai_logger.info('Extraction job %s still running after %.0fs; returning its status',
+                           job_id, EXTRACTION_JOB_WAIT_SEC)
+            return extraction_job_accepted(active_job)
+
+    if bool(data.get('stream', False)):
+        return Response(
+            stream_with_context(stream_extraction(file_path, endpoint_start)),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
     cached_pages = load_extraction_cache(file_path)
     if cached_pages is not None:
         ai_logger.info(
@@ -582,35 +904,170 @@ def extract_content():
         return jsonify({'pages': to_client_pages(cached_pages), 'cached': True})
 
     ai_logger.info('Extracting content from %s', file_path)
-    content = extract_text_from_pdf(file_path)
-
-    if is_successful_extraction(content):
-        save_extraction_cache(file_path, content)
-        ai_logger.info('Extraction cache saved for %s (pages=%d)', file_path, len(content))
-    else:
-        ai_logger.warning('Extraction returned errors for %s; skipping cache write', file_path)
+    content, shared = extract_document_pages(file_path)
 
     ai_logger.info(
-        'Extraction complete for %s (pages=%d, elapsed=%.2fs)',
+        'Extraction complete for %s (pages=%d, shared=%s, elapsed=%.2fs)',
         file_path,
         len(content),
+        shared,
         time.monotonic() - endpoint_start,
     )
     return jsonify({'pages': content, 'cached': False})
 
-@app.route('/generate-quiz', methods=['POST'])
-def generate_quiz():
+
+@app.route('/extract-status/<job_id>', methods=['GET'])
+def extraction_status(job_id):
+    """Progress of a background extraction started with /extract {'background': true}."""
+    job_id = secure_filename(job_id)
+    if not job_id:
+        return jsonify({'error': 'Invalid job id'}), 400
+
+    job = extraction_jobs.get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict())
+
+    # Jobs live in one worker's memory; any worker can still report a finished cache.
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+    cached_pages = load_extraction_cache(file_path)
+    if cached_pages is not None:
+        return jsonify(cached_extraction_status(job_id, cached_pages))
+    _, total_pages = load_cached_page_range(file_path, 1, 1)
+    if total_pages is not None:
+        # An extraction elsewhere is still flushing pages into the store.
+        return jsonify({
+            'jobId': job_id,
+            'status': 'running',
+            'totalPages': total_pages,
+            'pagesDone': None,
+            'pagesPending': None,
+            'error': None,
+            'cached': False,
+        })
+    return jsonify({'error': 'Unknown extraction job'}), 404
+
+
+@app.route('/precompute', methods=['POST'])
+def precompute_document():
     data = request.json or {}
-    pages = data.get('pages')
-    page_content = data.get('pageContent')
-    page_number = data.get('pageNumber')
-    document_id = data.get('documentId')
+    file_url = data.get('fileUrl')
+    file_path = resolve_uploaded_file_path(file_url)
+    if not file_path or not os.path.exists(file_path):
+        ai_logger.error('Precompute failed: file not found for fileUrl=%s', file_url)
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        page_number = max(1, int(data.get('pageNumber', 1) or 1))
+        pages_ahead = max(0, int(data.get('pagesAhead', precompute.PRECOMPUTE_PAGES_AHEAD)))
+        streak = int(data.get('streak', 0) or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'pageNumber, pagesAhead and streak must be integers'}), 400
+    whole_document = bool(data.get('wholeDocument', False))
+    is_hard_mode = data.get('isHardMode', False)
+    difficulty_level = str(data.get('difficultyLevel', 'normal') or 'normal').lower()
+
+    cached_pages = load_extraction_cache(file_path)
+    if cached_pages is None:
+        return jsonify({'error': 'Document has not been extracted yet'}), 409
+
+    # The reader is on page_number; its own quiz is next, then the pages after it.
+    scheduled = precompute.schedule_pages(
+        to_client_pages(cached_pages),
+        start_index=0 if whole_document else page_number - 1,
+        count=None if whole_document else pages_ahead + 1,
+        is_hard_mode=is_hard_mode,
+        difficulty_level=difficulty_level,
+        streak=streak,
+    )
+    ai_logger.info('Precompute scheduled for %s from page %d (whole=%s): %s',
+                   file_path, page_number, whole_document, scheduled)
+    return jsonify({'scheduled': scheduled, 'pending': precompute.scheduler.pending()}), 202
+
+
+@app.route('/search', methods=['POST'])
+def search_document_pages():
+    endpoint_start = time.perf_counter()
+    data = request.json or {}
+    query = str(data.get('query', '') or '').strip()
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    file_url = data.get('fileUrl')
+    file_path = resolve_uploaded_file_path(file_url)
+    if not file_path or not os.path.exists(file_path):
+        system_logger.error('Search failed: file not found for fileUrl=%s', file_url)
+        return jsonify({'error': 'File not found'}), 404
+    try:
+        limit = min(SEARCH_MAX_RESULTS, max(1, int(data.get('limit', 10) or 10)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        index = get_lexical_index(
+            file_path, lambda known: read_changed_client_pages(file_path, known), get_page_store(file_path).state(),
+        )
+    except PageStoreError as exc:
+        system_logger.warning('Search index not built for %s: %s', file_path, exc)
+        index = None
+    if index is None:
+        return jsonify({'error': 'Document has not been extracted yet'}), 409
+
+    search_start = time.perf_counter()
+    hits = index.search(query, limit)
+    search_ms = (time.perf_counter() - search_start) * 1000
+    results = []
+    for page_index, score, terms in hits:
+        pages, _ = load_cached_page_range(file_path, page_index + 1, page_index + 1)
+        text = to_client_page_text(pages[0]) if pages else ''
+        results.append({'pageNumber': page_index + 1, 'score': round(score, 4), 'snippet': make_snippet(text, terms)})
+    system_logger.info('Search %s: results=%d search=%.2fms total=%.2fms',
+                       file_path, len(results), search_ms, (time.perf_counter() - endpoint_start) * 1000)
+    return jsonify({'results': results, 'totalPages': index.page_count, 'searchMs': round(search_ms, 3)})
+
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'hotPages': hot_pages.stats(),
+        'singleFlight': {'extraction': extraction_flights.stats(), 'llm': llm_flights.stats()},
+    })
+
+def parse_quiz_options(data):
+    """(is_hard_mode, difficulty_level, streak, exclude_variants) from a quiz request body."""
     is_hard_mode = data.get('isHardMode', False)
     difficulty_level = str(data.get('difficultyLevel', 'normal') or 'normal').lower()
     try:
         streak = int(data.get('streak', 0) or 0)
     except (TypeError, ValueError):
         streak = 0
+    exclude_variants = data.get('excludeVariants') or []
+    if not isinstance(exclude_variants, list):
+        exclude_variants = []
+    exclude_variants = [variant for variant in exclude_variants if isinstance(variant, int)]
+    return is_hard_mode, difficulty_level, streak, exclude_variants
+
+
+def thin_page_verdict(word_count):
+    return {
+        'valid': False,
+        'result': 'Not a quizable page',
+        'validation_explanation':
+            f'This page contains only {word_count} word(s). '
+            'It is likely a section break, cover, or short intro and does not '
+            'need a quiz.'
+    }
+
+
+def parse_quiz_request(data):
+    """
+    Validate a /generate-quiz body. Returns (params, None) with the keyword arguments
+    for generate_quiz_cached, or (None, (payload, status)) when the request is answered
+    without an LLM call (missing content, thin page).
+    """
+    pages = data.get('pages')
+    page_content = data.get('pageContent')
+    page_number = data.get('pageNumber')
+    document_id = data.get('documentId')
+    is_hard_mode, difficulty_level, streak, exclude_variants = parse_quiz_options(data)
 
     ai_logger.info(
         '[generate-quiz] Request metadata: documentId=%s pageNumber=%s hasPageContent=%s pagesCount=%s isHardMode=%s difficultyLevel=%s streak=%s',
@@ -626,64 +1083,264 @@ def generate_quiz():
     if not (isinstance(page_content, str) and page_content.strip()):
         if not pages or not isinstance(pages, list):
             ai_logger.error('No page content provided for quiz generation')
-            return jsonify({'error': 'No page content provided'}), 400
+            return None, ({'error': 'No page content provided'}, 400)
 
-        idx = int(page_number) - 1 if page_number else 0
+        try:
+            idx = int(page_number) - 1 if page_number else 0
+        except (TypeError, ValueError):
+            idx = 0
         if idx < 0 or idx >= len(pages):
             page_content = pages[0]
         else:
             page_content = pages[idx]
+    if not isinstance(page_content, str):
+        page_content = ''
+
+    # Auto-skip pages that are too short to quiz (< 50 words)
+    # Saves an LLM call and avoids forcing quizzes on section breaks / cover pages
+    word_count = len(page_content.split())
+    if word_count < QUIZ_MIN_WORDS:
+        ai_logger.info(
+            'Page %s has only %d words — auto-skipping quiz (thin page)',
+            page_number, word_count
+        )
+        return None, (thin_page_verdict(word_count), 200)
 
+    ai_logger.info(
+        'Generating quiz for document %s, page %s, hardMode=%s difficultyLevel=%s streak=%s',
+        document_id,
+        page_number,
+        is_hard_mode,
+        difficulty_level,
+        streak,
+    )
+    return {
+        'page_content': page_content,
+        'is_hard_mode': is_hard_mode,
+        'difficulty_level': difficulty_level,
+        'streak': streak,
+        'exclude_variants': exclude_variants,
+    }, None
+
+
+def quiz_response(quiz, variant_id, cached):
+    ai_logger.info('Quiz generation complete (cached=%s variant=%s)', cached, variant_id)
+    if 'error' in quiz:
+        return quiz
+    return {**quiz, 'variantId': variant_id, 'cached': cached}
+
+
+def parse_quiz_batch_request(data):
+    """
+    Validate a /generate-quiz-batch body. Pages come from `pages` (page texts, as sent
+    to /generate-quiz) or from the extraction cache of `fileUrl`; `pageNumbers` picks
+    which ones (default: all). Returns (params, None) with the keyword arguments for
+    generate_quizzes_cached plus 'page_numbers' and 'thin_pages' ({page_number:
+    word_count} answered without an LLM call), or (None, (payload, status)).
+    """
+    pages = data.get('pages')
+    if not isinstance(pages, list) or not pages:
+        file_path = resolve_uploaded_file_path(data.get('fileUrl'))
+        if not file_path or not os.path.exists(file_path):
+            return None, ({'error': 'pages or a valid fileUrl is required'}, 400)
+        pages = load_extraction_cache(file_path)
+        if pages is None:
+            return None, ({'error': 'Document has not been extracted yet'}, 409)
+        pages = to_client_pages(pages)
+
+    page_numbers = data.get('pageNumbers')
+    if page_numbers is None:
+        page_numbers = list(range(1, len(pages) + 1))
     try:
-        # Auto-skip pages that are too short to quiz (< 50 words)
-        # Saves an LLM call and avoids forcing quizzes on section breaks / cover pages
-        word_count = len(page_content.split()) if page_content else 0
-        if word_count < 50:
-            ai_logger.info(
-                'Page %s has only %d words — auto-skipping quiz (thin page)',
-                page_number, word_count
-            )
-            return jsonify({
-                'valid': False,
-                'result': 'Not a quizable page',
-                'validation_explanation':
-                    f'This page contains only {word_count} word(s). '
-                    'It is likely a section break, cover, or short intro and does not '
-                    'need a quiz.'
-            })
+        page_numbers = [int(page_number) for page_number in page_numbers]
+    except (TypeError, ValueError):
+        return None, ({'error': 'pageNumbers must be a list of integers'}, 400)
+    if any(page_number < 1 or page_number > len(pages) for page_number in page_numbers):
+        return None, ({'error': f'pageNumbers out of range (1-{len(pages)})'}, 400)
+    if len(page_numbers) > QUIZ_BATCH_MAX_PAGES:
+        return None, ({'error': f'At most {QUIZ_BATCH_MAX_PAGES} pages per batch'}, 400)
+
+    is_hard_mode, difficulty_level, streak, exclude_variants = parse_quiz_options(data)
+    page_contents = []
+    quiz_page_numbers = []
+    thin_pages = {}
+    for page_number in page_numbers:
+        page_content = pages[page_number - 1] if isinstance(pages[page_number - 1], str) else ''
+        word_count = len(page_content.split())
+        if word_count < QUIZ_MIN_WORDS:
+            thin_pages[page_number] = word_count
+        else:
+            page_contents.append(page_content)
+            quiz_page_numbers.append(page_number)
+    ai_logger.info(
+        'Generating quiz batch: pages=%d thin=%d hardMode=%s difficultyLevel=%s streak=%s',
+        len(page_numbers), len(thin_pages), is_hard_mode, difficulty_level, streak,
+    )
+    return {
+        'page_contents': page_contents,
+        'is_hard_mode': is_hard_mode,
+        'difficulty_level': difficulty_level,
+        'streak': streak,
+        'exclude_variants': exclude_variants,
+        'page_numbers': page_numbers,
+        'quiz_page_numbers': quiz_page_numbers,
+        'thin_pages': thin_pages,
+    }, None
+
+
+def split_quiz_batch_params(params):
+    """(generate_quizzes_cached kwargs, page_numbers, quiz_page_numbers, thin_pages)."""
+    params = dict(params)
+    return params, params.pop('page_numbers'), params.pop('quiz_page_numbers'), params.pop('thin_pages')
+
+
+def quiz_batch_response(page_numbers, quiz_page_numbers, thin_pages, results):
+    by_page = dict(zip(quiz_page_numbers, results))
+    quizzes = []
+    for page_number in page_numbers:
+        if page_number in thin_pages:
+            quiz = thin_page_verdict(thin_pages[page_number])
+        else:
+            quiz = quiz_response(*by_page[page_number])
+        quizzes.append({'pageNumber': page_number, **quiz})
+    return {'quizzes': quizzes}
+
+
+def build_retrieval_context(file_path, message, page_context):
+    """
+    Chat context grounded on the whole document: the page on screen, up to
+    CHAT_CURRENT_PAGE_TOKENS, then the passages of the document most relevant to
+    `message` in the rest of the CHAT_CONTEXT_TOKENS budget. None if the document has
+    no index yet or no passage matches, in which case chat uses the page alone.
+    """
+    try:
+        results = search_document(file_path, message, lambda known: read_changed_client_pages(file_path, known))
+    except Exception as exc:
+        ai_logger.warning('Retrieval failed for %s: %s', file_path, exc)
+        return None
+    if not results:
+        return None
 
-        ai_logger.info(
-            'Generating quiz for document %s, page %s, hardMode=%s difficultyLevel=%s streak=%s',
-            document_id,
-            page_number,
-            is_hard_mode,
-            difficulty_level,
-            streak,
+    packer = ContextPacker(CHAT_CONTEXT_TOKENS)
+    sections = []
+    page_context = packer.add_text('page', ' '.join((page_context or '').split()), CHAT_CURRENT_PAGE_TOKENS)
+    if page_context:
+        sections.append(f'Current page (excerpt):\n{page_context}')
+    sections.append(packer.add_fixed('heading', 'Relevant passages from the document:'))
+    sections.extend(packer.add_passages(
+        'passages', [f'[Page {page_index + 1}] {text}' for _, page_index, text in results],
+    ))
+    ai_logger.info('Chat grounded on %s: pages=%s tokens=%s', file_path,
+                   [page_index + 1 for _, page_index, _ in results], packer.usage)
+    return '\n\n'.join(sections)
+
+
+def parse_chat_request(data):
+    """Returns (args for chat_with_document, None) or (None, (payload, status))."""
+    message = data.get('message', '').strip()
+    context = data.get('context', '')
+    document_name = data.get('documentName', 'document')
+    history = data.get('history', [])
+    if not message:
+        return None, ({'error': 'No message provided'}, 400)
+    file_path = resolve_uploaded_file_path(data.get('fileUrl'))
+    if RETRIEVAL_ENABLED and file_path and os.path.exists(file_path):
+        retrieved = build_retrieval_context(file_path, message, context)
+        if retrieved:
+            return (message, retrieved, document_name, history, 'Document context'), None
+    return (message, context, document_name, history), None
+
+
+def to_sse_event(payload, event=None):
+    lines = f'event: {event}\n' if event else ''
+    return lines + f'data: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+
+def stream_chat_events(chunks):
+    """
+    SSE body for /chat {'stream': true}: one {"token"} event per chunk, then a 'done'
+    event carrying the full response, or an 'error' event if the model fails midway.
+    """
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield to_sse_event({'token': chunk})
+    except Exception as e:
+        ai_logger.error('Chat stream failed after %d chunk(s): %s', len(parts), e)
+        yield to_sse_event({'error': CHAT_ERROR_REPLY}, event='error')
+        return
+    yield to_sse_event({'response': ''.join(parts)}, event='done')
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def parse_summary_request(data):
+    """Returns (page_content, None) or (None, (payload, status))."""
+    pages = data.get('pages')
+    page_number = data.get('pageNumber')
+    if not pages or not isinstance(pages, list):
+        return None, ({'error': 'No pages provided'}, 400)
+    try:
+        idx = int(page_number) - 1 if page_number else 0
+    except (TypeError, ValueError):
+        idx = 0
+    if idx < 0 or idx >= len(pages):
+        idx = 0
+    page_content = pages[idx] if isinstance(pages[idx], str) else ''
+    ai_logger.info('Generating summary for page %s', page_number)
+    return page_content, None
+
+
+@app.route('/generate-quiz', methods=['POST'])
+def generate_quiz():
+    params, early_response = parse_quiz_request(request.json or {})
+    if early_response is not None:
+        return jsonify(early_response[0]), early_response[1]
+    try:
+        # Learning Mode usually asks for a page that is already being prefetched.
+        key = quiz_cache_key(
+            params['page_content'], params['is_hard_mode'], params['difficulty_level'], params['streak'],
         )
-        quiz = mcq_quiz_generator(
-            page_content,
-            is_hard_mode=is_hard_mode,
-            difficulty_level=difficulty_level,
-            streak=streak,
+        precompute.wait_for_quiz(
+            params['page_content'], params['is_hard_mode'], params['difficulty_level'], params['streak'], key=key,
         )
-        ai_logger.info('Quiz generation complete')
-        return jsonify(quiz)
+        quiz, variant_id, cached = generate_quiz_cached(**params, key=key)
+        return jsonify(quiz_response(quiz, variant_id, cached))
     except Exception as e:
         ai_logger.error('Quiz generation failed: %s', e)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/generate-quiz-batch', methods=['POST'])
+def generate_quiz_batch():
+    params, early_response = parse_quiz_batch_request(request.json or {})
+    if early_response is not None:
+        return jsonify(early_response[0]), early_response[1]
+    kwargs, page_numbers, quiz_page_numbers, thin_pages = split_quiz_batch_params(params)
+    try:
+        results = generate_quizzes_cached(**kwargs)
+        return jsonify(quiz_batch_response(page_numbers, quiz_page_numbers, thin_pages, results))
+    except Exception as e:
+        ai_logger.error('Quiz batch generation failed: %s', e)
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.json or {}
-    message = data.get('message', '').strip()
-    context = data.get('context', '')
-    document_name = data.get('documentName', 'document')
-    history = data.get('history', [])
-    if not message:
-        return jsonify({'error': 'No message provided'}), 400
+    chat_args, early_response = parse_chat_request(data)
+    if early_response is not None:
+        return jsonify(early_response[0]), early_response[1]
+    if data.get('stream'):
+        return Response(
+            stream_with_context(stream_chat_events(stream_chat_with_document(*chat_args))),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS,
+        )
     try:
-        response = chat_with_document(message, context, document_name, history)
+        response = chat_with_document(*chat_args)
         ai_logger.info('Chat response generated successfully')
         return jsonify({'response': response})
     except Exception as e:
@@ -721,35 +1378,32 @@ def extract_page():
     if not os.path.exists(file_path):
         return jsonify({'error': 'File not found'}), 404
 
-    cached_pages = load_extraction_cache(file_path)
-    if cached_pages is not None and 1 <= page_number_int <= len(cached_pages):
-        cached_text = cached_pages[page_number_int - 1]
-        if isinstance(cached_text, str) and cached_text.strip() and not is_unresolved_text_marker(cached_text):
-            ai_logger.info(
-                'Single-page extraction served from cache: file=%s page=%s chars=%d elapsed=%.2fs',
-                file_path,
-                page_number_int,
-                len(cached_text),
-                time.monotonic() - endpoint_start,
-            )
-            return jsonify({'text': cached_text, 'pageNumber': page_number_int, 'source': 'cache'})
+    cached_range, total_cached_pages = load_cached_page_range(file_path, page_number_int, page_number_int)
+    cached_text = cached_range[0] if cached_range else None
+    if isinstance(cached_text, str) and cached_text.strip() and not is_unresolved_text_marker(cached_text):
+        ai_logger.info(
+            'Single-page extraction served from cache: file=%s page=%s chars=%d elapsed=%.2fs',
+            file_path,
+            page_number_int,
+            len(cached_text),
+            time.monotonic() - endpoint_start,
+        )
+        return jsonify({'text': cached_text, 'pageNumber': page_number_int, 'source': 'cache'})
 
     ai_logger.info('Single-page extraction requested: file=%s page=%s', file_path, page_number_int)
     try:
-        text = extract_page_text(file_path, page_number_int)
+        text, _ = extraction_flights.do(
+            ('extract-page', get_extraction_job_id(file_path), page_number_int),
+            extract_page_text, file_path, page_number_int,
+        )
 
         if (
-            cached_pages is not None
-            and 1 <= page_number_int <= len(cached_pages)
+            cached_text is not None
             and isinstance(text, str)
             and text.strip()
-            and (
-                not cached_pages[page_number_int - 1].strip()
-                or is_unresolved_text_marker(cached_pages[page_number_int - 1])
-            )
+            and (not cached_text.strip() or is_unresolved_text_marker(cached_text))
         ):
-            cached_pages[page_number_int - 1] = text
-            save_extraction_cache(file_path, cached_pages)
+            update_extraction_cache(file_path, {page_number_int - 1: text})
             ai_logger.info('Updated extraction cache with single-page content: file=%s page=%s', file_path, page_number_int)
 
         ai_logger.info(
@@ -802,25 +1456,55 @@ def extract_pages_batch():
     )
 
     try:
-        cached_pages = load_extraction_cache(file_path)
-        if cached_pages is None:
+        end_page_int = start_page_int + batch_size_int - 1
+        batch_pages, total_pages = load_cached_page_range(file_path, start_page_int, end_page_int)
+        if batch_pages is None:
             ai_logger.info('No extraction cache found for %s during batch request; extracting baseline', file_path)
-            cached_pages = extract_text_from_pdf(file_path)
-            if is_successful_extraction(cached_pages):
-                save_extraction_cache(file_path, cached_pages)
+            baseline_pages, _ = extract_document_pages(file_path)
+            total_pages = len(baseline_pages)
+            batch_pages = baseline_pages[start_page_int - 1:end_page_int]
 
-        total_pages = len(cached_pages)
         if total_pages == 0:
             return jsonify({'error': 'No pages found'}), 400
         if start_page_int > total_pages:
             return jsonify({'error': f'startPage out of range (1-{total_pages})'}), 400
 
-        end_page_int = min(total_pages, start_page_int + batch_size_int - 1)
+        end_page_int = min(total_pages, end_page_int)
         result_pages = []
         timed_out = False
+        deadline = endpoint_start + EXTRACTION_BATCH_TIME_BUDGET_SEC
+
+        # Pages that still need work are extracted in one call so their OCR runs concurrently.
+        pending_pages = [
+            page_no for page_no in range(start_page_int, end_page_int + 1)
+            if not is_unresolved_text_marker(batch_pages[page_no - start_page_int])
+            and not batch_pages[page_no - start_page_int].strip()
+        ]
+        extracted_pages = {}
+        if pending_pages and time.monotonic() < deadline:
+            extracted_pages, _ = extraction_flights.do(
+                ('extract-pages', get_extraction_job_id(file_path), tuple(pending_pages), text_layer_only),
+                extract_pages_text,
+                file_path,
+                pending_pages,
+                allow_vision=not text_layer_only,
+                deadline=deadline,
+            )
 
+        cache_updates = {}
         for page_no in range(start_page_int, end_page_int + 1):
-            if time.monotonic() - endpoint_start >= EXTRACTION_BATCH_TIME_BUDGET_SEC:
+            idx = page_no - 1
+            existing_text = batch_pages[page_no - start_page_int]
+
+            if is_unresolved_text_marker(existing_text):
+                result_pages.append({'pageNumber': page_no, 'text': '', 'source': 'unresolved'})
+                continue
+
+            if isinstance(existing_text, str) and existing_text.strip():
+                result_pages.append({'pageNumber': page_no, 'text': to_client_page_text(existing_text), 'source': 'cache'})
+                continue
+
+            if page_no not in extracted_pages:
                 timed_out = True
                 ai_logger.warning(
                     'Batch extraction time budget reached: file=%s start=%d current=%d elapsed=%.2fs budget=%.2fs',
@@ -832,27 +1516,16 @@ def extract_pages_batch():
                 )
                 break
 
-            idx = page_no - 1
-            existing_text = cached_pages[idx] if idx < len(cached_pages) else ''
-
-            if is_unresolved_text_marker(existing_text):
-                result_pages.append({'pageNumber': page_no, 'text': '', 'source': 'unresolved'})
-                continue
-
-            if isinstance(existing_text, str) and existing_text.strip():
-                result_pages.append({'pageNumber': page_no, 'text': to_client_page_text(existing_text), 'source': 'cache'})
-                continue
-
-            page_text = extract_page_text(file_path, page_no, allow_vision=not text_layer_only)
+            page_text = extracted_pages[page_no]
             if isinstance(page_text, str) and page_text.strip():
-                cached_pages[idx] = page_text
+                cache_updates[idx] = page_text
                 result_pages.append({'pageNumber': page_no, 'text': page_text, 'source': 'hydrated'})
             else:
                 # Mark unresolved text-layer pages so later batch passes skip redundant work.
-                cached_pages[idx] = UNRESOLVED_TEXT_LAYER_SENTINEL
+                cache_updates[idx] = UNRESOLVED_TEXT_LAYER_SENTINEL
                 result_pages.append({'pageNumber': page_no, 'text': '', 'source': 'unresolved'})
 
-        save_extraction_cache(file_path, cached_pages)
+        update_extraction_cache(file_path, cache_updates)
         ai_logger.info(
             'Batch extraction complete: file=%s start=%d end=%d elapsed=%.2fs',
             file_path,
@@ -876,18 +1549,13 @@ def extract_pages_batch():
 
 @app.route('/summarize', methods=['POST'])
 def summarize():
-    data = request.json or {}
-    pages = data.get('pages')
-    page_number = data.get('pageNumber')
-    if not pages or not isinstance(pages, list):
-        return jsonify({'error': 'No pages provided'}), 400
+    page_content, early_response = parse_summary_request(request.json or {})
+    if early_response is not None:
+        return jsonify(early_response[0]), early_response[1]
     try:
-        idx = int(page_number) - 1 if page_number else 0
-        if idx < 0 or idx >= len(pages):
-            idx = 0
-        page_content = pages[idx]
-        ai_logger.info('Generating summary for page %s', page_number)
-        summary = summarize_page(page_content)
+        key = summary_cache_key(page_content)
+        precompute.wait_for_summary(page_content, key=key)
+        summary = summarize_page(page_content, key=key)
         return jsonify(summary)
     except Exception as e:
         ai_logger.error('Summary generation failed: %s', e)
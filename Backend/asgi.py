@@ -0,0 +1,297 @@
+# asgi.py
+"""
+ASGI entry point: async LLM endpoints in front of the Flask app.
+
+POST /chat, /generate-quiz, /generate-quiz-batch and /summarize are served on the event loop with the
+`a*` variants from langchain_utils (ainvoke), so one worker multiplexes many
+in-flight LLM calls instead of pinning a gunicorn thread to each. At most
+ASYNC_LLM_MAX_CONCURRENCY of them run at once per worker, and each request is cut
+off after ASYNC_LLM_TIMEOUT_SEC (504). Request parsing and responses are shared
+with the Flask views, so both paths behave the same. Every other route (uploads,
+extraction, streaming) goes to the Flask app on a thread pool via a2wsgi.
+/chat with {"stream": true} is answered as server-sent events from astream; the
+stream holds its concurrency slot until it ends and shares the same time limit;
+if the client disconnects, the model stream is closed and the slot freed at once.
+
+Run with:  gunicorn -k uvicorn_worker.UvicornWorker asgi:app
+"""
+import asyncio
+import json
+import os
+
+from a2wsgi import WSGIMiddleware
+
+import precompute
+from app import (
+    SSE_HEADERS,
+    app as flask_app,
+    parse_chat_request,
+    parse_quiz_batch_request,
+    parse_quiz_request,
+    parse_summary_request,
+    quiz_batch_response,
+    quiz_response,
+    split_quiz_batch_params,
+    to_sse_event,
+)
+from langchain_utils import (
+    CHAT_ERROR_REPLY,
+    achat_with_document,
+    agenerate_quiz_cached,
+    agenerate_quizzes_cached,
+    astream_chat_with_document,
+    asummarize_page,
+    quiz_cache_key,
+    summary_cache_key,
+)
+from logger import get_logger
+
+system_logger = get_logger('SYSTEM')
+ai_logger = get_logger('AI')
+
+ASYNC_LLM_MAX_CONCURRENCY = max(1, int(os.environ.get('ASYNC_LLM_MAX_CONCURRENCY', '32')))
+ASYNC_LLM_TIMEOUT_SEC = max(1.0, float(os.environ.get('ASYNC_LLM_TIMEOUT_SEC', '90')))
+# Threads for the synchronous Flask routes (the old gunicorn --threads).
+WSGI_THREADS = max(1, int(os.environ.get('WSGI_THREADS', '4')))
+
+_wsgi_app = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+_llm_slots = None
+
+
+def _get_llm_slots():
+    # Created lazily so the semaphore belongs to the worker's running loop.
+    global _llm_slots
+    if _llm_slots is None:
+        _llm_slots = asyncio.Semaphore(ASYNC_LLM_MAX_CONCURRENCY)
+    return _llm_slots
+
+
+async def _chat(data):
+    # Retrieval reads the page store and embeds the question; keep it off the event loop.
+    chat_args, early_response = await asyncio.to_thread(parse_chat_request, data)
+    if early_response is not None:
+        return early_response
+    response = await achat_with_document(*chat_args)
+    return {'response': response}, 200
+
+
+async def _generate_quiz(data):
+    # Parsing counts the page's words and the cache key tokenizes it; keep both off the event loop.
+    params, early_response = await asyncio.to_thread(parse_quiz_request, data)
+    if early_response is not None:
+        return early_response
+    key = await asyncio.to_thread(
+        quiz_cache_key, params['page_content'], params['is_hard_mode'], params['difficulty_level'], params['streak'],
+    )
+    await precompute.wait_for_quiz_async(
+        params['page_content'], params['is_hard_mode'], params['difficulty_level'], params['streak'], key=key,
+    )
+    quiz, variant_id, cached = await agenerate_quiz_cached(**params, key=key)
+    return quiz_response(quiz, variant_id, cached), 200
+
+
+async def _generate_quiz_batch(data):
+    # With a fileUrl the pages are read from the extraction cache.
+    params, early_response = await asyncio.to_thread(parse_quiz_batch_request, data)
+    if early_response is not None:
+        return early_response
+    kwargs, page_numbers, quiz_page_numbers, thin_pages = split_quiz_batch_params(params)
+    results = await agenerate_quizzes_cached(**kwargs)
+    return quiz_batch_response(page_numbers, quiz_page_numbers, thin_pages, results), 200
+
+
+async def _summarize(data):
+    page_content, early_response = await asyncio.to_thread(parse_summary_request, data)
+    if early_response is not None:
+        return early_response
+    key = await asyncio.to_thread(summary_cache_key, page_content)
+    await precompute.wait_for_summary_async(page_content, key=key)
+    return await asummarize_page(page_content, key=key), 200
+
+
+async def _run_limited(handler, data):
+    async with _get_llm_slots():
+        return await handler(data)
+
+
+ASYNC_ROUTES = {
+    '/chat': _chat,
+    '/generate-quiz': _generate_quiz,
+    '/generate-quiz-batch': _generate_quiz_batch,
+    '/summarize': _summarize,
+}
+
+
+async def _read_body(receive, limit):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise ValueError('request body too large')
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _send_json(send, payload, status):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            # Same policy as the flask-cors setup in app.py.
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_for_disconnect(receive):
+    # The request body has been read, so the next message is the client going away.
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _unless_disconnected(awaitable, disconnected, timeout):
+    """
+    (True, result) of `awaitable`, or (False, None) if the client disconnects first; the
+    awaitable is then cancelled. Raises asyncio.TimeoutError after `timeout` seconds.
+    """
+    task = asyncio.ensure_future(awaitable)
+    await asyncio.wait({task, disconnected}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    # A task that finished anyway keeps its result, so an acquired slot is never lost.
+    if not task.cancelled():
+        return True, task.result()
+    if disconnected.done():
+        return False, None
+    raise asyncio.TimeoutError()
+
+
+async def _next_chunk(chunks):
+    try:
+        return True, await chunks.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def _stream_chat(send, receive, chat_args):
+    """
+    Send /chat as SSE (see app.stream_chat_events for the event format). If the client
+    disconnects, streaming stops and the model stream is closed at once rather than
+    generated to the end for nobody.
+    """
+    headers = [(b'content-type', b'text/event-stream'), (b'access-control-allow-origin', b'*')]
+    headers += [(name.lower().encode('ascii'), value.encode('ascii')) for name, value in SSE_HEADERS.items()]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+    async def send_event(payload, event=None):
+        await send({'type': 'http.response.body', 'body': to_sse_event(payload, event).encode('utf-8'), 'more_body': True})
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ASYNC_LLM_TIMEOUT_SEC
+    parts = []
+    chunks = astream_chat_with_document(*chat_args)
+    slots = _get_llm_slots()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        acquired, _ = await _unless_disconnected(slots.acquire(), disconnected, ASYNC_LLM_TIMEOUT_SEC)
+        if not acquired:
+            ai_logger.info('/chat stream client disconnected while waiting for a slot')
+            return
+        try:
+            while True:
+                connected, next_chunk = await _unless_disconnected(
+                    _next_chunk(chunks), disconnected, max(0.0, deadline - loop.time()),
+                )
+                if not connected:
+                    ai_logger.info('/chat stream client disconnected after %d chunk(s)', len(parts))
+                    return
+                more, chunk = next_chunk
+                if not more:
+                    break
+                parts.append(chunk)
+                await send_event({'token': chunk})
+        finally:
+            slots.release()
+        await send_event({'response': ''.join(parts)}, event='done')
+    except asyncio.TimeoutError:
+        ai_logger.error('/chat stream timed out after %.0fs', ASYNC_LLM_TIMEOUT_SEC)
+        await send_event({'error': 'The AI request timed out. Please try again.'}, event='error')
+    except Exception as e:
+        ai_logger.error('Chat stream failed after %d chunk(s): %s', len(parts), e)
+        await send_event({'error': CHAT_ERROR_REPLY}, event='error')
+    finally:
+        disconnected.cancel()
+        await chunks.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _handle_async_route(scope, receive, send, handler):
+    path = scope['path']
+    system_logger.info('Incoming request: method=POST path=%s (async)', path)
+    try:
+        body = await _read_body(receive, flask_app.config['MAX_CONTENT_LENGTH'])
+    except ValueError:
+        await _send_json(send, {'error': 'Request body too large'}, 413)
+        return
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        await _send_json(send, {'error': 'Invalid JSON body'}, 400)
+        return
+    if not isinstance(data, dict):
+        data = {}
+
+    if path == '/chat' and data.get('stream'):
+        chat_args, early_response = await asyncio.to_thread(parse_chat_request, data)
+        if early_response is not None:
+            await _send_json(send, *early_response)
+        else:
+            await _stream_chat(send, receive, chat_args)
+        return
+
+    try:
+        # The timeout covers waiting for a slot as well as the LLM call itself.
+        payload, status = await asyncio.wait_for(_run_limited(handler, data), ASYNC_LLM_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        ai_logger.error('%s timed out after %.0fs', path, ASYNC_LLM_TIMEOUT_SEC)
+        payload, status = {'error': 'The AI request timed out. Please try again.'}, 504
+    except Exception as e:
+        ai_logger.error('%s failed: %s', path, e)
+        payload, status = {'error': str(e)}, 500
+    await _send_json(send, payload, status)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    handler = ASYNC_ROUTES.get(scope.get('path'))
+    if scope['type'] == 'http' and scope['method'] == 'POST' and handler is not None:
+        await _handle_async_route(scope, receive, send, handler)
+        return
+    await _wsgi_app(scope, receive, send)
@@ -0,0 +1,558 @@
+# load_test.py
+"""
+End-to-end load benchmark for the backend, against the fake LLM.
+
+Starts the ASGI app (`uvicorn asgi:app`, as deployed) in a scratch working directory
+with LLM_BACKEND=fake and a private result store, so uploads, page stores, indexes
+and cached LLM results never touch Backend/uploads or a real cache. Generated PDFs
+(text, scanned-image and mixed; several copies of each so every copy is a fresh
+upload) and uploads/testpdf.pdf then go through these phases:
+
+  upload     POST /upload for every document
+  pages      /extract-page on random pages and /extract-pages batches, mixed, over
+             one copy of each document (cold, on-demand extraction)
+  extract    POST /extract for every document: cold for the other copies, served
+             from the page store for the documents the pages phase hydrated
+  llm        /generate-quiz, /summarize, /chat and streamed /chat drawn from --mix,
+             on pages picked with a skewed popularity so caches and single-flight
+             see the repeats a real audience produces
+
+Per endpoint it reports request count, errors, p50/p95/p99/mean/max latency,
+throughput over the span the endpoint was busy, and the server's RSS (main process
+plus children, sampled every 50 ms) while its requests completed. Results go to a
+JSON file that --compare can diff against a run from another commit; the exit status
+is 1 if p95 latency or throughput regressed by more than --tolerance or errors rose.
+
+Run from Backend/:  python benchmarks/load_test.py [--concurrency 16] [--llm-requests 200] [--output results.json]
+                    python benchmarks/load_test.py --compare baseline.json --output current.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PDF = os.path.join(BACKEND_DIR, 'uploads', 'testpdf.pdf')
+
+DEFAULT_MIX = 'quiz=3,summarize=3,chat=3,chat-stream=1'
+RSS_SAMPLE_SEC = 0.05
+SERVER_START_TIMEOUT_SEC = 60
+REQUEST_TIMEOUT_SEC = 300
+# Regressions smaller than this are treated as noise whatever the relative change.
+COMPARE_MIN_DELTA_MS = 5.0
+
+_WORDS = (
+    'energy cell membrane protein enzyme reaction molecule structure signal pathway gradient '
+    'transport equilibrium pressure volume current circuit voltage resistance market demand supply '
+    'price policy budget revenue growth network protocol packet latency memory process thread kernel '
+    'algorithm graph matrix vector theorem proof function variable model system analysis experiment'
+).split()
+_VERBS = 'regulates drives limits increases reduces transfers stores converts measures controls'.split()
+_ADJECTIVES = 'stable rapid internal external primary secondary variable constant complex minimal'.split()
+_QUESTIONS = (
+    'What is the main idea of this page?',
+    'Can you explain the second point in simpler terms?',
+    'How does the {word} relate to the {other}?',
+    'Why does the {word} matter here?',
+    'Give me an example of the {word} described on this page.',
+)
+
+
+# --- corpus ------------------------------------------------------------------------
+
+def _sentence(rng):
+    return (f'The {rng.choice(_ADJECTIVES)} {rng.choice(_WORDS)} {rng.choice(_VERBS)} the '
+            f'{rng.choice(_WORDS)} of the {rng.choice(_ADJECTIVES)} {rng.choice(_WORDS)}.')
+
+
+def _page_text(rng, page_number):
+    paragraphs = [' '.join(_sentence(rng) for _ in range(rng.randint(4, 7))) for _ in range(3)]
+    return f'Section {page_number}: {rng.choice(_WORDS).title()}\n\n' + '\n\n'.join(paragraphs)
+
+
+def _add_text_page(doc, text):
+    import fitz
+    page = doc.new_page()
+    page.insert_textbox(fitz.Rect(54, 54, page.rect.width - 54, page.rect.height - 54), text, fontsize=10)
+    return page
+
+
+def _add_scanned_page(doc, text, dpi):
+    """A page that carries `text` only as an image, like a scan: no text layer."""
+    import fitz
+    scratch = fitz.open()
+    _add_text_page(scratch, text)
+    pix = scratch[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    page = doc.new_page()
+    page.insert_image(page.rect, pixmap=pix)
+    scratch.close()
+
+
+def generate_pdf(path, kind, pages, seed, dpi=110):
+    """Write a `kind` ('text', 'scanned' or 'mixed') PDF of `pages` pages to `path`."""
+    import fitz
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        text = _page_text(rng, page_number)
+        scanned = kind == 'scanned' or (kind == 'mixed' and page_number % 3 == 0)
+        if scanned:
+            _add_scanned_page(doc, text, dpi)
+        else:
+            _add_text_page(doc, text)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+
+def build_corpus(directory, pages, copies, seed, include_sample=True):
+    """[(name, path)]; `copies` distinct documents per generated kind, plus the sample PDF."""
+    corpus = []
+    for kind in ('text', 'scanned', 'mixed'):
+        for copy in range(copies):
+            path = os.path.join(directory, f'{kind}-{copy}.pdf')
+            generate_pdf(path, kind, pages, seed=f'{seed}-{kind}-{copy}')
+            corpus.append((f'{kind}-{copy}', path))
+    if include_sample and os.path.exists(SAMPLE_PDF):
+        corpus.append(('testpdf', SAMPLE_PDF))
+    return corpus
+
+
+# --- server ------------------------------------------------------------------------
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir, args):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        'LLM_BACKEND': 'fake',
+        'RESULT_CACHE_PATH': os.path.join(workdir, 'results.sqlite3'),
+        'PRECOMPUTE_ENABLED': 'true' if args.precompute else 'false',
+        'FAKE_LLM_LATENCY_MS': str(args.fake_latency_ms),
+        'FAKE_LLM_JITTER_MS': str(args.fake_jitter_ms),
+        'FAKE_LLM_TOKENS_PER_SEC': str(args.fake_tokens_per_sec),
+        'PYTHONPATH': os.pathsep.join(filter(None, [BACKEND_DIR, env.get('PYTHONPATH')])),
+    })
+    env.pop('LANGSMITH_TRACING', None)
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SEC
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with {proc.returncode}; see {log.name}')
+        try:
+            with urllib.request.urlopen(f'{base_url}/cache-stats', timeout=2):
+                return proc, base_url, log
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'server did not start within {SERVER_START_TIMEOUT_SEC}s; see {log.name}')
+
+
+def stop_server(proc, log):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    log.close()
+
+
+def _process_tree(pid):
+    """`pid` and its descendants (extraction runs in a process pool)."""
+    pids = [pid]
+    for parent in pids:
+        try:
+            tasks = os.listdir(f'/proc/{parent}/task')
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(f'/proc/{parent}/task/{task}/children') as children:
+                    pids.extend(int(child) for child in children.read().split())
+            except OSError:
+                continue
+    return pids
+
+
+def _rss_bytes(pid):
+    total = 0
+    for member in _process_tree(pid):
+        try:
+            with open(f'/proc/{member}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total or None
+
+
+class RssSampler:
+    """Latest and peak RSS of a process tree, sampled on a background thread (Linux only)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.latest = self.peak = _rss_bytes(pid) if pid else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SEC):
+            self.latest = _rss_bytes(self.pid)
+            if self.latest and (self.peak is None or self.latest > self.peak):
+                self.peak = self.latest
+
+    def __enter__(self):
+        if self.pid:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+
+
+# --- client ------------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, started, elapsed, ok, cached=None):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append({
+                'start': started, 'elapsed': elapsed, 'ok': ok, 'cached': cached,
+                'rss': self.sampler.latest,
+            })
+
+
+def _post_json(url, payload, stream=False):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'},
+    )
+    return _send(request, stream)
+
+
+def _post_file(url, path):
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as pdf:
+        content = pdf.read()
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'
+    ).encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    return _send(request)
+
+
+def _send(request, stream=False):
+    """(status, parsed JSON body, or the raw text for event streams)."""
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SEC) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as exc:
+        status, body = exc.code, exc.read()
+    text = body.decode('utf-8', 'replace')
+    if stream:
+        return status, text
+    try:
+        return status, json.loads(text)
+    except ValueError:
+        return status, None
+
+
+def timed(recorder, endpoint, fn, *args):
+    """Run one request, record it and return its body (None on failure)."""
+    started = time.monotonic()
+    try:
+        status, body = fn(*args)
+    except OSError:
+        status, body = None, None
+    elapsed = time.monotonic() - started
+    ok = status is not None and 200 <= status < 300
+    if isinstance(body, dict):
+        ok = ok and 'error' not in body
+    elif isinstance(body, str):
+        ok = ok and 'event: done' in body
+    cached = body.get('cached') if isinstance(body, dict) and isinstance(body.get('cached'), bool) else None
+    recorder.record(endpoint, started, elapsed, ok, cached)
+    return body if ok else None
+
+
+def run_concurrently(tasks, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda task: task[0](*task[1:]), tasks))
+
+
+# --- phases ------------------------------------------------------------------------
+
+def phase_upload(base_url, recorder, corpus, concurrency):
+    bodies = run_concurrently(
+        [(timed, recorder, 'POST /upload', _post_file, f'{base_url}/upload', path) for _, path in corpus],
+        concurrency,
+    )
+    return {name: body['fileUrl'] for (name, _), body in zip(corpus, bodies) if body}
+
+
+def phase_pages(base_url, recorder, file_urls, pages, concurrency, rng, requests_per_doc, batch_size):
+    tasks = []
+    for file_url in file_urls:
+        for _ in range(requests_per_doc):
+            tasks.append((timed, recorder, 'POST /extract-page', _post_json, f'{base_url}/extract-page',
+                          {'fileUrl': file_url, 'pageNumber': rng.randint(1, pages)}))
+        for start_page in range(1, pages + 1, batch_size):
+            tasks.append((timed, recorder, 'POST /extract-pages', _post_json, f'{base_url}/extract-pages',
+                          {'fileUrl': file_url, 'startPage': start_page, 'batchSize': batch_size}))
+    rng.shuffle(tasks)
+    run_concurrently(tasks, concurrency)
+
+
+def phase_extract(base_url, recorder, file_urls, concurrency):
+    bodies = run_concurrently(
+        [(timed, recorder, 'POST /extract', _post_json, f'{base_url}/extract', {'fileUrl': file_url})
+         for file_url in file_urls],
+        concurrency,
+    )
+    return {file_url: body.get('pages') or [] for file_url, body in zip(file_urls, bodies) if body}
+
+
+def _llm_task(base_url, recorder, kind, file_url, page_text, rng):
+    if kind == 'quiz':
+        return (timed, recorder, 'POST /generate-quiz', _post_json, f'{base_url}/generate-quiz',
+                {'pageContent': page_text})
+    if kind == 'summarize':
+        return (timed, recorder, 'POST /summarize', _post_json, f'{base_url}/summarize',
+                {'pages': [page_text], 'pageNumber': 1})
+    words = [word for word in page_text.split() if len(word) > 5] or ['page']
+    question = rng.choice(_QUESTIONS).format(word=rng.choice(words).strip('.,:'), other=rng.choice(words).strip('.,:'))
+    payload = {
+        'message': question, 'context': page_text, 'documentName': os.path.basename(file_url),
+        'history': [], 'fileUrl': file_url,
+    }
+    if kind == 'chat-stream':
+        payload['stream'] = True
+        return (timed, recorder, 'POST /chat [stream]', lambda url, body: _post_json(url, body, stream=True),
+                f'{base_url}/chat', payload)
+    return (timed, recorder, 'POST /chat', _post_json, f'{base_url}/chat', payload)
+
+
+def phase_llm(base_url, recorder, extracted, mix, total, concurrency, rng):
+    """`total` LLM requests over quizable pages; page popularity falls off as 1/rank."""
+    pages = [
+        (file_url, text)
+        for file_url, texts in extracted.items()
+        for text in texts
+        if len((text or '').split()) >= 60
+    ]
+    if not pages:
+        return
+    rng.shuffle(pages)
+    popularity = [1.0 / rank for rank in range(1, len(pages) + 1)]
+    kinds, weights = zip(*mix.items())
+    tasks = []
+    for _ in range(total):
+        file_url, text = rng.choices(pages, popularity)[0]
+        tasks.append(_llm_task(base_url, recorder, rng.choices(kinds, weights)[0], file_url, text, rng))
+    run_concurrently(tasks, concurrency)
+
+
+# --- report ------------------------------------------------------------------------
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _mb(value):
+    return round(value / (1024 * 1024), 1) if value else None
+
+
+def summarize(samples):
+    report = {}
+    for endpoint, rows in samples.items():
+        latencies = sorted(row['elapsed'] * 1000 for row in rows)
+        span = max(row['start'] + row['elapsed'] for row in rows) - min(row['start'] for row in rows)
+        rss = sorted(row['rss'] for row in rows if row['rss'])
+        cached = [row['cached'] for row in rows if row['cached'] is not None]
+        report[endpoint] = {
+            'count': len(rows),
+            'errors': sum(1 for row in rows if not row['ok']),
+            'p50Ms': round(_percentile(latencies, 0.50), 1),
+            'p95Ms': round(_percentile(latencies, 0.95), 1),
+            'p99Ms': round(_percentile(latencies, 0.99), 1),
+            'meanMs': round(sum(latencies) / len(latencies), 1),
+            'maxMs': round(latencies[-1], 1),
+            'throughputRps': round(len(rows) / span, 2) if span > 0 else None,
+            'cachedShare': round(sum(cached) / len(cached), 2) if cached else None,
+            'rssMedianMb': _mb(_percentile(rss, 0.5)),
+            'rssPeakMb': _mb(rss[-1]) if rss else None,
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<22} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'req/s':>8} {'cached':>7} {'RSS MB':>8}")
+    for endpoint, row in report.items():
+        cached = '-' if row['cachedShare'] is None else f"{row['cachedShare']:.0%}"
+        print(f"{endpoint:<22} {row['count']:>5} {row['errors']:>4} {row['p50Ms']:>9.1f} {row['p95Ms']:>9.1f} "
+              f"{row['p99Ms']:>9.1f} {row['throughputRps'] or 0:>8.2f} {cached:>7} {row['rssPeakMb'] or '-':>8}")
+
+
+def compare(baseline, current, tolerance):
+    """Print per-endpoint deltas against `baseline`; returns the regressions found."""
+    regressions = []
+    print(f"\nvs {baseline['meta'].get('commit') or 'baseline'}:")
+    print(f"{'endpoint':<22} {'p95 ms':>19} {'req/s':>17} {'errors':>9}")
+    for endpoint, row in current['endpoints'].items():
+        old = baseline['endpoints'].get(endpoint)
+        if old is None:
+            print(f'{endpoint:<22} (new)')
+            continue
+        print(f"{endpoint:<22} {old['p95Ms']:>8.1f} -> {row['p95Ms']:>7.1f} "
+              f"{old['throughputRps'] or 0:>7.2f} -> {row['throughputRps'] or 0:>6.2f} "
+              f"{old['errors']:>3} -> {row['errors']:<3}")
+        if row['p95Ms'] > old['p95Ms'] * (1 + tolerance) and row['p95Ms'] - old['p95Ms'] > COMPARE_MIN_DELTA_MS:
+            regressions.append(f'{endpoint}: p95 {old["p95Ms"]} -> {row["p95Ms"]} ms')
+        if old['throughputRps'] and (row['throughputRps'] or 0) < old['throughputRps'] * (1 - tolerance):
+            regressions.append(f'{endpoint}: throughput {old["throughputRps"]} -> {row["throughputRps"]} req/s')
+        if row['errors'] > old['errors']:
+            regressions.append(f'{endpoint}: errors {old["errors"]} -> {row["errors"]}')
+    return regressions
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in ('quiz', 'summarize', 'chat', 'chat-stream'):
+            raise argparse.ArgumentTypeError(f'unknown request kind {kind!r}')
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--pages', type=int, default=12, help='pages per generated PDF')
+    parser.add_argument('--copies', type=int, default=2, help='documents per generated kind')
+    parser.add_argument('--page-requests', type=int, default=6, help='/extract-page requests per document')
+    parser.add_argument('--batch-size', type=int, default=4, help='pages per /extract-pages request')
+    parser.add_argument('--llm-requests', type=int, default=200)
+    parser.add_argument('--mix', type=_parse_mix, default=_parse_mix(DEFAULT_MIX))
+    parser.add_argument('--fake-latency-ms', type=float, default=400)
+    parser.add_argument('--fake-jitter-ms', type=float, default=200)
+    parser.add_argument('--fake-tokens-per-sec', type=float, default=80)
+    parser.add_argument('--precompute', action='store_true', help='leave background precompute on')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--compare', help='results file of an earlier run to diff against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--keep-workdir', action='store_true')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='docsensei-load-')
+    print(f'workdir: {workdir}')
+    phases = []
+    proc = None
+    try:
+        corpus = build_corpus(workdir, args.pages, args.copies, args.seed)
+        print(f'corpus: {len(corpus)} documents ({", ".join(name for name, _ in corpus)})')
+        proc, base_url, log = start_server(workdir, args)
+        with RssSampler(proc.pid) as sampler:
+            recorder = Recorder(sampler)
+            idle_rss = sampler.latest
+
+            def run_phase(name, fn, *fn_args):
+                started = time.monotonic()
+                result = fn(*fn_args)
+                phases.append({'name': name, 'seconds': round(time.monotonic() - started, 2),
+                               'rssPeakMb': _mb(sampler.peak)})
+                print(f'{name}: {phases[-1]["seconds"]}s')
+                return result
+
+            uploaded = run_phase('upload', phase_upload, base_url, recorder, corpus, args.concurrency)
+            on_demand = [url for name, url in uploaded.items() if name.endswith('-0')]
+            run_phase('pages', phase_pages, base_url, recorder, on_demand, args.pages, args.concurrency,
+                      rng, args.page_requests, args.batch_size)
+            extracted = run_phase('extract', phase_extract, base_url, recorder, list(uploaded.values()),
+                                  args.concurrency)
+            run_phase('llm', phase_llm, base_url, recorder, extracted, args.mix, args.llm_requests,
+                      args.concurrency, rng)
+        with urllib.request.urlopen(f'{base_url}/cache-stats', timeout=10) as response:
+            cache_stats = json.loads(response.read())
+    finally:
+        if proc is not None:
+            stop_server(proc, log)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'idleRssMb': _mb(idle_rss),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'corpus': [name for name, _ in corpus],
+        },
+        'phases': phases,
+        'endpoints': summarize(recorder.samples),
+        'cacheStats': cache_stats,
+    }
+    print_report(results['endpoints'])
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f'\nresults: {args.output}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# prompt_registry_bench.py
+"""
+Per-call prompt setup cost: rebuilding templates and chains vs the prompt registry.
+
+Before the registry, every quiz and summary call ran ChatPromptTemplate.from_messages
+and composed `prompt | llm | JsonOutputParser()`. This times that setup against a
+registry lookup for each registered prompt, and the same for a full invoke against an
+instant fake model so the setup's share of the non-network work is visible.
+
+Run from Backend/:  python benchmarks/prompt_registry_bench.py [--iterations N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel  # noqa: E402
+from langchain_core.output_parsers import JsonOutputParser  # noqa: E402
+from langchain_core.prompts import ChatPromptTemplate  # noqa: E402
+
+from prompt_registry import registry  # noqa: E402
+
+SAMPLE_PAGE = 'Photosynthesis converts light energy into chemical energy stored in glucose. ' * 40
+FAKE_REPLY = json.dumps({'title': 'T', 'bullets': ['b'], 'is_content_page': True, 'one_liner': 'o'})
+
+
+def _rebuilt_chain(prompt, llm):
+    template = ChatPromptTemplate.from_messages(list(prompt.messages))
+    chain = template | llm
+    return chain | JsonOutputParser() if prompt.json_output else chain
+
+
+def _inputs(prompt):
+    return {name: SAMPLE_PAGE if name == 'page_content' else 'x' for name in prompt.template.input_variables}
+
+
+def _per_call_us(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    llm = FakeListChatModel(responses=[FAKE_REPLY])
+    rows = []
+    for name in registry.versions():
+        prompt = registry.get(name)
+        inputs = _inputs(prompt)
+        invoke_iterations = max(1, args.iterations // 10)
+        rows.append({
+            'prompt': name,
+            'version': prompt.version,
+            'setupRebuiltUs': _per_call_us(lambda: _rebuilt_chain(prompt, llm), args.iterations),
+            'setupRegistryUs': _per_call_us(lambda: prompt.chain(llm), args.iterations),
+            'invokeRebuiltUs': _per_call_us(lambda: _rebuilt_chain(prompt, llm).invoke(inputs), invoke_iterations),
+            'invokeRegistryUs': _per_call_us(lambda: prompt.chain(llm).invoke(inputs), invoke_iterations),
+        })
+
+    print(f"{'prompt':<10} {'version':<13} {'setup rebuilt':>14} {'setup registry':>15} "
+          f"{'invoke rebuilt':>15} {'invoke registry':>16}")
+    for row in rows:
+        print(f"{row['prompt']:<10} {row['version']:<13} {row['setupRebuiltUs']:>12.1f}us "
+              f"{row['setupRegistryUs']:>13.2f}us {row['invokeRebuiltUs']:>13.1f}us {row['invokeRegistryUs']:>14.1f}us")
+
+
+if __name__ == '__main__':
+    main()
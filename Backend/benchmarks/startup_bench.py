@@ -0,0 +1,116 @@
+# startup_bench.py
+"""
+Cold-start cost of importing the backend, in the style of `python -X importtime`.
+
+Each run imports the module in a fresh interpreter with -X importtime and with
+socket connects and DNS lookups replaced by a recorder that refuses them, then
+reports the median wall time, the slowest imports by cumulative time, any network
+attempts, and which of the deferred heavy modules (see lazy_imports.py) were loaded
+anyway. Exits non-zero if the median is over budget, the import touched the network,
+or a deferred module was imported eagerly, so it can gate CI or a deploy.
+
+Run from Backend/:  python benchmarks/startup_bench.py [--module app] [--runs 5] [--budget-sec 1.0]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from lazy_imports import tracing_enabled  # noqa: E402
+
+# Modules app startup must not import; each is loaded on first use instead.
+# langsmith is expected at import when LangSmith tracing is on.
+DEFERRED_MODULES = (
+    'fitz', 'pypdf', 'pytesseract', 'PIL', 'numpy', 'tiktoken', 'langchain_openai', 'openai',
+) + (() if tracing_enabled() else ('langsmith',))
+
+_CHILD = '''
+import json, socket, sys, time
+attempts = []
+def _refuse(kind):
+    def refuse(*args, **kwargs):
+        attempts.append('%s %r' % (kind, args[1:2] if kind == 'connect' else args[:2]))
+        raise OSError('network disabled during startup benchmark')
+    return refuse
+socket.socket.connect = _refuse('connect')
+socket.socket.connect_ex = _refuse('connect')
+socket.getaddrinfo = _refuse('getaddrinfo')
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'elapsedSec': elapsed,
+    'network': attempts,
+    'deferredLoaded': sorted(name for name in {deferred!r} if name in sys.modules),
+}}))
+'''
+
+
+def _parse_importtime(stderr):
+    """[(cumulative_us, self_us, depth, module)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return rows
+
+
+def run_once(module):
+    code = _CHILD.format(module=module, deferred=DEFERRED_MODULES)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr[-2000:]}')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['imports'] = _parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-sec', type=float, default=float(os.environ.get('STARTUP_BUDGET_SEC', '1.0')))
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-depth', type=int, default=2, help='only list imports nested at most this deep')
+    args = parser.parse_args()
+
+    runs = [run_once(args.module) for _ in range(max(1, args.runs))]
+    median = statistics.median(run['elapsedSec'] for run in runs)
+    network = sorted({attempt for run in runs for attempt in run['network']})
+    deferred = sorted({name for run in runs for name in run['deferredLoaded']})
+
+    imports = [row for row in runs[-1]['imports'] if row[2] <= args.max_depth]
+    imports.sort(reverse=True)
+    print(f"import {args.module}: median {median * 1000:.0f} ms over {len(runs)} run(s) "
+          f"(min {min(run['elapsedSec'] for run in runs) * 1000:.0f} ms, budget {args.budget_sec * 1000:.0f} ms)")
+    print(f"\n{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, depth, name in imports[:args.top]:
+        print(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {'  ' * depth}{name}")
+    print(f"\nnetwork attempts: {', '.join(network) or 'none'}")
+    print(f"deferred modules loaded at import: {', '.join(deferred) or 'none'}")
+
+    failures = []
+    if median > args.budget_sec:
+        failures.append(f'median import time {median:.3f}s is over the {args.budget_sec:.3f}s budget')
+    if network:
+        failures.append('import touched the network')
+    if deferred:
+        failures.append('deferred modules were imported eagerly')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
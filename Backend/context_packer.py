@@ -0,0 +1,184 @@
+# context_packer.py
+"""
+Token-budgeted prompt assembly for chat, quiz and summary calls.
+
+Prompts used to be cut by characters (`context[:3000]`, the last 6 chat messages,
+`page_content[:4000]`) or not at all (quizzes), which wastes context on dense pages
+and overflows on long ones. A ContextPacker is given a total token budget and fills
+it section by section, in the order the caller adds them:
+
+  add_fixed     text that must go in whole (system instructions, the question)
+  add_text      one text cut to fit, keeping the start and ending on a sentence
+  add_passages  ranked passages kept whole in order until the budget runs out
+  add_recent    chat turns kept newest first, whole
+
+Every section may also have its own cap. `usage` reports the tokens each section
+took, so callers can log and tune latency and cost per call. Tokens are counted with
+the shared cl100k_base encoder (get_token_encoder); if it cannot be loaded (tiktoken
+downloads it on first use) counts fall back to an estimate of four characters per
+token, and the load is retried every TOKEN_ENCODER_RETRY_SEC.
+"""
+import math
+import os
+import re
+import threading
+import time
+
+from lazy_imports import LazyModule
+from logger import get_logger
+
+tiktoken = LazyModule('tiktoken')
+
+ai_logger = get_logger('AI')
+
+# Prompt budgets per call type (total tokens, and caps for the variable sections).
+CHAT_PROMPT_TOKENS = max(256, int(os.environ.get('CHAT_PROMPT_TOKENS', '2800')))
+CHAT_CONTEXT_TOKENS = max(64, int(os.environ.get('CHAT_CONTEXT_TOKENS', '1600')))
+CHAT_CURRENT_PAGE_TOKENS = max(0, int(os.environ.get('CHAT_CURRENT_PAGE_TOKENS', '750')))
+CHAT_HISTORY_TOKENS = max(0, int(os.environ.get('CHAT_HISTORY_TOKENS', '600')))
+QUIZ_PROMPT_TOKENS = max(256, int(os.environ.get('QUIZ_PROMPT_TOKENS', '4500')))
+QUIZ_PAGE_TOKENS = max(64, int(os.environ.get('QUIZ_PAGE_TOKENS', '2500')))
+SUMMARY_PROMPT_TOKENS = max(256, int(os.environ.get('SUMMARY_PROMPT_TOKENS', '4500')))
+SUMMARY_PAGE_TOKENS = max(64, int(os.environ.get('SUMMARY_PAGE_TOKENS', '1000')))
+# After a failed encoder load, callers estimate token counts for this long before it is retried.
+TOKEN_ENCODER_RETRY_SEC = max(1.0, float(os.environ.get('TOKEN_ENCODER_RETRY_SEC', '300')))
+
+_CHARS_PER_TOKEN = 4
+# A sentence boundary is only used if it keeps at least this share of the allowance.
+_MIN_SENTENCE_KEEP = 0.5
+# A trailing passage is cut to fit rather than dropped if this many tokens remain.
+_MIN_PARTIAL_PASSAGE_TOKENS = 48
+_SENTENCE_END_RE = re.compile(r'[.!?…]["\')\]]*(?=\s)')
+
+
+_encoder = None
+_encoder_retry_at = None
+_encoder_lock = threading.Lock()
+
+
+def get_token_encoder():
+    """
+    The cl100k_base encoder, loaded once per process and shared by every caller, or
+    None while it cannot be loaded. A failed load is not retried for
+    TOKEN_ENCODER_RETRY_SEC, so an offline worker does not attempt the download on
+    every call but still picks the encoder up once it becomes reachable.
+    """
+    global _encoder, _encoder_retry_at
+    if _encoder is not None:
+        return _encoder
+    with _encoder_lock:
+        if _encoder is None and (_encoder_retry_at is None or time.monotonic() >= _encoder_retry_at):
+            try:
+                _encoder = tiktoken.get_encoding("cl100k_base")
+                _encoder_retry_at = None
+            except Exception as e:
+                ai_logger.warning('Token encoder unavailable, estimating token counts for %.0fs: %s',
+                                  TOKEN_ENCODER_RETRY_SEC, e)
+                _encoder_retry_at = time.monotonic() + TOKEN_ENCODER_RETRY_SEC
+        return _encoder
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    enc = get_token_encoder()
+    if enc is None:
+        return math.ceil(len(text) / _CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    (text, tokens) with `text` cut to at most `max_tokens`, keeping the start and
+    ending on the last sentence boundary (or word boundary) inside the allowance.
+    """
+    text = text or ''
+    if max_tokens <= 0 or not text:
+        return '', 0
+    enc = get_token_encoder()
+    if enc is None:
+        if len(text) <= max_tokens * _CHARS_PER_TOKEN:
+            return text, count_tokens(text)
+        head = text[:max_tokens * _CHARS_PER_TOKEN]
+    else:
+        tokens = enc.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text, len(tokens)
+        # A cut token sequence can end inside a multi-byte character.
+        head = enc.decode(tokens[:max_tokens]).rstrip('�')
+
+    cut = None
+    for match in _SENTENCE_END_RE.finditer(head):
+        cut = match.end()
+    if cut is None or cut < len(head) * _MIN_SENTENCE_KEEP:
+        space = head.rfind(' ')
+        cut = space if space >= len(head) * _MIN_SENTENCE_KEEP else len(head)
+    head = head[:cut].rstrip()
+    return head, count_tokens(head)
+
+
+class ContextPacker:
+    """Fills a prompt's token budget section by section; see the module docstring."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.usage = {}
+
+    @property
+    def used(self):
+        return sum(self.usage.values())
+
+    @property
+    def remaining(self):
+        return max(0, self.budget - self.used)
+
+    def _allowance(self, max_tokens):
+        return self.remaining if max_tokens is None else min(max_tokens, self.remaining)
+
+    def _record(self, name, tokens):
+        self.usage[name] = self.usage.get(name, 0) + tokens
+
+    def add_fixed(self, name, text):
+        """Count text that is sent whole, even if it exceeds the budget."""
+        self._record(name, count_tokens(text))
+        return text
+
+    def add_text(self, name, text, max_tokens=None):
+        packed, tokens = truncate_to_tokens(text, self._allowance(max_tokens))
+        self._record(name, tokens)
+        return packed
+
+    def add_passages(self, name, passages, max_tokens=None, separator='\n\n'):
+        """The leading passages that fit, in order; the last may be cut at a sentence."""
+        allowance = self._allowance(max_tokens)
+        separator_tokens = count_tokens(separator)
+        packed = []
+        used = 0
+        for passage in passages:
+            cost = count_tokens(passage) + (separator_tokens if packed else 0)
+            if used + cost > allowance:
+                left = allowance - used - (separator_tokens if packed else 0)
+                if left >= _MIN_PARTIAL_PASSAGE_TOKENS:
+                    partial, tokens = truncate_to_tokens(passage, left)
+                    if partial:
+                        packed.append(partial)
+                        used += tokens + (separator_tokens if len(packed) > 1 else 0)
+                break
+            packed.append(passage)
+            used += cost
+        self._record(name, used)
+        return packed
+
+    def add_recent(self, name, items, max_tokens=None):
+        """The most recent whole items that fit, oldest first."""
+        allowance = self._allowance(max_tokens)
+        kept = []
+        used = 0
+        for item in reversed(items):
+            cost = count_tokens(item)
+            if used + cost > allowance:
+                break
+            kept.append(item)
+            used += cost
+        self._record(name, used)
+        return kept[::-1]
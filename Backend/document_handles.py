@@ -0,0 +1,146 @@
+# document_handles.py
+"""
+Per-path pool of open PDF handles shared across pages and requests.
+
+Opening a PDF parses its xref table, so the extraction paths borrow a cached
+fitz.Document / PdfReader pair from here instead of reopening the file for every
+page. Entries are validated against the file's mtime and size on each checkout
+and the pool is bounded with LRU eviction.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from lazy_imports import LazyModule
+from logger import get_logger
+
+fitz = LazyModule('fitz')  # PyMuPDF
+pypdf = LazyModule('pypdf')
+
+system_logger = get_logger('SYSTEM')
+
+DOCUMENT_HANDLE_POOL_SIZE = max(1, int(os.environ.get('DOCUMENT_HANDLE_POOL_SIZE', '8')))
+
+
+class DocumentHandle:
+    """
+    Lazily opened fitz and pypdf views of one file.
+    Neither library is thread-safe, so callers hold `lock` around every access.
+    """
+
+    def __init__(self, file_path, signature):
+        self.file_path = file_path
+        self.signature = signature
+        self.lock = threading.RLock()
+        self.refs = 0
+        self.retired = False
+        self._fitz_doc = None
+        self._pdf_reader = None
+
+    def fitz_doc(self):
+        if self._fitz_doc is None:
+            self._fitz_doc = fitz.open(self.file_path)
+        return self._fitz_doc
+
+    def pdf_reader(self):
+        if self._pdf_reader is None:
+            reader = pypdf.PdfReader(self.file_path)
+            if reader.is_encrypted:
+                reader.decrypt("")
+            self._pdf_reader = reader
+        return self._pdf_reader
+
+    def close(self):
+        with self.lock:
+            if self._fitz_doc is not None:
+                try:
+                    self._fitz_doc.close()
+                except Exception as exc:
+                    system_logger.warning('Failed to close fitz handle for %s: %s', self.file_path, exc)
+                self._fitz_doc = None
+            if self._pdf_reader is not None:
+                close_reader = getattr(self._pdf_reader, 'close', None)
+                if close_reader is not None:
+                    try:
+                        close_reader()
+                    except Exception as exc:
+                        system_logger.warning('Failed to close pypdf handle for %s: %s', self.file_path, exc)
+                self._pdf_reader = None
+
+
+class DocumentHandlePool:
+    """LRU pool of DocumentHandle objects keyed by absolute path."""
+
+    def __init__(self, max_size=DOCUMENT_HANDLE_POOL_SIZE):
+        self.max_size = max(1, int(max_size))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, file_path):
+        handle = self._checkout(file_path)
+        try:
+            yield handle
+        finally:
+            self._release(handle)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            for handle in entries:
+                self._retire(handle)
+
+    def _checkout(self, file_path):
+        key = os.path.abspath(file_path)
+        stat = os.stat(key)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            handle = self._entries.get(key)
+            if handle is not None and handle.signature != signature:
+                system_logger.info('Document changed on disk, dropping cached handle: %s', key)
+                del self._entries[key]
+                self._retire(handle)
+                handle = None
+            if handle is None:
+                handle = DocumentHandle(key, signature)
+                self._entries[key] = handle
+                while len(self._entries) > self.max_size:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._retire(evicted)
+            else:
+                self._entries.move_to_end(key)
+            handle.refs += 1
+            return handle
+
+    def _release(self, handle):
+        with self._lock:
+            handle.refs -= 1
+            close_now = handle.retired and handle.refs == 0
+        if close_now:
+            handle.close()
+
+    def _retire(self, handle):
+        # Handles still borrowed by another request are closed on their last release.
+        handle.retired = True
+        if handle.refs == 0:
+            handle.close()
+
+
+_pool = DocumentHandlePool()
+
+
+def open_document(file_path):
+    """Borrow the shared handle for `file_path` for the duration of a with-block."""
+    return _pool.open(file_path)
+
+
+def _reset_pool_after_fork():
+    # Extraction worker processes must not share MuPDF state with their parent.
+    global _pool
+    _pool = DocumentHandlePool(_pool.max_size)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
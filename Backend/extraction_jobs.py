@@ -0,0 +1,136 @@
+# extraction_jobs.py
+"""
+Background extraction jobs for /extract.
+
+A job runs the extractor on a small thread pool so the request thread can return
+immediately with a job id. Progress (pages done / pending) is updated as page
+ranges finish and is exposed through ExtractionJob.to_dict() for status polling.
+At most one job is active per file; repeated submissions join the running job.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import get_logger
+
+ai_logger = get_logger('AI')
+
+EXTRACTION_JOB_WORKERS = max(1, int(os.environ.get('EXTRACTION_JOB_WORKERS', '1')))
+EXTRACTION_JOB_TTL_SEC = max(60.0, float(os.environ.get('EXTRACTION_JOB_TTL_SEC', '3600')))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class ExtractionJob:
+    def __init__(self, job_id, file_path):
+        self.id = job_id
+        self.file_path = file_path
+        self.status = JOB_QUEUED
+        self.total_pages = None
+        self.pages_done = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    @property
+    def is_active(self):
+        return self.status in (JOB_QUEUED, JOB_RUNNING)
+
+    def record_progress(self, total_pages, pages_done):
+        with self._lock:
+            self.total_pages = total_pages
+            self.pages_done = min(pages_done, total_pages)
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _mark_running(self):
+        with self._lock:
+            self.status = JOB_RUNNING
+            self.started_at = time.time()
+
+    def _mark_finished(self, error=None):
+        with self._lock:
+            self.status = JOB_FAILED if error else JOB_DONE
+            self.error = error
+            self.finished_at = time.time()
+        self._finished.set()
+
+    def to_dict(self):
+        with self._lock:
+            total_pages = self.total_pages
+            pages_done = self.pages_done
+            pages_pending = None if total_pages is None else max(0, total_pages - pages_done)
+            end = self.finished_at or time.time()
+            return {
+                'jobId': self.id,
+                'status': self.status,
+                'totalPages': total_pages,
+                'pagesDone': pages_done,
+                'pagesPending': pages_pending,
+                'error': self.error,
+                'elapsed': round(end - (self.started_at or end), 2),
+            }
+
+
+class ExtractionJobQueue:
+    """
+    Runs `runner(job)` on a bounded thread pool. The runner reports progress through
+    job.record_progress and raises to mark the job failed.
+    """
+
+    def __init__(self, runner, max_workers=EXTRACTION_JOB_WORKERS, ttl_sec=EXTRACTION_JOB_TTL_SEC):
+        self._runner = runner
+        self._ttl_sec = ttl_sec
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='extract-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, file_path):
+        """Start a job for `file_path`, or return the one already queued or running."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and job.is_active:
+                return job
+            job = ExtractionJob(job_id, file_path)
+            self._jobs[job_id] = job
+        ai_logger.info('Extraction job queued: id=%s file=%s', job_id, file_path)
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_job(self, job_id):
+        job = self.get(job_id)
+        return job if job is not None and job.is_active else None
+
+    def _run(self, job):
+        job._mark_running()
+        try:
+            self._runner(job)
+        except Exception as exc:
+            ai_logger.exception('Extraction job failed: id=%s file=%s error=%s', job.id, job.file_path, exc)
+            job._mark_finished(error=str(exc))
+            return
+        job._mark_finished()
+        ai_logger.info('Extraction job finished: id=%s pages=%s elapsed=%.2fs',
+                       job.id, job.total_pages, job.finished_at - job.started_at)
+
+    def _prune(self):
+        cutoff = time.time() - self._ttl_sec
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if not job.is_active and job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,256 @@
+# fake_llm.py
+"""
+Offline, deterministic chat model for load tests and local runs (LLM_BACKEND=fake).
+
+A call waits FAKE_LLM_LATENCY_MS (plus up to FAKE_LLM_JITTER_MS) before its first
+token and then produces FAKE_LLM_TOKENS_PER_SEC tokens per second (0 for the whole
+reply at once), so a request costs roughly what a hosted model's would without the
+network, an API key or a bill. Replies are built from the prompt:
+
+  quiz prompts     up to three fill-in-the-blank MCQs on the page's own sentences,
+                   in the schema of prompt_library's quiz prompts
+  summary prompt   title, bullets, is_content_page, example and one_liner taken
+                   from the page's leading sentences
+  anything else    a short chat answer quoting the sentences of the context that
+                   best match the question
+
+The prompt is recognised by comparing the system message with the templates in the
+prompt registry. The same prompt always gets the same reply and the same jitter.
+Blocking calls sleep, async calls await, and batch, stream and astream come from
+BaseChatModel, so server concurrency, caching and streaming can be measured as
+they would behave against a real model.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import string
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from context_packer import count_tokens
+
+FAKE_LLM_LATENCY_MS = max(0.0, float(os.environ.get('FAKE_LLM_LATENCY_MS', '400')))
+FAKE_LLM_JITTER_MS = max(0.0, float(os.environ.get('FAKE_LLM_JITTER_MS', '200')))
+FAKE_LLM_TOKENS_PER_SEC = max(0.0, float(os.environ.get('FAKE_LLM_TOKENS_PER_SEC', '80')))
+
+_QUIZ_PROMPTS = ('quiz', 'quiz_hard')
+_QUIZ_QUESTIONS = 3
+_SUMMARY_BULLETS = 6
+_CHAT_SENTENCES = 2
+# Quoted sentences are cut to this many words.
+_MAX_SENTENCE_WORDS = 40
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]*")
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+_STREAM_CHUNK_RE = re.compile(r'\S+\s*|\s+')
+_QUESTION_MARKER = 'Current question:'
+
+
+def _text(message):
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return ' '.join(part.get('text', '') if isinstance(part, dict) else str(part) for part in content)
+
+
+@lru_cache(maxsize=1)
+def _registered_prompts():
+    """[(name, literal fragments of the system template)] for every registered prompt."""
+    from prompt_registry import registry
+    formatter = string.Formatter()
+    prompts = []
+    for name in registry.versions():
+        template = registry.get(name).system_template
+        literals = [literal for literal, _, _, _ in formatter.parse(template) if literal.strip()]
+        prompts.append((name, literals))
+    return prompts
+
+
+def _identify(system_text):
+    """(prompt name or None, the values filled into its placeholders, longest first)."""
+    for name, literals in _registered_prompts():
+        if not literals or not system_text.startswith(literals[0]):
+            continue
+        filled = []
+        position = 0
+        for literal in literals:
+            found = system_text.find(literal, position)
+            if found < 0:
+                continue
+            filled.append(system_text[position:found])
+            position = found + len(literal)
+        filled.append(system_text[position:])
+        return name, sorted((part.strip() for part in filled if part.strip()), key=len, reverse=True)
+    return None, [system_text] if system_text.strip() else []
+
+
+def _sentences(text):
+    """The distinct sentences of `text` with at least five words, in order."""
+    sentences = {}
+    for sentence in _SENTENCE_RE.split(' '.join(text.split())):
+        if len(_WORD_RE.findall(sentence)) >= 5:
+            sentences.setdefault(' '.join(sentence.split()[:_MAX_SENTENCE_WORDS]), None)
+    return list(sentences)
+
+
+def _quiz_reply(page, rng):
+    sentences = _sentences(page)
+    vocabulary = {}
+    for word in _WORD_RE.findall(page):
+        if len(word) >= 5:
+            vocabulary.setdefault(word.lower(), word)
+    questions = []
+    for sentence in rng.sample(sentences, min(_QUIZ_QUESTIONS, len(sentences))):
+        candidates = [word for word in _WORD_RE.findall(sentence) if len(word) >= 5]
+        if not candidates:
+            continue
+        answer = rng.choice(candidates)
+        distractors = sorted(word for key, word in vocabulary.items() if key != answer.lower())
+        if len(distractors) < 3:
+            continue
+        options = rng.sample(distractors, 3)
+        correct = rng.randrange(4)
+        options.insert(correct, answer)
+        blanked = re.sub(r'\b%s\b' % re.escape(answer), '_____', sentence, count=1)
+        questions.append({
+            'question': f'Which word completes this statement from the page? "{blanked}"',
+            'choices': dict(zip('ABCD', options)),
+            'answer': 'ABCD'[correct],
+            'explanation': f'- The page states: "{sentence}"',
+        })
+    if not questions:
+        return {
+            'questions': [],
+            'valid': True,
+            'validation_explanation': 'This page does not contain enough substantive content for quiz generation. '
+                                      'It is valid to move to the next page.',
+        }
+    return {
+        'questions': questions,
+        'valid': True,
+        'validation_explanation': 'Each question is drawn from a sentence on the page.',
+    }
+
+
+def _summary_reply(page):
+    sentences = _sentences(page) or [' '.join(page.split()[:_MAX_SENTENCE_WORDS])]
+    bullets = sentences[:_SUMMARY_BULLETS]
+    if len(bullets) < 2:
+        bullets.append('The page is short; this is its only key point.')
+    return {
+        'title': ' '.join(_WORD_RE.findall(sentences[0])[:6]) or 'Page Summary',
+        'bullets': bullets,
+        'is_content_page': True,
+        'example': '',
+        'one_liner': sentences[0],
+    }
+
+
+def _chat_reply(context, question):
+    sentences = _sentences(context)
+    if not sentences:
+        return "The page doesn't say much about that, so I can only answer in general terms."
+    asked = {word.lower() for word in _WORD_RE.findall(question)}
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda index: (-len(asked & {word.lower() for word in _WORD_RE.findall(sentences[index])}), index),
+    )
+    quoted = ' '.join(sentences[index] for index in sorted(ranked[:_CHAT_SENTENCES]))
+    return f'According to the page: {quoted} Let me know if you would like me to go deeper on any part of it.'
+
+
+def fake_reply(messages, rng):
+    """The reply text for a prompt (see the module docstring)."""
+    system_text = '\n'.join(_text(message) for message in messages if message.type == 'system')
+    human_texts = [_text(message) for message in messages if message.type != 'system']
+    name, filled = _identify(system_text)
+    if name in _QUIZ_PROMPTS:
+        return json.dumps(_quiz_reply(filled[0] if filled else '', rng), ensure_ascii=False)
+    if name == 'summary':
+        return json.dumps(_summary_reply(human_texts[-1] if human_texts else ''), ensure_ascii=False)
+    question = human_texts[-1] if human_texts else ''
+    question = question.rsplit(_QUESTION_MARKER, 1)[-1]
+    return _chat_reply(filled[0] if filled else '', question)
+
+
+class FakeChatModel(BaseChatModel):
+    """See the module docstring."""
+
+    model_name: str = 'fake'
+    latency_ms: float = FAKE_LLM_LATENCY_MS
+    jitter_ms: float = FAKE_LLM_JITTER_MS
+    tokens_per_sec: float = FAKE_LLM_TOKENS_PER_SEC
+
+    @property
+    def _llm_type(self) -> str:
+        return 'docsensei-fake'
+
+    @property
+    def _identifying_params(self):
+        return {'latency_ms': self.latency_ms, 'jitter_ms': self.jitter_ms, 'tokens_per_sec': self.tokens_per_sec}
+
+    def _plan(self, messages):
+        """(reply, seconds before the first token, usage metadata) for a prompt."""
+        prompt = '\n'.join(f'{message.type}:{_text(message)}' for message in messages)
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+        first_token_sec = (self.latency_ms + rng.uniform(0, self.jitter_ms)) / 1000
+        reply = fake_reply(messages, rng)
+        input_tokens = count_tokens(prompt)
+        output_tokens = count_tokens(reply)
+        usage = {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                 'total_tokens': input_tokens + output_tokens}
+        return reply, first_token_sec, usage
+
+    def _generation_sec(self, text):
+        return count_tokens(text) / self.tokens_per_sec if self.tokens_per_sec else 0.0
+
+    def _result(self, reply, usage):
+        message = AIMessage(content=reply, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, reply, usage):
+        pieces = _STREAM_CHUNK_RE.findall(reply) or ['']
+        for index, piece in enumerate(pieces):
+            last = index == len(pieces) - 1
+            yield piece, ChatGenerationChunk(
+                message=AIMessageChunk(content=piece, usage_metadata=usage if last else None),
+            )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        reply, first_token_sec, usage = self._plan(messages)
+        time.sleep(first_token_sec + self._generation_sec(reply))
+        return self._result(reply, usage)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        reply, first_token_sec, usage = self._plan(messages)
+        await asyncio.sleep(first_token_sec + self._generation_sec(reply))
+        return self._result(reply, usage)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        reply, first_token_sec, usage = self._plan(messages)
+        time.sleep(first_token_sec)
+        for piece, chunk in self._chunks(reply, usage):
+            time.sleep(self._generation_sec(piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        reply, first_token_sec, usage = self._plan(messages)
+        await asyncio.sleep(first_token_sec)
+        for piece, chunk in self._chunks(reply, usage):
+            await asyncio.sleep(self._generation_sec(piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
@@ -1,40 +1,67 @@
 #lanchain_utils.py
 from logger import get_logger
+import asyncio
 import json
-from functools import lru_cache
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.messages import SystemMessage, HumanMessage
+import random
+import sqlite3
 import os
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langsmith import traceable
-import prompt_library
-
-import base64
-import fitz  # PyMuPDF
-from openai import OpenAI
-from pypdf import PdfReader
+from lazy_imports import traceable, tracing_enabled
+import llm_backends
+from prompt_registry import registry as prompt_registry
+from document_handles import open_document
+import ocr_pool
+from result_cache import content_key, get_result_store, normalize_text
+from single_flight import SingleFlight
+from context_packer import (
+    CHAT_CONTEXT_TOKENS,
+    CHAT_HISTORY_TOKENS,
+    CHAT_PROMPT_TOKENS,
+    QUIZ_PAGE_TOKENS,
+    QUIZ_PROMPT_TOKENS,
+    SUMMARY_PAGE_TOKENS,
+    SUMMARY_PROMPT_TOKENS,
+    ContextPacker,
+    get_token_encoder as _get_token_encoder,
+)
+
+import multiprocessing
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 
 load_dotenv()
 ai_logger = get_logger('AI')
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.2)
+if tracing_enabled():
+    ai_logger.info("LangSmith tracing enabled for project: %s", os.environ.get("LANGSMITH_PROJECT"))
 
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """
+    The shared chat model for LLM_BACKEND (see llm_backends.py), created on first use:
+    importing langchain_openai takes over a second, and nothing at import time should
+    need the network or an API key.
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = llm_backends.create_llm()
+    return _llm
+
+
+def _cache_version(prompt):
+    """The prompt version, tagged with the backend unless it is the default one."""
+    tag = llm_backends.cache_tag()
+    return prompt.version if tag is None else f'{prompt.version}+{tag}'
 
-# LangSmith tracing test (run once at import if tracing is enabled)
-if os.environ.get("LANGSMITH_TRACING", "false").lower() == "true":
-    try:
-        ai_logger.info("LangSmith tracing enabled. Sending test trace to project: %s", os.environ.get("LANGSMITH_PROJECT"))
-        test_llm = ChatOpenAI()
-        test_llm.invoke("Hello, world!")
-        ai_logger.info("LangSmith test trace sent successfully.")
-    except Exception as e:
-        ai_logger.error("LangSmith test trace failed: %s", e)
 
 
-_openai_client = OpenAI()
 INITIAL_EXTRACTION_TIME_BUDGET_SEC = max(
     5.0,
     float(os.environ.get("INITIAL_EXTRACTION_TIME_BUDGET_SEC", "20")),
@@ -43,225 +70,457 @@ INITIAL_EXTRACTION_MAX_PAGES = max(
     0,
     int(os.environ.get("INITIAL_EXTRACTION_MAX_PAGES", "0")),
 )
+# Process-pool extraction: documents with at least EXTRACTION_PARALLEL_MIN_PAGES pages are
+# split into EXTRACTION_CHUNK_PAGES ranges and extracted by EXTRACTION_WORKERS processes.
+EXTRACTION_WORKERS = max(
+    1,
+    int(os.environ.get("EXTRACTION_WORKERS", str(os.cpu_count() or 1))),
+)
+EXTRACTION_CHUNK_PAGES = max(
+    1,
+    int(os.environ.get("EXTRACTION_CHUNK_PAGES", "8")),
+)
+EXTRACTION_PARALLEL_MIN_PAGES = max(
+    1,
+    int(os.environ.get("EXTRACTION_PARALLEL_MIN_PAGES", "16")),
+)
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
 
-import tiktoken
-import pytesseract
-from PIL import Image
-import io
+import string
 
-def _is_text_gibberish(text: str) -> bool:
-    if not text or len(text) < 20:
+_ASCII_LETTERS = string.ascii_letters.encode('ascii')
+_ASCII_UPPERCASE = string.ascii_uppercase.encode('ascii')
+
+
+def _alpha_upper_counts(text: str) -> tuple:
+    """
+    Count alphabetic and uppercase-alphabetic characters in one C-level pass.
+    ASCII text (the common case for text layers) is counted with bytes.translate;
+    anything else falls back to str.isalpha/str.isupper mapped over the string.
+    """
+    if text.isascii():
+        raw = text.encode('ascii')
+        alpha = len(raw) - len(raw.translate(None, _ASCII_LETTERS))
+        upper = len(raw) - len(raw.translate(None, _ASCII_UPPERCASE))
+        return alpha, upper
+    alpha_chars = ''.join(filter(str.isalpha, text))
+    return len(alpha_chars), sum(map(str.isupper, alpha_chars))
+
+
+def _count_tokens_batch(texts: list) -> list:
+    """
+    Token counts for `texts`, encoded in one batch. Entries that cannot be encoded
+    (e.g. text containing special-token markers) come back as None.
+    """
+    if not texts:
+        return []
+    enc = _get_token_encoder()
+    if enc is None:
+        return [None] * len(texts)
+    try:
+        return [len(tokens) for tokens in enc.encode_batch(texts)]
+    except Exception:
+        counts = []
+        for text in texts:
+            try:
+                counts.append(len(enc.encode(text)))
+            except Exception as e:
+                ai_logger.error(f"Error in gibberish detection: {e}")
+                counts.append(None)
+        return counts
+
+
+def _classify_gibberish(text: str, token_count: int) -> bool:
+    if token_count == 0:
+        return True
+    density = len(text) / token_count
+
+    if density < 1.5:
+        ai_logger.warning(f"Gibberish detected: Extremely low token density ({density:.2f} < 1.5). Snippet: {repr(text[:50])}")
+        return True
+
+    alpha_count, upper_count = _alpha_upper_counts(text)
+    if not alpha_count:
         return False
-        
-    if text.count('\ufffd') > len(text) * 0.05:
-        ai_logger.warning("Gibberish detected: High concentration of Unicode replacement characters '\\ufffd'")
+
+    upper_ratio = upper_count / alpha_count
+    space_ratio = text.count(' ') / len(text)
+
+    # Random all-caps tends to have density < 3.0, while real headers > 3.5
+    if upper_ratio > 0.8 and density < 3.0:
+        ai_logger.warning(f"Gibberish detected: All-caps random text (Upper Ratio: {upper_ratio:.2f}, Density: {density:.2f}). Snippet: {repr(text[:50])}")
         return True
-        
+
+    # Large blocks of unspaced garbage letters
+    if space_ratio < 0.05 and density < 2.5:
+        ai_logger.warning(f"Gibberish detected: Dense unspaced text (Space Ratio: {space_ratio:.2f}, Density: {density:.2f}). Snippet: {repr(text[:50])}")
+        return True
+
+    # Miscellaneous highly suspicious density
+    if density < 2.0:
+        ai_logger.warning(f"Gibberish detected: Suspiciously low token density ({density:.2f} < 2.0). Snippet: {repr(text[:50])}")
+        return True
+
+    return False
+
+
+def _score_pages_gibberish(texts: list) -> list:
+    """
+    Batch gibberish classifier: returns one verdict per text, in order.
+    All candidate pages are tokenized with a single encode_batch call.
+    """
+    verdicts = [False] * len(texts)
+    candidates = []
+    for idx, text in enumerate(texts):
+        if not text or len(text) < 20:
+            continue
+        if text.count('\ufffd') > len(text) * 0.05:
+            ai_logger.warning("Gibberish detected: High concentration of Unicode replacement characters '\\ufffd'")
+            verdicts[idx] = True
+            continue
+        candidates.append(idx)
+
+    token_counts = _count_tokens_batch([texts[idx] for idx in candidates])
+    for idx, token_count in zip(candidates, token_counts):
+        if token_count is not None:
+            verdicts[idx] = _classify_gibberish(texts[idx], token_count)
+    return verdicts
+
+
+def _is_text_gibberish(text: str) -> bool:
+    return _score_pages_gibberish([text])[0]
+
+def _submit_page_ocr(handle, idx: int, total_pages: int, deadline: float = None):
+    """
+    Render a page under the handle lock and queue it on the shared OCR pool. Returns a Future.
+    The handle must stay checked out until the future is resolved (adaptive DPI re-renders from it).
+    """
+    def render(scale=ocr_pool.OCR_BASE_SCALE):
+        with handle.lock:
+            return ocr_pool.render_page_for_ocr(handle.fitz_doc()[idx], scale)
+
+    return ocr_pool.submit(render(), label=f'{idx + 1}/{total_pages}', deadline=deadline, rerender=render)
+
+
+def _extract_pypdf_page(handle, idx: int, total_pages: int) -> str:
+    """pypdf fallback for a page whose PyMuPDF text was empty or gibberish."""
+    with handle.lock:
+        pypdf_text = (handle.pdf_reader().pages[idx].extract_text() or '').strip()
+
+    if pypdf_text and _is_text_gibberish(pypdf_text):
+        ai_logger.warning('Page %d/%d pypdf fallback flagged as gibberish too. Ignoring. Snippet: %s', idx + 1, total_pages, repr(pypdf_text[:100]))
+        pypdf_text = ""
+
+    if pypdf_text:
+        ai_logger.info('Page %d/%d extracted via pypdf FALLBACK. Length: %d chars. Snippet: %s', 
+                       idx + 1, total_pages, len(pypdf_text), repr(pypdf_text[:100]))
+    return pypdf_text
+
+
+def _collect_page_ocr(future, idx: int, total_pages: int) -> str:
+    ocr_text = future.result()
+    if ocr_text:
+        ai_logger.info('Page %d/%d extracted via TESSERACT OCR. Length: %d chars.', idx + 1, total_pages, len(ocr_text))
+    else:
+        ai_logger.warning('Page %d/%d is EMPTY after all fallbacks.', idx + 1, total_pages)
+    return ocr_text
+
+
+def _iter_fitz_range(handle, start: int, end: int, total_pages: int, deadline: float = None):
+    """
+    Run the PyMuPDF -> pypdf -> Tesseract chain for pages [start, end) of a pooled handle,
+    yielding (page_index, page_text, used_fallback) in page order.
+    PyMuPDF text layers are read page by page and gibberish-scored in one batch, pypdf
+    fallbacks run page by page, and every page that still needs OCR is queued on the OCR
+    pool up front so those pages are recognised concurrently. Once the monotonic `deadline`
+    passes no further text layer is read and no further fallback started (the first page of
+    the document is always attempted); the deadline also caps each OCR timeout.
+    """
+    def out_of_time(idx):
+        return idx > 0 and deadline is not None and time.monotonic() >= deadline
+
+    layer_texts = []
+    with handle.lock:
+        doc = handle.fitz_doc()
+        for idx in range(start, end):
+            if out_of_time(idx):
+                break
+            layer_texts.append(doc[idx].get_text().strip())
+    gibberish = _score_pages_gibberish(layer_texts)
+
+    # Each entry is (idx, page_text, used_fallback) or (idx, ocr_future, True).
+    planned = []
+    for idx, page_text, is_gibberish in zip(range(start, end), layer_texts, gibberish):
+        if is_gibberish:
+            ai_logger.warning('Page %d/%d PyMuPDF extraction flagged as gibberish. Ignoring text.', idx + 1, total_pages)
+            page_text = ""
+
+        if page_text:
+            ai_logger.info('Page %d/%d extracted via PyMuPDF. Length: %d chars. Snippet: %s', 
+                           idx + 1, total_pages, len(page_text), repr(page_text[:100]))
+            planned.append((idx, page_text, False))
+            continue
+
+        # Fallback to pypdf, then OCR, on empty page. Text layers already read are kept past the
+        # deadline; the fallbacks are what it bounds.
+        if out_of_time(idx):
+            break
+        try:
+            pypdf_text = _extract_pypdf_page(handle, idx, total_pages)
+            if pypdf_text:
+                planned.append((idx, pypdf_text, True))
+            else:
+                planned.append((idx, _submit_page_ocr(handle, idx, total_pages, deadline), True))
+        except Exception as e:
+            ai_logger.warning('Fallback chain failed for page %d: %s', idx + 1, e)
+            planned.append((idx, "", False))
+
+    for idx, result, used_fallback in planned:
+        if isinstance(result, str):
+            yield idx, result, used_fallback
+        else:
+            ocr_text = _collect_page_ocr(result, idx, total_pages)
+            yield idx, ocr_text, bool(ocr_text)
+
+
+def _extract_page_range(file_path: str, start: int, end: int, deadline: float) -> list:
+    """
+    Process-pool worker: extract pages [start, end) using the worker process's own
+    document handles, which stay open across the chunks it is given.
+    Stops early once the wall-clock deadline passes; pages not reached are left out
+    of the result so the caller can defer them. Returns [(page_index, page_text, used_fallback)].
+    """
+    # The deadline crosses processes as wall-clock time; the OCR pool works in monotonic time.
+    monotonic_deadline = time.monotonic() + (deadline - time.time())
+    with open_document(file_path) as handle:
+        with handle.lock:
+            total_pages = len(handle.fitz_doc())
+        return list(_iter_fitz_range(handle, start, end, total_pages, monotonic_deadline))
+
+
+def _init_extraction_worker():
+    # Per-process state is set up here: workers start from a fresh interpreter, not a fork
+    # of the server. Each gets a share of the OCR pool so total tesseract concurrency
+    # stays near the CPU count; document handles are opened on first use.
+    ocr_pool.configure(max(1, ocr_pool.OCR_MAX_WORKERS // EXTRACTION_WORKERS))
+
+
+def _extraction_mp_context():
+    """
+    forkserver where available, else spawn. Forking the server would copy its threads'
+    locks (OCR pool, single-flight, logging) and MuPDF state into the workers mid-use.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _get_extraction_pool() -> ProcessPoolExecutor:
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            mp_context = _extraction_mp_context()
+            ai_logger.info('Starting extraction process pool (workers=%d, start=%s)',
+                           EXTRACTION_WORKERS, mp_context.get_start_method())
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_WORKERS, mp_context=mp_context, initializer=_init_extraction_worker,
+            )
+        return _extraction_pool
+
+
+def _reset_extraction_pool():
+    global _extraction_pool
+    with _extraction_pool_lock:
+        pool = _extraction_pool
+        _extraction_pool = None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_fitz_pages_parallel(file_path: str, page_limit: int, start_time: float, time_budget_sec: float):
+    """
+    Fan pages [0, page_limit) out to the process pool in EXTRACTION_CHUNK_PAGES ranges and
+    yield the results in page order as each range completes. Chunks are submitted front to
+    back so that, when the time budget runs out, it is the tail of the document that gets deferred.
+    """
+    remaining = time_budget_sec - (time.monotonic() - start_time)
+    deadline = time.time() + max(0.0, remaining)
+    pool = _get_extraction_pool()
+    futures = [
+        pool.submit(_extract_page_range, file_path, chunk_start, min(chunk_start + EXTRACTION_CHUNK_PAGES, page_limit), deadline)
+        for chunk_start in range(0, page_limit, EXTRACTION_CHUNK_PAGES)
+    ]
     try:
-        enc = tiktoken.get_encoding("cl100k_base")
-        tokens = enc.encode(text)
-        if len(tokens) == 0:
-            return True
-        density = len(text) / len(tokens)
-        
-        if density < 1.5:
-            ai_logger.warning(f"Gibberish detected: Extremely low token density ({density:.2f} < 1.5). Snippet: {repr(text[:50])}")
-            return True
-            
-        alpha_chars = [c for c in text if c.isalpha()]
-        if not alpha_chars:
-            return False
-            
-        upper_ratio = sum(1 for c in alpha_chars if c.isupper()) / len(alpha_chars)
-        space_ratio = text.count(' ') / len(text)
-        
-        # Random all-caps tends to have density < 3.0, while real headers > 3.5
-        if upper_ratio > 0.8 and density < 3.0:
-            ai_logger.warning(f"Gibberish detected: All-caps random text (Upper Ratio: {upper_ratio:.2f}, Density: {density:.2f}). Snippet: {repr(text[:50])}")
-            return True
-            
-        # Large blocks of unspaced garbage letters
-        if space_ratio < 0.05 and density < 2.5:
-            ai_logger.warning(f"Gibberish detected: Dense unspaced text (Space Ratio: {space_ratio:.2f}, Density: {density:.2f}). Snippet: {repr(text[:50])}")
-            return True
-            
-        # Miscellaneous highly suspicious density
-        if density < 2.0:
-            ai_logger.warning(f"Gibberish detected: Suspiciously low token density ({density:.2f} < 2.0). Snippet: {repr(text[:50])}")
-            return True
+        for future in futures:
+            yield from future.result()
+    finally:
+        # Also reached when the consumer stops early (e.g. a streaming client disconnects).
+        for future in futures:
+            future.cancel()
+
+
+def _iter_fitz_pages_serial(handle, first_page: int, page_limit: int, total_pages: int,
+                            start_time: float, time_budget_sec: float):
+    deadline = start_time + time_budget_sec
+    for chunk_start in range(first_page, page_limit, EXTRACTION_CHUNK_PAGES):
+        chunk_end = min(chunk_start + EXTRACTION_CHUNK_PAGES, page_limit)
+        produced = 0
+        for item in _iter_fitz_range(handle, chunk_start, chunk_end, total_pages, deadline):
+            produced += 1
+            yield item
+        if produced < chunk_end - chunk_start:
+            return
+
+
+def _iter_fitz_pages(file_path: str, start_time: float, time_budget_sec: float):
+    """Yields (page_index, page_text, used_fallback, total_pages) for pages extracted via PyMuPDF."""
+    with open_document(file_path) as handle:
+        with handle.lock:
+            total_pages = len(handle.fitz_doc())
+        ai_logger.info('PDF opened successfully with PyMuPDF: %s (pages=%d)', file_path, total_pages)
+
+        page_limit = total_pages
+        if INITIAL_EXTRACTION_MAX_PAGES > 0:
+            page_limit = min(total_pages, max(1, INITIAL_EXTRACTION_MAX_PAGES))
+
+        next_page = 0
+        if EXTRACTION_WORKERS > 1 and page_limit >= EXTRACTION_PARALLEL_MIN_PAGES:
+            try:
+                for idx, page_text, used_fallback in _iter_fitz_pages_parallel(file_path, page_limit, start_time, time_budget_sec):
+                    next_page = idx + 1
+                    yield idx, page_text, used_fallback, total_pages
+                return
+            except BrokenProcessPool as e:
+                ai_logger.error('Extraction process pool broke on %s, continuing serially from page %d: %s',
+                                file_path, next_page + 1, e)
+                _reset_extraction_pool()
+
+        for idx, page_text, used_fallback in _iter_fitz_pages_serial(
+            handle, next_page, page_limit, total_pages, start_time, time_budget_sec
+        ):
+            yield idx, page_text, used_fallback, total_pages
+
+
+def _iter_pypdf_pages(file_path: str, start_time: float, time_budget_sec: float):
+    """Yields (page_index, page_text, used_fallback, total_pages) using pypdf only."""
+    with open_document(file_path) as handle, handle.lock:
+        reader_pages = list(handle.pdf_reader().pages)
+    total_pages = len(reader_pages)
+    for idx, page in enumerate(reader_pages):
+        if idx > 0:
+            elapsed = time.monotonic() - start_time
+            hit_time_budget = elapsed >= time_budget_sec
+            hit_page_budget = (INITIAL_EXTRACTION_MAX_PAGES > 0 and idx >= INITIAL_EXTRACTION_MAX_PAGES)
             
-        return False
-    except Exception as e:
-        ai_logger.error(f"Error in gibberish detection: {e}")
-        return False
+            if hit_time_budget or hit_page_budget:
+                return
+                
+        page_text = (page.extract_text() or '').strip()
+        if page_text and _is_text_gibberish(page_text):
+            ai_logger.warning('Page %d/%d pypdf absolute fallback flagged as gibberish.', idx + 1, total_pages)
+            page_text = ""
 
-def _ocr_page_local(page: fitz.Page) -> str:
-    try:
-        ai_logger.info('Starting local Tesseract OCR on fallback page...')
-        start_t = time.monotonic()
-        # Reduced matrix from 2x to 1x to drastically improve extraction speed on low-CPU servers
-        pix = page.get_pixmap(matrix=fitz.Matrix(1.0, 1.0))
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
-        text = pytesseract.image_to_string(img).strip()
-        elapsed = time.monotonic() - start_t
-        ai_logger.info(f"Local OCR completed in {elapsed:.2f}s. Extracted {len(text)} chars. Snippet: {repr(text[:100])}")
-        return text
-    except Exception as e:
-        ai_logger.warning('Local OCR failed: %s', e)
-        return ''
+        if page_text:
+            ai_logger.info('Page %d/%d extracted entirely via pypdf fallback. Length: %d chars. Snippet: %s', 
+                           idx + 1, total_pages, len(page_text), repr(page_text[:100]))
+        else:
+            ai_logger.warning('Page %d/%d is EMPTY using absolute pypdf fallback.', idx + 1, total_pages)
+            
+        yield idx, page_text, bool(page_text), total_pages
 
 
-def extract_text_from_pdf(file_path: str) -> list:
+def iter_extracted_pages(file_path: str, time_budget_sec: float = None):
     """
-    Extract text from a PDF using PyMuPDF (fitz) first, fallback to pypdf.
-    Returns a list of page texts.
+    Generator form of extract_text_from_pdf. Yields (page_index, page_text, total_pages)
+    in page order as soon as each page is ready; pages deferred by the time budget are
+    yielded as '' at the end, so every index in range(total_pages) is produced.
+    If PyMuPDF fails part-way, the pypdf fallback restarts from page 0, so consumers should
+    assign by index. On failure a single error page (0, "[Error ...]", 1) is yielded.
     """
+    if time_budget_sec is None:
+        time_budget_sec = INITIAL_EXTRACTION_TIME_BUDGET_SEC
     start_time = time.monotonic()
     ai_logger.info('Starting extraction for %s', file_path)
-    if file_path.lower().endswith('.pdf'):
+    if not file_path.lower().endswith('.pdf'):
         try:
-            pages = []
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            ai_logger.info('Text file read successfully: %s', file_path)
+            yield 0, text, 1
+        except (OSError, UnicodeDecodeError) as e:
+            ai_logger.error('Error reading file: %s', e)
+            yield 0, f"[Error reading file: {e}]", 1
+        return
+
+    try:
+        for source in (_iter_fitz_pages, _iter_pypdf_pages):
             non_empty_pages = 0
             fallback_pages = 0
-            deferred_pages = 0
-
-            # Try PyMuPDF First
+            next_page = 0
+            total_pages = 0
             try:
-                fitz_doc = fitz.open(file_path)
-                total_pages = len(fitz_doc)
-                ai_logger.info('PDF opened successfully with PyMuPDF: %s (pages=%d)', file_path, total_pages)
-                
-                for idx in range(total_pages):
-                    if idx > 0:
-                        elapsed = time.monotonic() - start_time
-                        hit_time_budget = elapsed >= INITIAL_EXTRACTION_TIME_BUDGET_SEC
-                        hit_page_budget = (INITIAL_EXTRACTION_MAX_PAGES > 0 and idx >= INITIAL_EXTRACTION_MAX_PAGES)
-                        
-                        if hit_time_budget or hit_page_budget:
-                            deferred_pages = total_pages - idx
-                            ai_logger.info('Initial extraction budget reached; deferring %d pages', deferred_pages)
-                            break
-                    
-                    page_text = fitz_doc[idx].get_text().strip()
-                    
-                    if page_text and _is_text_gibberish(page_text):
-                        ai_logger.warning('Page %d/%d PyMuPDF extraction flagged as gibberish. Ignoring text.', idx + 1, total_pages)
-                        page_text = ""
-
-                    if page_text:
-                        ai_logger.info('Page %d/%d extracted via PyMuPDF. Length: %d chars. Snippet: %s', 
-                                       idx + 1, total_pages, len(page_text), repr(page_text[:100]))
-                    if not page_text:
-                        # Fallback to pypdf on empty page
-                        try:
-                            reader = PdfReader(file_path)
-                            if reader.is_encrypted:
-                                reader.decrypt("")
-                            pypdf_text = (reader.pages[idx].extract_text() or '').strip()
-                            
-                            if pypdf_text and _is_text_gibberish(pypdf_text):
-                                ai_logger.warning('Page %d/%d pypdf fallback flagged as gibberish too. Ignoring. Snippet: %s', idx + 1, total_pages, repr(pypdf_text[:100]))
-                                pypdf_text = ""
-                                
-                            if pypdf_text:
-                                page_text = pypdf_text
-                                ai_logger.info('Page %d/%d extracted via pypdf FALLBACK. Length: %d chars. Snippet: %s', 
-                                               idx + 1, total_pages, len(page_text), repr(page_text[:100]))
-                                fallback_pages += 1
-                            else:
-                                ocr_text = _ocr_page_local(fitz_doc[idx])
-                                if ocr_text:
-                                    page_text = ocr_text
-                                    ai_logger.info('Page %d/%d extracted via TESSERACT OCR. Length: %d chars.', idx + 1, total_pages, len(page_text))
-                                    fallback_pages += 1
-                                else:
-                                    ai_logger.warning('Page %d/%d is EMPTY after all fallbacks.', idx + 1, total_pages)
-                        except Exception as e:
-                            ai_logger.warning('Fallback chain failed for page %d: %s', idx + 1, e)
-                    
+                for idx, page_text, used_fallback, total_pages in source(file_path, start_time, time_budget_sec):
+                    # Pages skipped by a range that hit the deadline mid-way are deferred in place.
+                    for deferred_idx in range(next_page, idx):
+                        yield deferred_idx, '', total_pages
+                    next_page = idx + 1
                     if page_text:
                         non_empty_pages += 1
-                    pages.append(page_text)
-                
-                fitz_doc.close()
-                if deferred_pages > 0:
-                    pages.extend([''] * deferred_pages)
-                    
+                    if used_fallback:
+                        fallback_pages += 1
+                    yield idx, page_text, total_pages
             except Exception as e:
+                if source is _iter_pypdf_pages:
+                    raise
                 ai_logger.error('PyMuPDF failed on %s, falling back to pypdf completely: %s', file_path, e)
-                # Fallback to pypdf entirely
-                reader = PdfReader(file_path)
-                if reader.is_encrypted:
-                    reader.decrypt("")
-                total_pages = len(reader.pages)
-                for idx, page in enumerate(reader.pages):
-                    if idx > 0:
-                        elapsed = time.monotonic() - start_time
-                        hit_time_budget = elapsed >= INITIAL_EXTRACTION_TIME_BUDGET_SEC
-                        hit_page_budget = (INITIAL_EXTRACTION_MAX_PAGES > 0 and idx >= INITIAL_EXTRACTION_MAX_PAGES)
-                        
-                        if hit_time_budget or hit_page_budget:
-                            deferred_pages = total_pages - idx
-                            break
-                            
-                    page_text = (page.extract_text() or '').strip()
-                    if page_text and _is_text_gibberish(page_text):
-                        ai_logger.warning('Page %d/%d pypdf absolute fallback flagged as gibberish.', idx + 1, total_pages)
-                        page_text = ""
+                continue
 
-                    if page_text:
-                        ai_logger.info('Page %d/%d extracted entirely via pypdf fallback. Length: %d chars. Snippet: %s', 
-                                       idx + 1, total_pages, len(page_text), repr(page_text[:100]))
-                        non_empty_pages += 1
-                        fallback_pages += 1
-                    else:
-                        ai_logger.warning('Page %d/%d is EMPTY using absolute pypdf fallback.', idx + 1, total_pages)
-                        
-                    pages.append(page_text)
-                    
-                if deferred_pages > 0:
-                    pages.extend([''] * deferred_pages)
+            deferred_pages = total_pages - next_page
+            if deferred_pages > 0:
+                ai_logger.info('Initial extraction budget reached; deferring %d pages', deferred_pages)
+                for deferred_idx in range(next_page, total_pages):
+                    yield deferred_idx, '', total_pages
 
             elapsed = time.monotonic() - start_time
             ai_logger.info('Extracted %d pages from PDF: %s (non_empty=%d, fallback=%d, elapsed=%.2fs)',
-                           len(pages), file_path, non_empty_pages, fallback_pages, elapsed)
-            return pages
-            
-        except Exception as e:
-            ai_logger.exception('Error extracting PDF %s: %s', file_path, e)
-            return [f"[Error extracting PDF: {e}]"]
-    else:
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read()
-            ai_logger.info('Text file read successfully: %s', file_path)
-            return [text]
-        except (OSError, UnicodeDecodeError) as e:
-            ai_logger.error('Error reading file: %s', e)
-            return [f"[Error reading file: {e}]"]
+                           total_pages, file_path, non_empty_pages, fallback_pages, elapsed)
+            return
+    except Exception as e:
+        ai_logger.exception('Error extracting PDF %s: %s', file_path, e)
+        yield 0, f"[Error extracting PDF: {e}]", 1
 
 
-def extract_page_text(file_path: str, page_number: int, allow_vision: bool = True) -> str:
+def extract_text_from_pdf(file_path: str, time_budget_sec: float = None) -> list:
     """
-    Extract a single page with layered fallbacks:
-    1) PyMuPDF text layer, 2) pypdf text layer. No AI OCR.
+    Extract text from a PDF using PyMuPDF (fitz) first, fallback to pypdf.
+    Large documents are split into page ranges and extracted on a process pool.
+    Pages beyond `time_budget_sec` (default INITIAL_EXTRACTION_TIME_BUDGET_SEC) are deferred as ''.
+    Returns a list of page texts.
     """
-    ai_logger.info('Single-page extraction requested: %s page=%d', file_path, page_number)
+    pages = []
+    for idx, page_text, total_pages in iter_extracted_pages(file_path, time_budget_sec):
+        if len(pages) != total_pages:
+            pages = [''] * total_pages
+        pages[idx] = page_text
+    return pages
 
-    if page_number < 1:
-        raise ValueError('page_number must be >= 1')
-        
+
+def _extract_page_text_layer(handle, file_path: str, page_number: int) -> tuple:
+    """
+    PyMuPDF then pypdf text layer for one page. Returns (text, ocr_total_pages) where
+    ocr_total_pages is set only when the page exists in PyMuPDF and may still be OCR'd.
+    """
     text = ''
     pymupdf_was_gibberish = False
+    ocr_total_pages = None
     try:
-        doc = fitz.open(file_path)
-        total_pages = len(doc)
-        if page_number > total_pages:
-            doc.close()
-            raise ValueError(f'page_number {page_number} out of range (1-{total_pages})')
-            
-        text = (doc[page_number - 1].get_text() or '').strip()
+        with handle.lock:
+            doc = handle.fitz_doc()
+            total_pages = len(doc)
+            if page_number > total_pages:
+                raise ValueError(f'page_number {page_number} out of range (1-{total_pages})')
+
+            text = (doc[page_number - 1].get_text() or '').strip()
         
         if text and _is_text_gibberish(text):
             ai_logger.warning('Single-page PyMuPDF extraction flagged as gibberish.')
@@ -271,23 +530,21 @@ def extract_page_text(file_path: str, page_number: int, allow_vision: bool = Tru
         if text:
             ai_logger.info('Single-page extraction succeeded via PyMuPDF: %s page=%d. Extracted %d chars. Snippet: %s',
                            file_path, page_number, len(text), repr(text[:100]))
-            doc.close()
-            return text
-            
-        fallback_page = doc[page_number - 1]
+            return text, None
+
+        ocr_total_pages = total_pages
     except Exception as exc:
         ai_logger.warning('Single-page PyMuPDF extraction failed: %s page=%d error=%s', file_path, page_number, exc)
         
     if not text and not pymupdf_was_gibberish:
         try:
-            reader = PdfReader(file_path)
-            if reader.is_encrypted:
-                reader.decrypt("")
-            total_pages = len(reader.pages)
-            if page_number > total_pages:
-                raise ValueError(f'page_number {page_number} out of range (1-{total_pages})')
-                
-            text = (reader.pages[page_number - 1].extract_text() or '').strip()
+            with handle.lock:
+                reader = handle.pdf_reader()
+                total_pages = len(reader.pages)
+                if page_number > total_pages:
+                    raise ValueError(f'page_number {page_number} out of range (1-{total_pages})')
+
+                text = (reader.pages[page_number - 1].extract_text() or '').strip()
             
             if text and _is_text_gibberish(text):
                 ai_logger.warning('pypdf extracted gibberish for single page %d in %s, discarding.', page_number, file_path)
@@ -296,20 +553,142 @@ def extract_page_text(file_path: str, page_number: int, allow_vision: bool = Tru
             if text:
                 ai_logger.info('Single-page extraction succeeded via pypdf FALLBACK: %s page=%d. Extracted %d chars. Snippet: %s',
                                file_path, page_number, len(text), repr(text[:100]))
-                return text
+                return text, None
         except Exception as exc:
             ai_logger.warning('Single-page pypdf extraction failed: %s page=%d error=%s', file_path, page_number, exc)
 
-    if not text and fallback_page and allow_vision:
-        ai_logger.info('Single-page text layer empty or gibberish, performing OCR: %s page=%d', file_path, page_number)
-        text = _ocr_page_local(fallback_page)
-        if text:
-            return text
+    return '', ocr_total_pages
+
+
+def extract_pages_text(file_path: str, page_numbers: list, allow_vision: bool = True, deadline: float = None) -> dict:
+    """
+    Extract several pages of one document with the same layered fallbacks as extract_page_text.
+    Text layers are read page by page; pages that still need OCR are queued on the OCR pool and
+    recognised concurrently. No new page is started once the monotonic `deadline` has passed
+    (the first page is always attempted), and the deadline also caps each OCR timeout.
+    Returns {page_number: text} in request order for the pages attempted, '' where nothing was found.
+    """
+    results = {}
+    ocr_futures = {}
+    with open_document(file_path) as handle:
+        for position, page_number in enumerate(page_numbers):
+            if page_number < 1:
+                raise ValueError('page_number must be >= 1')
+            if position > 0 and deadline is not None and time.monotonic() >= deadline:
+                break
+
+            text, ocr_total_pages = _extract_page_text_layer(handle, file_path, page_number)
+            results[page_number] = text
+            if not text and ocr_total_pages and allow_vision:
+                ai_logger.info('Single-page text layer empty or gibberish, performing OCR: %s page=%d', file_path, page_number)
+                ocr_futures[page_number] = _submit_page_ocr(handle, page_number - 1, ocr_total_pages, deadline)
+
+        for page_number, future in ocr_futures.items():
+            results[page_number] = future.result()
+    return results
+
+
+def extract_page_text(file_path: str, page_number: int, allow_vision: bool = True) -> str:
+    """
+    Extract a single page with layered fallbacks:
+    1) PyMuPDF text layer, 2) pypdf text layer, 3) local Tesseract OCR (if allow_vision). No AI OCR.
+    Document handles come from the shared pool, so repeated calls do not reopen the file.
+    """
+    ai_logger.info('Single-page extraction requested: %s page=%d', file_path, page_number)
+
+    if page_number < 1:
+        raise ValueError('page_number must be >= 1')
+
+    text = extract_pages_text(file_path, [page_number], allow_vision=allow_vision).get(page_number)
+    if text:
+        return text
 
     ai_logger.info('Single-page text layer empty and no OCR: %s page=%d', file_path, page_number)
+    return None
 
 # Add more LangChain-powered functions as needed.
 
+# Concurrent identical quiz, summary and chat calls share one LLM call (see single_flight.py).
+llm_flights = SingleFlight('llm')
+
+QUIZ_CACHE_ENABLED = os.environ.get('QUIZ_CACHE_ENABLED', 'true').lower() == 'true'
+QUIZ_CACHE_MAX_VARIANTS = max(1, int(os.environ.get('QUIZ_CACHE_MAX_VARIANTS', '3')))
+# Model requests in flight at once for one batch of quizzes.
+QUIZ_BATCH_MAX_CONCURRENCY = max(1, int(os.environ.get('QUIZ_BATCH_MAX_CONCURRENCY', '8')))
+# Pages shorter than this are section breaks / cover pages and are not quizzed.
+QUIZ_MIN_WORDS = 50
+# Learners whose streaks fall in the same bucket share cached quizzes.
+QUIZ_STREAK_BUCKETS = (0, 1, 3, 5, 10)
+
+
+def _quiz_prompt(is_hard_mode):
+    return prompt_registry.get('quiz_hard' if is_hard_mode else 'quiz')
+
+
+def _quiz_chain(is_hard_mode):
+    return _quiz_prompt(is_hard_mode).chain(get_llm())
+
+
+def _quiz_page_text(page_content, is_hard_mode):
+    """The page as sent to the model: as much as fits next to the quiz prompt, cut at a sentence."""
+    packer = ContextPacker(QUIZ_PROMPT_TOKENS)
+    packer.add_fixed('system', _quiz_prompt(is_hard_mode).system_template)
+    page_text = packer.add_text('page', page_content, QUIZ_PAGE_TOKENS)
+    return page_text, packer.usage
+
+
+def _quiz_inputs(page_content, is_hard_mode, difficulty_level, streak):
+    page_text, usage = _quiz_page_text(page_content, is_hard_mode)
+    ai_logger.info('Quiz prompt tokens: %s', usage)
+    return {
+        "page_content": page_text,
+        "difficulty_level": difficulty_level,
+        "streak": streak,
+        "file_name": "Unknown.pdf",
+        "additional context": "None Provided"
+    }
+
+
+def _normalize_quiz_response(response):
+    ai_logger.info('Raw LLM chain response: %s', response)
+    # Transform 'answer' (A/B/C/D) to 'correctAnswer' (0/1/2/3) for frontend compatibility
+    letter_to_index = {"A": 0, "B": 1, "C": 2, "D": 3}
+    if response.get("questions") and isinstance(response["questions"], list):
+        valid_questions = []
+        for q in response["questions"]:
+            ans = q.get("answer")
+            if ans not in letter_to_index:
+                ai_logger.warning('Quiz question dropped: invalid answer letter %r', ans)
+                continue
+            q["correctAnswer"] = letter_to_index[ans]
+            del q["answer"]
+            if "choices" in q and isinstance(q["choices"], dict):
+                options = [q["choices"].get(l) for l in ["A", "B", "C", "D"]]
+                if any(o is None for o in options):
+                    ai_logger.warning('Quiz question dropped: missing choice option(s)')
+                    continue
+                q["options"] = options
+                del q["choices"]
+            valid_questions.append(q)
+        response["questions"] = valid_questions
+    # Ensure the response is JSON serializable (plain dict, no custom objects)
+    try:
+        return json.loads(json.dumps(response))
+    except Exception as e:
+        ai_logger.error('Failed to serialize LLM quiz response: %s', e)
+        return {"error": f"Failed to serialize LLM quiz response: {e}"}
+
+
+def _log_quiz_request(page_content, is_hard_mode, difficulty_level, streak):
+    ai_logger.info(
+        'mcq_quiz_generator received content: %s, is_hard_mode: %s, difficulty_level: %s, streak: %s',
+        page_content[:300],
+        is_hard_mode,
+        difficulty_level,
+        streak,
+    )
+
+
 @traceable(name="Generate MCQ Quiz")
 def mcq_quiz_generator(
     page_content: str,
@@ -320,122 +699,482 @@ def mcq_quiz_generator(
     """
     Use LLM to generate 3 MCQs with explanations for the given page content. Returns a list of question dicts.
     """
-    ai_logger.info(
-        'mcq_quiz_generator received content: %s, is_hard_mode: %s, difficulty_level: %s, streak: %s',
-        page_content[:300],
-        is_hard_mode,
-        difficulty_level,
-        streak,
-    )
+    _log_quiz_request(page_content, is_hard_mode, difficulty_level, streak)
+    try:
+        response = _quiz_chain(is_hard_mode).invoke(_quiz_inputs(page_content, is_hard_mode, difficulty_level, streak))
+        return _normalize_quiz_response(response)
+    except Exception as e:
+        ai_logger.error('Failed to run LLM chain for quiz: %s', e)
+        return {"error": f"Failed to run LLM chain for quiz: {e}"}
 
+
+@traceable(name="Generate MCQ Quiz")
+async def amcq_quiz_generator(
+    page_content: str,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+):
+    """Async mcq_quiz_generator for the ASGI serving path."""
+    _log_quiz_request(page_content, is_hard_mode, difficulty_level, streak)
     try:
-        if is_hard_mode and hasattr(prompt_library, 'prompt_generate_quiz_hard_v1'):
-            system_message = prompt_library.prompt_generate_quiz_hard_v1
-        else:
-            system_message = prompt_library.prompt_generate_quiz_v1
-            
-        user_message = "Generate MCQs for the provided content."
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("user", user_message)
-        ])
-        chain = prompt | llm | JsonOutputParser()
-        response = chain.invoke({
-            "page_content": page_content,
-            "difficulty_level": difficulty_level,
-            "streak": streak,
-            "file_name": "Unknown.pdf",
-            "additional context": "None Provided"
-        })
-        ai_logger.info('Raw LLM chain response: %s', response)
-        # Transform 'answer' (A/B/C/D) to 'correctAnswer' (0/1/2/3) for frontend compatibility
-        letter_to_index = {"A": 0, "B": 1, "C": 2, "D": 3}
-        if response.get("questions") and isinstance(response["questions"], list):
-            valid_questions = []
-            for q in response["questions"]:
-                ans = q.get("answer")
-                if ans not in letter_to_index:
-                    ai_logger.warning('Quiz question dropped: invalid answer letter %r', ans)
-                    continue
-                q["correctAnswer"] = letter_to_index[ans]
-                del q["answer"]
-                if "choices" in q and isinstance(q["choices"], dict):
-                    options = [q["choices"].get(l) for l in ["A", "B", "C", "D"]]
-                    if any(o is None for o in options):
-                        ai_logger.warning('Quiz question dropped: missing choice option(s)')
-                        continue
-                    q["options"] = options
-                    del q["choices"]
-                valid_questions.append(q)
-            response["questions"] = valid_questions
-        valid = response.get("valid", False)
-        explanation = response.get(
-            "validation_explanation", "No Response from LLM about explanation of validity."
-        )
-        # Ensure the response is JSON serializable (plain dict, no custom objects)
-        try:
-            serializable = json.loads(json.dumps(response))
-            return serializable
-        except Exception as e:
-            ai_logger.error('Failed to serialize LLM quiz response: %s', e)
-            return {"error": f"Failed to serialize LLM quiz response: {e}"}
+        # Packing the page tokenizes it; keep that off the event loop.
+        inputs = await asyncio.to_thread(_quiz_inputs, page_content, is_hard_mode, difficulty_level, streak)
+        response = await _quiz_chain(is_hard_mode).ainvoke(inputs)
+        return _normalize_quiz_response(response)
     except Exception as e:
         ai_logger.error('Failed to run LLM chain for quiz: %s', e)
         return {"error": f"Failed to run LLM chain for quiz: {e}"}
 
 
-@traceable(name="Chat with Document")
-def chat_with_document(message: str, context: str, document_name: str, history: list) -> str:
+def _streak_bucket(streak):
+    return max(bucket for bucket in QUIZ_STREAK_BUCKETS if bucket <= max(0, streak))
+
+
+def quiz_cache_key(page_content, is_hard_mode=False, difficulty_level="normal", streak=0):
     """
-    Chat with the AI about the current page of a document.
-    Uses conversation history for context continuity.
+    Hash of the normalised page text the model sees, the prompt version and the
+    parameters the chosen prompt actually uses, so e.g. the streak does not split the cache for normal mode.
     """
-    ai_logger.info('chat_with_document called with message: %s', message[:100])
+    prompt = _quiz_prompt(is_hard_mode)
+    system_message = prompt.system_template
+    params = {'hard': bool(is_hard_mode)}
+    if '{difficulty_level}' in system_message:
+        params['difficulty'] = difficulty_level
+    if '{streak}' in system_message:
+        params['streak'] = _streak_bucket(streak)
+    page_text, _ = _quiz_page_text(page_content, is_hard_mode)
+    return content_key('quiz', _cache_version(prompt), normalize_text(page_text), params)
+
+
+def _lookup_cached_quiz(key, exclude_variants):
+    """
+    Returns (hit, variants, replace_variant): hit is (quiz, variant_id) or None,
+    variants is None if the cache could not be read, and replace_variant is the
+    variant a newly generated quiz should overwrite (None to append).
+    """
+    store = get_result_store()
+    excluded = set(exclude_variants or ())
+    try:
+        variants = store.get_variants('quiz', key)
+    except sqlite3.Error as e:
+        ai_logger.warning('Quiz cache read failed: %s', e)
+        return None, None, None
+
+    if not variants:
+        return None, variants, None
+    # A not-quizable verdict does not change on retry.
+    verdicts = [(variant, quiz) for variant, quiz in variants if not quiz.get('valid')]
+    unseen = verdicts or [(variant, quiz) for variant, quiz in variants if variant not in excluded]
+    if unseen:
+        variant, quiz = random.choice(unseen)
+        try:
+            store.touch('quiz', key, variant)
+        except sqlite3.Error as e:
+            ai_logger.warning('Quiz cache touch failed: %s', e)
+        ai_logger.info('Quiz cache hit: key=%s variant=%s (variants=%d)', key[:12], variant, len(variants))
+        return (quiz, variant), variants, None
+    replace_variant = variants[0][0] if len(variants) >= QUIZ_CACHE_MAX_VARIANTS else None
+    return None, variants, replace_variant
+
+
+def _store_quiz(key, quiz, variants, replace_variant):
+    """Cache a freshly generated quiz; returns its variant id or None if it was not cached."""
+    # Failures and quizzes whose questions were all dropped are worth retrying, not caching.
+    cacheable = 'error' not in quiz and (quiz.get('questions') or quiz.get('valid') is False)
+    if not cacheable or variants is None:
+        return None
+    try:
+        variant = get_result_store().put('quiz', key, quiz, variant=replace_variant)
+    except sqlite3.Error as e:
+        ai_logger.warning('Quiz cache write failed: %s', e)
+        return None
+    ai_logger.info('Quiz cache stored: key=%s variant=%s', key[:12], variant)
+    return variant
+
+
+def generate_quiz_cached(
+    page_content: str,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+    exclude_variants=(),
+    key=None,
+):
+    """
+    mcq_quiz_generator behind the persistent quiz cache. Up to QUIZ_CACHE_MAX_VARIANTS
+    quizzes are kept per key: a cached variant not in `exclude_variants` (the ones the
+    learner has already seen) is served at random; once every variant has been seen a
+    new one is generated, replacing the oldest when the key is full.
+    Returns (quiz, variant_id, cached); variant_id is None when the result was not cached.
+    `key` is the quiz_cache_key, if the caller already has it.
+    """
+    if key is None:
+        key = quiz_cache_key(page_content, is_hard_mode, difficulty_level, streak)
+    if not QUIZ_CACHE_ENABLED:
+        quiz, _ = llm_flights.do(('quiz', key), mcq_quiz_generator, page_content, is_hard_mode, difficulty_level, streak)
+        return quiz, None, False
+
+    hit, variants, replace_variant = _lookup_cached_quiz(key, exclude_variants)
+    if hit is not None:
+        return hit[0], hit[1], True
+    (quiz, variant), _ = llm_flights.do(
+        ('quiz', key), _generate_and_store_quiz,
+        key, page_content, is_hard_mode, difficulty_level, streak, variants, replace_variant,
+    )
+    return quiz, variant, False
+
+
+def _generate_and_store_quiz(key, page_content, is_hard_mode, difficulty_level, streak, variants, replace_variant):
+    quiz = mcq_quiz_generator(page_content, is_hard_mode, difficulty_level, streak)
+    return quiz, _store_quiz(key, quiz, variants, replace_variant)
+
+
+async def agenerate_quiz_cached(
+    page_content: str,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+    exclude_variants=(),
+    key=None,
+):
+    """
+    Async generate_quiz_cached; the cache key (which tokenizes the page) and cache I/O
+    run on a worker thread. `key` is the quiz_cache_key, if the caller already has it.
+    """
+    if key is None:
+        key = await asyncio.to_thread(quiz_cache_key, page_content, is_hard_mode, difficulty_level, streak)
+    if not QUIZ_CACHE_ENABLED:
+        quiz, _ = await llm_flights.ado(
+            ('quiz', key), amcq_quiz_generator, page_content, is_hard_mode, difficulty_level, streak,
+        )
+        return quiz, None, False
+
+    hit, variants, replace_variant = await asyncio.to_thread(_lookup_cached_quiz, key, exclude_variants)
+    if hit is not None:
+        return hit[0], hit[1], True
+    (quiz, variant), _ = await llm_flights.ado(
+        ('quiz', key), _agenerate_and_store_quiz,
+        key, page_content, is_hard_mode, difficulty_level, streak, variants, replace_variant,
+    )
+    return quiz, variant, False
+
+
+async def _agenerate_and_store_quiz(key, page_content, is_hard_mode, difficulty_level, streak, variants, replace_variant):
+    quiz = await amcq_quiz_generator(page_content, is_hard_mode, difficulty_level, streak)
+    return quiz, await asyncio.to_thread(_store_quiz, key, quiz, variants, replace_variant)
+
+
+@traceable(name="Generate MCQ Quiz Batch")
+def mcq_quiz_generator_batch(
+    page_contents: list,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+):
+    """
+    mcq_quiz_generator for several pages in one chain.batch call, with at most
+    QUIZ_BATCH_MAX_CONCURRENCY requests to the model in flight. Quizzes come back in
+    page order; a page whose call failed gets an error dict.
+    """
+    ai_logger.info('mcq_quiz_generator_batch received %d page(s), is_hard_mode: %s, difficulty_level: %s, streak: %s',
+                   len(page_contents), is_hard_mode, difficulty_level, streak)
+    if not page_contents:
+        return []
+    inputs = [_quiz_inputs(page_content, is_hard_mode, difficulty_level, streak) for page_content in page_contents]
+    responses = _quiz_chain(is_hard_mode).batch(
+        inputs, config={'max_concurrency': QUIZ_BATCH_MAX_CONCURRENCY}, return_exceptions=True,
+    )
+    return [_quiz_batch_result(response) for response in responses]
+
+
+@traceable(name="Generate MCQ Quiz Batch")
+async def amcq_quiz_generator_batch(
+    page_contents: list,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+):
+    """Async mcq_quiz_generator_batch (abatch) for the ASGI serving path."""
+    ai_logger.info('amcq_quiz_generator_batch received %d page(s), is_hard_mode: %s, difficulty_level: %s, streak: %s',
+                   len(page_contents), is_hard_mode, difficulty_level, streak)
+    if not page_contents:
+        return []
+    inputs = [_quiz_inputs(page_content, is_hard_mode, difficulty_level, streak) for page_content in page_contents]
+    responses = await _quiz_chain(is_hard_mode).abatch(
+        inputs, config={'max_concurrency': QUIZ_BATCH_MAX_CONCURRENCY}, return_exceptions=True,
+    )
+    return [_quiz_batch_result(response) for response in responses]
+
+
+def _quiz_batch_result(response):
+    if isinstance(response, Exception):
+        ai_logger.error('Failed to run LLM chain for quiz: %s', response)
+        return {"error": f"Failed to run LLM chain for quiz: {response}"}
+    return _normalize_quiz_response(response)
+
+
+def _claim_quiz_batch(page_contents, is_hard_mode, difficulty_level, streak, exclude_variants):
+    """
+    Cache lookups and single-flight claims for a batch. Returns (keys, results, waiting,
+    leading): results holds (quiz, variant_id, True) for cache hits and None otherwise,
+    waiting maps keys another call is already generating to its future, and leading
+    maps the keys this call must generate to (page_content, variants, replace_variant,
+    future). A page repeated within the batch is generated once.
+    """
+    keys = [quiz_cache_key(page_content, is_hard_mode, difficulty_level, streak) for page_content in page_contents]
+    results = [None] * len(keys)
+    waiting = {}
+    leading = {}
+    for index, (page_content, key) in enumerate(zip(page_contents, keys)):
+        if key in waiting or key in leading:
+            continue
+        variants = replace_variant = None
+        if QUIZ_CACHE_ENABLED:
+            hit, variants, replace_variant = _lookup_cached_quiz(key, exclude_variants)
+            if hit is not None:
+                results[index] = (hit[0], hit[1], True)
+                continue
+        future, leader = llm_flights.claim(('quiz', key))
+        if leader:
+            leading[key] = (page_content, variants, replace_variant, future)
+        else:
+            waiting[key] = future
+    return keys, results, waiting, leading
+
+
+def _release_quiz_batch(leading, quizzes):
+    """Cache the generated quizzes and hand them to waiting callers; returns {key: flight value}."""
+    values = {}
+    for (key, (_, variants, replace_variant, future)), quiz in zip(leading.items(), quizzes):
+        # Same value shape as generate_quiz_cached's single-flight calls.
+        values[key] = (quiz, _store_quiz(key, quiz, variants, replace_variant)) if QUIZ_CACHE_ENABLED else quiz
+        llm_flights.release(('quiz', key), future, values[key])
+    return values
+
+
+def _fail_quiz_batch(leading, error):
+    for key, (_, _, _, future) in leading.items():
+        if not future.done():
+            llm_flights.release(('quiz', key), future, error=error)
+
+
+def _collect_quiz_batch(keys, results, values):
+    collected = list(results)
+    for index, key in enumerate(keys):
+        if collected[index] is not None:
+            continue
+        value = values[key]
+        if isinstance(value, Exception):
+            quiz, variant = {"error": f"Failed to run LLM chain for quiz: {value}"}, None
+        elif QUIZ_CACHE_ENABLED:
+            quiz, variant = value
+        else:
+            quiz, variant = value, None
+        collected[index] = (quiz, variant, False)
+    return collected
 
-    # Build conversation history string (last 6 messages to stay within token limits)
-    history_str = ""
-    for msg in history[-6:]:
+
+def generate_quizzes_cached(
+    page_contents: list,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+    exclude_variants=(),
+):
+    """
+    generate_quiz_cached for several pages: returns [(quiz, variant_id, cached)] in page
+    order. Cache misses are generated together by mcq_quiz_generator_batch; pages whose
+    quiz another request is already generating wait for that call instead.
+    """
+    keys, results, waiting, leading = _claim_quiz_batch(
+        page_contents, is_hard_mode, difficulty_level, streak, exclude_variants,
+    )
+    values = {}
+    if leading:
+        try:
+            quizzes = mcq_quiz_generator_batch(
+                [page_content for page_content, _, _, _ in leading.values()], is_hard_mode, difficulty_level, streak,
+            )
+            values.update(_release_quiz_batch(leading, quizzes))
+        except BaseException as e:
+            _fail_quiz_batch(leading, e)
+            raise
+    for key, future in waiting.items():
+        try:
+            values[key] = future.result()
+        except Exception as e:
+            values[key] = e
+    return _collect_quiz_batch(keys, results, values)
+
+
+async def agenerate_quizzes_cached(
+    page_contents: list,
+    is_hard_mode: bool = False,
+    difficulty_level: str = "normal",
+    streak: int = 0,
+    exclude_variants=(),
+):
+    """Async generate_quizzes_cached; cache I/O runs on a worker thread."""
+    keys, results, waiting, leading = await asyncio.to_thread(
+        _claim_quiz_batch, page_contents, is_hard_mode, difficulty_level, streak, exclude_variants,
+    )
+    values = {}
+    if leading:
+        try:
+            quizzes = await amcq_quiz_generator_batch(
+                [page_content for page_content, _, _, _ in leading.values()], is_hard_mode, difficulty_level, streak,
+            )
+            values.update(await asyncio.to_thread(_release_quiz_batch, leading, quizzes))
+        except BaseException as e:
+            _fail_quiz_batch(leading, e)
+            raise
+    for key, future in waiting.items():
+        try:
+            values[key] = await asyncio.shield(asyncio.wrap_future(future))
+        except Exception as e:
+            values[key] = e
+    return _collect_quiz_batch(keys, results, values)
+
+
+# Older turns than this are never considered, however short they are.
+CHAT_HISTORY_MAX_MESSAGES = 20
+
+
+def _chat_chain():
+    return prompt_registry.get('chat').chain(get_llm())
+
+
+def _chat_inputs(message: str, context: str, document_name: str, history: list,
+                 context_label: str = "Current page content") -> dict:
+    # The question and instructions go in whole; the context and then as many recent
+    # turns as fit share the rest of CHAT_PROMPT_TOKENS.
+    packer = ContextPacker(CHAT_PROMPT_TOKENS)
+    packer.add_fixed('system', prompt_registry.get('chat').system_template)
+    packer.add_fixed('document', f"{document_name}{context_label}")
+    packer.add_fixed('question', message)
+    context = packer.add_text('context', context, CHAT_CONTEXT_TOKENS)
+    turns = []
+    for msg in history[-CHAT_HISTORY_MAX_MESSAGES:]:
         role = "User" if msg.get("sender") == "user" else "Assistant"
         text = msg.get("text", "").strip()
         if text:
-            history_str += f"{role}: {text}\n"
-
-    system_content = (
-        "You are an intelligent AI learning assistant helping a user understand a document. "
-        "Answer questions based on the document page content provided below. "
-        "Be concise, educational, and encouraging. "
-        "If the user asks about something not present in the page content, acknowledge that and "
-        "answer from your general knowledge while noting the distinction. "
-        "Keep responses to 2-4 sentences unless a detailed explanation is genuinely needed.\n\n"
-        f"Document name: {document_name}\n\n"
-        f"Current page content:\n{context[:3000]}"
-    )
+            turns.append(f"{role}: {text}\n")
+    history_str = "".join(packer.add_recent('history', turns, CHAT_HISTORY_TOKENS))
+    ai_logger.info('Chat prompt tokens: %s', packer.usage)
 
     user_content = (
         f"Previous conversation:\n{history_str}\nCurrent question: {message}"
         if history_str
         else message
     )
+    return {
+        "document_name": document_name,
+        "context_label": context_label,
+        "context": context,
+        "user_content": user_content,
+    }
+
+
+CHAT_ERROR_REPLY = "I'm sorry, I encountered an error generating a response. Please try again."
+
+
+@traceable(name="Chat with Document")
+def chat_with_document(message: str, context: str, document_name: str, history: list,
+                       context_label: str = "Current page content") -> str:
+    """
+    Chat with the AI about the current page of a document.
+    Uses conversation history for context continuity.
+    """
+    ai_logger.info('chat_with_document called with message: %s', message[:100])
+    reply, _ = llm_flights.do(
+        _chat_flight_key(message, context, document_name, history, context_label),
+        _invoke_chat, message, context, document_name, history, context_label,
+    )
+    return reply
 
+
+def _chat_flight_key(message, context, document_name, history, context_label):
+    return ('chat', content_key(message, context, document_name, history, context_label))
+
+
+def _invoke_chat(message, context, document_name, history, context_label):
     try:
-        messages_list = [SystemMessage(content=system_content), HumanMessage(content=user_content)]
-        response = llm.invoke(messages_list)
+        response = _chat_chain().invoke(_chat_inputs(message, context, document_name, history, context_label))
         ai_logger.info('Chat response generated successfully')
         return response.content
     except Exception as e:
         ai_logger.error('chat_with_document failed: %s', e)
-        return "I'm sorry, I encountered an error generating a response. Please try again."
+        return CHAT_ERROR_REPLY
 
 
-@lru_cache(maxsize=256)
-@traceable(name="Summarize Page Content")
-def summarize_page(page_content: str) -> dict:
+@traceable(name="Chat with Document")
+async def achat_with_document(message: str, context: str, document_name: str, history: list,
+                              context_label: str = "Current page content") -> str:
+    """Async chat_with_document for the ASGI serving path."""
+    ai_logger.info('achat_with_document called with message: %s', message[:100])
+    reply, _ = await llm_flights.ado(
+        _chat_flight_key(message, context, document_name, history, context_label),
+        _ainvoke_chat, message, context, document_name, history, context_label,
+    )
+    return reply
+
+
+async def _ainvoke_chat(message, context, document_name, history, context_label):
+    try:
+        response = await _chat_chain().ainvoke(_chat_inputs(message, context, document_name, history, context_label))
+        ai_logger.info('Chat response generated successfully')
+        return response.content
+    except Exception as e:
+        ai_logger.error('achat_with_document failed: %s', e)
+        return CHAT_ERROR_REPLY
+
+
+def stream_chat_with_document(message: str, context: str, document_name: str, history: list,
+                              context_label: str = "Current page content"):
     """
-    Generate a structured summary for a single page of content.
-    Results are cached (LRU, 256 entries) to save on repeated LLM calls.
+    chat_with_document that yields the reply as text chunks while the model produces
+    it. Errors propagate to the caller, which may already have sent earlier chunks.
     """
-    ai_logger.info('summarize_page called (content length: %d)', len(page_content))
+    ai_logger.info('stream_chat_with_document called with message: %s', message[:100])
+    for chunk in _chat_chain().stream(_chat_inputs(message, context, document_name, history, context_label)):
+        if chunk.content:
+            yield chunk.content
+    ai_logger.info('Chat response streamed successfully')
+
+
+async def astream_chat_with_document(message: str, context: str, document_name: str, history: list,
+                                     context_label: str = "Current page content"):
+    """Async stream_chat_with_document for the ASGI serving path."""
+    ai_logger.info('astream_chat_with_document called with message: %s', message[:100])
+    async for chunk in _chat_chain().astream(_chat_inputs(message, context, document_name, history, context_label)):
+        if chunk.content:
+            yield chunk.content
+    ai_logger.info('Chat response streamed successfully')
+
+
+SUMMARY_CACHE_ENABLED = os.environ.get('SUMMARY_CACHE_ENABLED', 'true').lower() == 'true'
+
+
+def _summary_page_text(page_content):
+    """The page as sent to the model, cut at a sentence to SUMMARY_PAGE_TOKENS."""
+    packer = ContextPacker(SUMMARY_PROMPT_TOKENS)
+    packer.add_fixed('system', prompt_registry.get('summary').system_template)
+    page_text = packer.add_text('page', page_content, SUMMARY_PAGE_TOKENS)
+    return page_text, packer.usage
+
+
+def summary_cache_key(page_content):
+    """Hash of the normalised text the model actually sees plus the prompt version."""
+    page_text, _ = _summary_page_text(page_content)
+    return content_key(
+        'summary',
+        _cache_version(prompt_registry.get('summary')),
+        normalize_text(page_text),
+    )
 
+
+def _minimal_summary(page_content):
     word_count = len(page_content.split()) if page_content else 0
     if word_count < 15:
         return {
@@ -444,15 +1183,101 @@ def summarize_page(page_content: str) -> dict:
             "is_content_page": False,
             "one_liner": "This page contains minimal or no readable content.",
         }
+    return None
+
 
+def _lookup_summary(key):
     try:
-        system_message = prompt_library.prompt_summarize_page
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("user", "{page_content}"),
-        ])
-        chain = prompt | llm | JsonOutputParser()
-        response = chain.invoke({"page_content": page_content[:4000]})
+        cached = get_result_store().get('summary', key)
+    except sqlite3.Error as e:
+        ai_logger.warning('Summary cache read failed: %s', e)
+        return None
+    if cached is not None:
+        ai_logger.info('Summary cache hit: key=%s', key[:12])
+    return cached
+
+
+def _store_summary(key, summary):
+    if 'error' in summary:
+        return
+    try:
+        get_result_store().put('summary', key, summary, variant=0)
+    except sqlite3.Error as e:
+        ai_logger.warning('Summary cache write failed: %s', e)
+
+
+@traceable(name="Summarize Page Content")
+def summarize_page(page_content: str, key=None) -> dict:
+    """
+    Generate a structured summary for a single page of content.
+    Summaries are kept in the shared result store (see result_cache.py), keyed by
+    content hash, so they survive restarts and are shared across workers. Failures
+    are never cached, and concurrent calls for the same page share one generation.
+    `key` is the summary_cache_key, if the caller already has it.
+    """
+    ai_logger.info('summarize_page called (content length: %d)', len(page_content))
+    minimal = _minimal_summary(page_content)
+    if minimal is not None:
+        return minimal
+
+    if key is None:
+        key = summary_cache_key(page_content)
+    if SUMMARY_CACHE_ENABLED:
+        cached = _lookup_summary(key)
+        if cached is not None:
+            return cached
+    summary, _ = llm_flights.do(('summary', key), _generate_and_store_summary, key, page_content)
+    return summary
+
+
+@traceable(name="Summarize Page Content")
+async def asummarize_page(page_content: str, key=None) -> dict:
+    """
+    Async summarize_page; the cache key (which tokenizes the page) and cache I/O run
+    on a worker thread. `key` is the summary_cache_key, if the caller already has it.
+    """
+    ai_logger.info('asummarize_page called (content length: %d)', len(page_content))
+    minimal = _minimal_summary(page_content)
+    if minimal is not None:
+        return minimal
+
+    if key is None:
+        key = await asyncio.to_thread(summary_cache_key, page_content)
+    if SUMMARY_CACHE_ENABLED:
+        cached = await asyncio.to_thread(_lookup_summary, key)
+        if cached is not None:
+            return cached
+    summary, _ = await llm_flights.ado(('summary', key), _agenerate_and_store_summary, key, page_content)
+    return summary
+
+
+def _generate_and_store_summary(key, page_content):
+    summary = _generate_summary(page_content)
+    if SUMMARY_CACHE_ENABLED:
+        _store_summary(key, summary)
+    return summary
+
+
+async def _agenerate_and_store_summary(key, page_content):
+    summary = await _agenerate_summary(page_content)
+    if SUMMARY_CACHE_ENABLED:
+        await asyncio.to_thread(_store_summary, key, summary)
+    return summary
+
+
+def _summary_chain():
+    return prompt_registry.get('summary').chain(get_llm())
+
+
+def _summary_inputs(page_content):
+    page_text, usage = _summary_page_text(page_content)
+    ai_logger.info('Summary prompt tokens: %s', usage)
+    return {"page_content": page_text}
+
+
+def _generate_summary(page_content):
+    try:
+        response = _summary_chain().invoke(_summary_inputs(page_content))
         ai_logger.info('Page summary generated successfully')
 
         # Ensure serialisable
@@ -460,3 +1285,14 @@ def summarize_page(page_content: str) -> dict:
     except Exception as e:
         ai_logger.error('summarize_page failed: %s', e)
         return {"error": f"Failed to generate summary: {e}"}
+
+
+async def _agenerate_summary(page_content):
+    try:
+        inputs = await asyncio.to_thread(_summary_inputs, page_content)
+        response = await _summary_chain().ainvoke(inputs)
+        ai_logger.info('Page summary generated successfully')
+        return json.loads(json.dumps(response))
+    except Exception as e:
+        ai_logger.error('summarize_page failed: %s', e)
+        return {"error": f"Failed to generate summary: {e}"}
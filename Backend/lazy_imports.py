@@ -0,0 +1,57 @@
+# lazy_imports.py
+"""
+Deferred imports for a fast, offline-safe startup.
+
+Importing the backend used to load PyMuPDF, pypdf, pytesseract, PIL, numpy,
+tiktoken, langchain_openai and langsmith before the first request, most of which
+a given worker may never need (a worker serving cached pages never renders a page
+or calls the LLM). Heavy modules are bound to a LazyModule instead, which imports
+the real module on first attribute access; after that, each attribute is cached on
+the proxy, so hot paths pay a plain attribute lookup.
+
+`traceable` is langsmith's decorator when LangSmith tracing is switched on and a
+no-op otherwise, so langsmith is only imported by processes that actually trace.
+"""
+import importlib
+import os
+import threading
+
+_TRACING_ENV_VARS = ('LANGSMITH_TRACING', 'LANGSMITH_TRACING_V2', 'LANGCHAIN_TRACING_V2')
+
+
+class LazyModule:
+    """Stands in for `import name`; the import happens on first attribute access."""
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def _load(self):
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, attr):
+        # Only called for attributes not cached on the proxy yet.
+        value = getattr(self._load(), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        state = 'loaded' if self.__module is not None else 'not loaded'
+        return f'<lazy module {self.__name!r} ({state})>'
+
+
+def tracing_enabled():
+    return any(os.environ.get(name, 'false').lower() == 'true' for name in _TRACING_ENV_VARS)
+
+
+def traceable(**kwargs):
+    """langsmith.traceable(**kwargs) if tracing is on when the function is defined, else a no-op."""
+    if tracing_enabled():
+        from langsmith import traceable as langsmith_traceable
+        return langsmith_traceable(**kwargs)
+    return lambda fn: fn
@@ -0,0 +1,59 @@
+# llm_backends.py
+"""
+Chat model backends, selected with LLM_BACKEND.
+
+  openai   ChatOpenAI (LLM_MODEL, default gpt-3.5-turbo; LLM_TEMPERATURE, default 0.2)
+  fake     FakeChatModel from fake_llm.py: offline and deterministic, with
+           configurable latency and token rate, answering quiz, summary and chat
+           prompts in the shape the app expects
+
+Every backend is a langchain chat model, so the prompt registry chains, batching,
+async calls and streaming work unchanged. Backend modules are imported by
+create_llm(), not here, to keep app startup slim.
+
+Results from a backend other than openai are cached under that backend's tag
+(`cache_tag()`), so a load test against the shared result store can never leave
+fake quizzes or summaries behind for real users.
+"""
+import os
+
+from logger import get_logger
+
+ai_logger = get_logger('AI')
+
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai').lower()
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-3.5-turbo')
+LLM_TEMPERATURE = float(os.environ.get('LLM_TEMPERATURE', '0.2'))
+
+
+def _create_openai():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE)
+
+
+def _create_fake():
+    from fake_llm import FakeChatModel
+    return FakeChatModel()
+
+
+BACKENDS = {
+    'openai': _create_openai,
+    'fake': _create_fake,
+}
+DEFAULT_BACKEND = 'openai'
+
+
+def create_llm(name=None):
+    name = (name or LLM_BACKEND).lower()
+    factory = BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f'Unknown LLM_BACKEND {name!r}; expected one of: {", ".join(sorted(BACKENDS))}')
+    llm = factory()
+    ai_logger.info('LLM backend: %s (%s)', name, getattr(llm, 'model_name', None) or type(llm).__name__)
+    return llm
+
+
+def cache_tag(name=None):
+    """None for the default backend (its cache keys predate backends), else the backend name."""
+    name = (name or LLM_BACKEND).lower()
+    return None if name == DEFAULT_BACKEND else name
@@ -0,0 +1,176 @@
+# ocr_pool.py
+"""
+Bounded Tesseract OCR pool.
+
+Pages are rendered by the caller (PyMuPDF documents are not thread-safe) and the
+resulting images are OCR'd concurrently here. pytesseract runs each image in its
+own tesseract process, so a thread pool is enough to keep several CPUs busy.
+Every page gets its own timeout, and callers may pass an overall monotonic
+deadline so one pathological page cannot consume a whole request budget.
+
+Pages are rendered straight to 8-bit grayscale and wrapped as PIL images over the
+pixmap's sample buffer, with no PNG encode/decode round-trip.
+
+Adaptive DPI (OCR_ADAPTIVE_DPI, off by default) re-renders a page whose mean word
+confidence is low at OCR_HIGH_RES_SCALE, recognises it again and keeps the more
+confident result. It reads word boxes with image_to_data, so the text is rebuilt
+from them (same words, slightly different line breaks than image_to_string), and a
+low-confidence page costs up to two OCR passes, the second on a larger image.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_imports import LazyModule
+from logger import get_logger
+
+fitz = LazyModule('fitz')  # PyMuPDF
+pytesseract = LazyModule('pytesseract')
+Image = LazyModule('PIL.Image')
+
+ai_logger = get_logger('AI')
+
+OCR_MAX_WORKERS = max(1, int(os.environ.get('OCR_MAX_WORKERS', str(os.cpu_count() or 1))))
+OCR_PAGE_TIMEOUT_SEC = max(1.0, float(os.environ.get('OCR_PAGE_TIMEOUT_SEC', '15')))
+OCR_ADAPTIVE_DPI = os.environ.get('OCR_ADAPTIVE_DPI', 'false').lower() == 'true'
+OCR_MIN_CONFIDENCE = float(os.environ.get('OCR_MIN_CONFIDENCE', '60'))
+# Reduced matrix from 2x to 1x to drastically improve extraction speed on low-CPU servers
+OCR_BASE_SCALE = 1.0
+OCR_HIGH_RES_SCALE = max(OCR_BASE_SCALE, float(os.environ.get('OCR_HIGH_RES_SCALE', '2.0')))
+# A second, high-resolution pass is only started if at least this much of the page timeout is left.
+OCR_MIN_RETRY_SEC = 1.0
+
+_executor = None
+_executor_lock = threading.Lock()
+_max_workers = OCR_MAX_WORKERS
+
+
+def configure(max_workers):
+    """Resize the pool; takes effect the next time the pool is created."""
+    global _max_workers
+    _max_workers = max(1, int(max_workers))
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix='ocr')
+        return _executor
+
+
+def render_page_for_ocr(page, scale=OCR_BASE_SCALE):
+    """Render `page` as an 8-bit grayscale PIL image that shares the pixmap's sample buffer."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+    image = Image.frombuffer('L', (pix.width, pix.height), pix.samples, 'raw', 'L', pix.stride, 1)
+    # pytesseract passes tesseract a temp file in image.format; PPM (P5/PGM for 'L') is written
+    # raw, where the PNG default would deflate every page only for tesseract to inflate it again.
+    image.format = 'PPM'
+    return image
+
+
+def _text_from_ocr_data(data):
+    lines = []
+    current_key = None
+    words = []
+    for idx, word in enumerate(data['text']):
+        word = (word or '').strip()
+        if not word:
+            continue
+        key = (data['block_num'][idx], data['par_num'][idx], data['line_num'][idx])
+        if key != current_key:
+            if words:
+                lines.append(' '.join(words))
+            if current_key is not None and key[:2] != current_key[:2]:
+                lines.append('')
+            current_key = key
+            words = []
+        words.append(word)
+    if words:
+        lines.append(' '.join(words))
+    return '\n'.join(lines).strip()
+
+
+def _mean_confidence(data, image):
+    confidences = [
+        float(conf) for word, conf in zip(data['text'], data['conf'])
+        if (word or '').strip() and float(conf) >= 0
+    ]
+    if confidences:
+        return sum(confidences) / len(confidences)
+    # No words at all: a near-uniform raster is a blank page and not worth a second pass.
+    low, high = image.getextrema()
+    return 100.0 if high - low < 32 else 0.0
+
+
+def _recognise(image, timeout):
+    """Returns (text, mean_confidence); confidence is None when adaptive DPI is off."""
+    if not OCR_ADAPTIVE_DPI:
+        return pytesseract.image_to_string(image, timeout=timeout).strip(), None
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT, timeout=timeout)
+    return _text_from_ocr_data(data), _mean_confidence(data, image)
+
+
+def _run_ocr(image, label, deadline, rerender):
+    timeout = OCR_PAGE_TIMEOUT_SEC
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            ai_logger.warning('Skipping OCR for %s: time budget exhausted before it started', label)
+            return ''
+    try:
+        ai_logger.info('Starting local Tesseract OCR on fallback page %s...', label)
+        start_t = time.monotonic()
+        page_deadline = start_t + timeout
+        text, confidence = _recognise(image, timeout)
+
+        if (
+            confidence is not None
+            and confidence < OCR_MIN_CONFIDENCE
+            and rerender is not None
+            and OCR_HIGH_RES_SCALE > OCR_BASE_SCALE
+            and page_deadline - time.monotonic() >= OCR_MIN_RETRY_SEC
+        ):
+            ai_logger.info('Low OCR confidence for %s (%.1f < %.1f); re-rendering at %.1fx',
+                           label, confidence, OCR_MIN_CONFIDENCE, OCR_HIGH_RES_SCALE)
+            try:
+                hi_text, hi_confidence = _recognise(rerender(OCR_HIGH_RES_SCALE), page_deadline - time.monotonic())
+                if hi_confidence > confidence:
+                    text, confidence = hi_text, hi_confidence
+            except Exception as e:
+                ai_logger.warning('High-resolution OCR retry failed for %s: %s', label, e)
+
+        elapsed = time.monotonic() - start_t
+        ai_logger.info(f"Local OCR completed in {elapsed:.2f}s. Extracted {len(text)} chars. Snippet: {repr(text[:100])}")
+        return text
+    except Exception as e:
+        ai_logger.warning('Local OCR failed for %s (timeout=%.1fs): %s', label, timeout, e)
+        return ''
+
+
+def submit(image, label='page', deadline=None, rerender=None):
+    """
+    Queue one rendered page for OCR; returns a Future resolving to the page text.
+    `rerender(scale)` must return the same page rendered at `scale`; it enables the
+    adaptive high-resolution retry and is called from the OCR thread.
+    """
+    return _get_executor().submit(_run_ocr, image, label, deadline, rerender)
+
+
+def ocr_images(images, labels=None, deadline=None):
+    """OCR `images` concurrently and return their texts in input order."""
+    labels = labels or [f'{idx + 1}/{len(images)}' for idx in range(len(images))]
+    futures = [submit(image, label, deadline) for image, label in zip(images, labels)]
+    return [future.result() for future in futures]
+
+
+def _reset_after_fork():
+    # Worker threads do not survive fork; children build their own pool on first use.
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
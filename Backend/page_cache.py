@@ -0,0 +1,122 @@
+# page_cache.py
+"""
+In-process LRU of hot page texts in front of the on-disk page store.
+
+Readers flipping through one document hit the same few pages over and over, so
+page texts are kept in memory keyed by (document, page index) and evicted by total
+size in bytes. Each document entry remembers the signature (blob generation, write
+count; see PageStore.signature) of the store it was read from; a lookup whose signature no longer matches drops the
+document, which covers writes made by other gunicorn workers. Writers in this process
+call invalidate() directly.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+HOT_PAGE_CACHE_MAX_BYTES = max(0, int(os.environ.get('HOT_PAGE_CACHE_MAX_MB', '64'))) * 1024 * 1024
+
+
+class HotPageCache:
+    def __init__(self, max_bytes=HOT_PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()   # (doc_key, page_index) -> (text, size)
+        self._documents = {}          # doc_key -> (signature, total_pages, set of cached page indices)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get_range(self, doc_key, signature, start, end):
+        """
+        Pages [start, end) and the page count if every one of them is cached under
+        `signature`, else None. `end=None` means through the last page.
+        """
+        with self._lock:
+            document = self._documents.get(doc_key)
+            if document is not None and document[0] != signature:
+                self._drop_document(doc_key)
+                document = None
+            if document is None:
+                self._misses += 1
+                return None
+            total_pages = document[1]
+            end = total_pages if end is None else min(end, total_pages)
+            pages = []
+            for page_index in range(max(0, start), end):
+                entry = self._pages.get((doc_key, page_index))
+                if entry is None:
+                    self._misses += 1
+                    return None
+                pages.append(entry[0])
+            for page_index in range(max(0, start), end):
+                self._pages.move_to_end((doc_key, page_index))
+            self._hits += 1
+            return pages, total_pages
+
+    def put_range(self, doc_key, signature, start, pages, total_pages):
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            document = self._documents.get(doc_key)
+            if document is not None and (document[0] != signature or document[1] != total_pages):
+                self._drop_document(doc_key)
+                document = None
+            if document is None:
+                document = self._documents[doc_key] = (signature, total_pages, set())
+            for page_index, text in enumerate(pages, start=max(0, start)):
+                key = (doc_key, page_index)
+                previous = self._pages.pop(key, None)
+                if previous is not None:
+                    self._bytes -= previous[1]
+                    document[2].discard(page_index)
+                size = sys.getsizeof(text)
+                if size > self.max_bytes:
+                    continue
+                self._pages[key] = (text, size)
+                self._bytes += size
+                document[2].add(page_index)
+            while self._bytes > self.max_bytes and self._pages:
+                (evicted_doc, evicted_page), (_, size) = self._pages.popitem(last=False)
+                self._bytes -= size
+                self._evictions += 1
+                self._release_page(evicted_doc, evicted_page)
+            if not document[2]:
+                self._documents.pop(doc_key, None)
+
+    def invalidate(self, doc_key):
+        with self._lock:
+            self._drop_document(doc_key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRate': round(self._hits / lookups, 4) if lookups else None,
+                'evictions': self._evictions,
+                'documents': len(self._documents),
+                'pages': len(self._pages),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+            }
+
+    def _drop_document(self, doc_key):
+        document = self._documents.pop(doc_key, None)
+        if document is None:
+            return
+        for page_index in document[2]:
+            self._bytes -= self._pages.pop((doc_key, page_index))[1]
+
+    def _release_page(self, doc_key, page_index):
+        document = self._documents.get(doc_key)
+        if document is None:
+            return
+        document[2].discard(page_index)
+        if not document[2]:
+            del self._documents[doc_key]
+
+
+hot_pages = HotPageCache()
@@ -0,0 +1,428 @@
+# page_store.py
+"""
+Binary, memory-mapped store for extracted page text.
+
+Uploads are stored as `<sha256>.<ext>`, so a document's pages live next to it in two
+files keyed by that content hash:
+
+  <file>.pages.idx   header (page count, live bytes, blob generation, write count, flags)
+                     + one fixed-size (offset, length) record per page
+  <file>.pages.bin   UTF-8 page texts, append-only
+
+Reading page N maps the index, unpacks one record and slices the blob, so serving a
+single page costs O(1) regardless of document size. Updating a page appends its text
+to the blob and patches its index record in place; the blob is compacted by a full
+rewrite once superseded text outweighs live text.
+
+Several gunicorn threads and workers can hydrate the same document at once, so every
+access holds a per-document lock: a thread lock inside the process plus an flock on
+`<file>.pages.lock` across processes (shared for reads, exclusive for writes). Full
+rewrites go to temp files that are fsync'd and renamed into place, and the index
+header carries the generation stamped at the start of the blob it belongs to, so a
+crash between the two renames is detected instead of serving text from the wrong
+blob. Every write also bumps the header's write count, which together with the blob
+generation is the store's signature: unlike the index file's mtime it changes on
+every write, however coarse the filesystem's timestamps. Writes merge with what is
+already on disk: a placeholder ('' or the caller's unresolved marker) never replaces
+text another worker has already stored.
+
+A writer that fills the store in several flushes marks it incomplete until the last
+one (`complete=False`), so readers can tell a finished document from one still being
+written, or left half-written by a crashed worker.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+from logger import get_logger
+
+system_logger = get_logger('SYSTEM')
+
+INDEX_SUFFIX = '.pages.idx'
+BLOB_SUFFIX = '.pages.bin'
+LEGACY_JSON_SUFFIX = '.pages.json'
+LOCK_SUFFIX = '.pages.lock'
+
+_MAGIC = b'DSPAGES3'
+# magic, page count, live (referenced) blob bytes, blob generation, write count, flags
+_HEADER = struct.Struct('<8sIQ8sQI')
+_FLAG_INCOMPLETE = 1
+_RECORD = struct.Struct('<QI')      # blob offset, byte length
+_GENERATION_SIZE = 8                # the blob starts with its generation; page texts follow
+# Compact once the blob is this many times larger than the live text (plus slack for small docs).
+_COMPACT_RATIO = 2
+_COMPACT_SLACK_BYTES = 1024 * 1024
+
+
+class PageStoreError(Exception):
+    pass
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.RLock()
+        return lock
+
+
+def _fsync_replace(tmp_path, path):
+    with open(tmp_path, 'rb') as tmp_file:
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _set_complete(flags, complete):
+    if complete is None:
+        return flags
+    return flags & ~_FLAG_INCOMPLETE if complete else flags | _FLAG_INCOMPLETE
+
+
+def _map_file(file_obj):
+    size = os.fstat(file_obj.fileno()).st_size
+    if size == 0:
+        return None
+    return mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PageStore:
+    """
+    `placeholders` lists texts that stand for "no text yet", least informative first;
+    on write, a page is only replaced by something at least as informative as what is
+    stored (any real text outranks every placeholder).
+    """
+
+    def __init__(self, file_path, placeholders=('',)):
+        self.file_path = file_path
+        self.index_path = f'{file_path}{INDEX_SUFFIX}'
+        self.blob_path = f'{file_path}{BLOB_SUFFIX}'
+        self.legacy_json_path = f'{file_path}{LEGACY_JSON_SUFFIX}'
+        self.lock_path = f'{file_path}{LOCK_SUFFIX}'
+        self.placeholders = tuple(placeholders)
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def signature(self):
+        """
+        (blob generation, write count) as integers, or None if there is no readable
+        store; changes on every write.
+        """
+        state = self.state()
+        return state[0] if state else None
+
+    def state(self):
+        """(signature, complete) from one header read, or None if there is no readable store."""
+        with self._locked(exclusive=False):
+            try:
+                with open(self.index_path, 'rb') as index_file:
+                    _, _, generation, write_count, flags = self._read_header(index_file.read(_HEADER.size))
+            except FileNotFoundError:
+                return None
+            except PageStoreError as exc:
+                system_logger.warning('Unreadable page store %s: %s', self.index_path, exc)
+                return None
+        signature = (int.from_bytes(generation, 'little', signed=True), write_count)
+        return signature, not flags & _FLAG_INCOMPLETE
+
+    # -- reads -------------------------------------------------------------
+
+    def page_count(self):
+        """Number of pages, or None if the document has no store yet."""
+        with self._locked(exclusive=False):
+            try:
+                with open(self.index_path, 'rb') as index_file:
+                    return self._read_header(index_file.read(_HEADER.size))[0]
+            except FileNotFoundError:
+                return None
+
+    def read_page(self, page_index):
+        """Text of one page (0-based), or None if there is no store or the index is out of range."""
+        pages = self.read_page_range(page_index, page_index + 1)
+        return pages[0] if pages else None
+
+    def read_pages(self):
+        """All page texts, or None if the document has no store yet."""
+        return self.read_page_range(0, None)
+
+    def read_page_range(self, start, end):
+        """Texts of pages [start, end) clipped to the document, or None if there is no store."""
+        with self._locked(exclusive=False):
+            return self._read_page_range(start, end)
+
+    def read_changed_pages(self, known_records=None):
+        """
+        (records, {page_index: text}) read under one lock, or None if there is no store.
+        `records` holds each page's (offset, length) record, which changes whenever the
+        page is written; texts are returned only for pages whose record differs from
+        `known_records` (every page when it is None), so callers can track updates
+        without rereading the whole document.
+        """
+        with self._locked(exclusive=False):
+            try:
+                with open(self.index_path, 'rb') as index_file:
+                    index_bytes = index_file.read()
+            except FileNotFoundError:
+                return None
+            page_count = self._read_header(index_bytes[:_HEADER.size])[0]
+            self._check_index_size(len(index_bytes), page_count)
+            records = [
+                _RECORD.unpack_from(index_bytes, _HEADER.size + page_index * _RECORD.size)
+                for page_index in range(page_count)
+            ]
+            known = [tuple(record) for record in known_records] if known_records is not None else []
+            changed = [
+                page_index for page_index, record in enumerate(records)
+                if page_index >= len(known) or known[page_index] != record
+            ]
+            texts = {}
+            # Changed pages are usually clustered (one hydrated batch), so read them as runs.
+            run_start = None
+            for position, page_index in enumerate(changed):
+                if run_start is None:
+                    run_start = page_index
+                if position + 1 == len(changed) or changed[position + 1] != page_index + 1:
+                    for offset, text in enumerate(self._read_page_range(run_start, page_index + 1)):
+                        texts[run_start + offset] = text
+                    run_start = None
+            return records, texts
+
+    def _read_page_range(self, start, end):
+        try:
+            index_file = open(self.index_path, 'rb')
+        except FileNotFoundError:
+            return None
+        with index_file, open(self.blob_path, 'rb') as blob_file:
+            index_map = _map_file(index_file)
+            blob_map = _map_file(blob_file)
+            try:
+                if index_map is None:
+                    raise PageStoreError(f'empty page index: {self.index_path}')
+                page_count, _, generation, _, _ = self._read_header(index_map[:_HEADER.size])
+                self._check_index_size(len(index_map), page_count)
+                if blob_map is None or blob_map[:_GENERATION_SIZE] != generation:
+                    raise PageStoreError(f'page index does not match {self.blob_path}')
+                end = page_count if end is None else min(end, page_count)
+                pages = []
+                for page_index in range(max(0, start), end):
+                    offset, length = _RECORD.unpack_from(index_map, _HEADER.size + page_index * _RECORD.size)
+                    if length == 0:
+                        pages.append('')
+                        continue
+                    if offset < _GENERATION_SIZE or offset + length > len(blob_map):
+                        raise PageStoreError(f'page {page_index} points past the end of {self.blob_path}')
+                    pages.append(blob_map[offset:offset + length].decode('utf-8'))
+                return pages
+            finally:
+                if index_map is not None:
+                    index_map.close()
+                if blob_map is not None:
+                    blob_map.close()
+
+    def _read_header(self, header_bytes):
+        if len(header_bytes) < _HEADER.size:
+            raise PageStoreError(f'truncated page index: {self.index_path}')
+        magic, page_count, live_bytes, generation, write_count, flags = _HEADER.unpack(header_bytes)
+        if magic != _MAGIC:
+            raise PageStoreError(f'not a page index: {self.index_path}')
+        return page_count, live_bytes, generation, write_count, flags
+
+    def _check_index_size(self, index_size, page_count):
+        # A short index would make the record reads below fail with struct.error.
+        if index_size < _HEADER.size + page_count * _RECORD.size:
+            raise PageStoreError(f'truncated page index: {self.index_path}')
+
+    def _stored_header(self):
+        """(write count, flags) of the stored index, (0, 0) if there is no readable one."""
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                return self._read_header(index_file.read(_HEADER.size))[3:]
+        except (FileNotFoundError, PageStoreError):
+            return 0, 0
+
+    # -- locking -----------------------------------------------------------
+
+    @contextmanager
+    def _locked(self, exclusive):
+        # flock conflicts between separate open()s even inside one process, so the thread
+        # lock is only needed to serialise writers where flock is unavailable. Callers must
+        # not nest _locked() on the same store.
+        if fcntl is None:
+            with _thread_lock(os.path.abspath(self.lock_path)):
+                yield
+            return
+        with open(self.lock_path, 'a+b') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _rank(self, text):
+        try:
+            return self.placeholders.index(text)
+        except ValueError:
+            return len(self.placeholders)
+
+    def _keeps_existing(self, existing, incoming):
+        return self._rank(existing) > self._rank(incoming)
+
+    # -- writes ------------------------------------------------------------
+
+    def write_pages(self, pages, complete=True):
+        """
+        Replace the whole document with `pages` (also compacts the blob). Pages already
+        stored with more informative text than the incoming placeholder are kept.
+        `complete=False` marks the store incomplete until a later write completes it.
+        Returns the pages as written.
+        """
+        with self._locked(exclusive=True):
+            pages = list(pages)
+            try:
+                existing = self._read_page_range(0, None)
+            except (PageStoreError, UnicodeDecodeError) as exc:
+                system_logger.warning('Replacing unreadable page store %s: %s', self.index_path, exc)
+                existing = None
+            if existing is not None and len(existing) == len(pages):
+                pages = [
+                    old if self._keeps_existing(old, new) else new
+                    for old, new in zip(existing, pages)
+                ]
+            self._write_pages(pages, complete)
+            return pages
+
+    def _write_pages(self, pages, complete=None):
+        generation = os.urandom(_GENERATION_SIZE)
+        write_count, flags = self._stored_header()
+        write_count += 1
+        flags = _set_complete(flags, complete)
+        suffix = f'.tmp.{os.getpid()}.{threading.get_ident()}'
+        blob_tmp = self.blob_path + suffix
+        index_tmp = self.index_path + suffix
+        try:
+            records = []
+            with open(blob_tmp, 'wb') as blob_file:
+                blob_file.write(generation)
+                offset = _GENERATION_SIZE
+                for page in pages:
+                    encoded = page.encode('utf-8')
+                    blob_file.write(encoded)
+                    records.append((offset, len(encoded)))
+                    offset += len(encoded)
+            with open(index_tmp, 'wb') as index_file:
+                index_file.write(_HEADER.pack(
+                    _MAGIC, len(records), offset - _GENERATION_SIZE, generation, write_count, flags,
+                ))
+                for record in records:
+                    index_file.write(_RECORD.pack(*record))
+            # The old index rejects the new blob by generation until the new index lands.
+            _fsync_replace(blob_tmp, self.blob_path)
+            _fsync_replace(index_tmp, self.index_path)
+        finally:
+            for tmp_path in (blob_tmp, index_tmp):
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+
+    def update_pages(self, updates, complete=None):
+        """
+        Set {page_index: text} in place: new texts are appended to the blob, then their
+        index records are patched. Updates that would replace stored text with a less
+        informative placeholder are dropped. `complete` marks the store complete (True)
+        or incomplete (False); None leaves the mark alone. Returns False if there is no
+        store to update.
+        """
+        if not updates and complete is None:
+            return True
+        with self._locked(exclusive=True):
+            try:
+                index_file = open(self.index_path, 'r+b')
+            except FileNotFoundError:
+                return False
+            with index_file:
+                page_count, live_bytes, generation, write_count, flags = self._read_header(
+                    index_file.read(_HEADER.size),
+                )
+                new_flags = _set_complete(flags, complete)
+                for page_index in updates:
+                    if not 0 <= page_index < page_count:
+                        raise IndexError(f'page index {page_index} out of range (0-{page_count - 1})')
+                stored = {
+                    page_index: self._read_page_range(page_index, page_index + 1)[0]
+                    for page_index in updates
+                }
+                updates = {
+                    page_index: text for page_index, text in updates.items()
+                    if not self._keeps_existing(stored[page_index], text)
+                }
+                if not updates and new_flags == flags:
+                    return True
+                for page_index in updates:
+                    live_bytes -= len(stored[page_index].encode('utf-8'))
+
+                with open(self.blob_path, 'ab') as blob_file:
+                    offset = blob_file.tell()
+                    records = {}
+                    for page_index, text in sorted(updates.items()):
+                        encoded = text.encode('utf-8')
+                        blob_file.write(encoded)
+                        records[page_index] = (offset, len(encoded))
+                        offset += len(encoded)
+                        live_bytes += len(encoded)
+                    blob_file.flush()
+                    blob_size = offset
+
+                # Blob bytes are on disk before any record points at them.
+                for page_index, record in records.items():
+                    index_file.seek(_HEADER.size + page_index * _RECORD.size)
+                    index_file.write(_RECORD.pack(*record))
+                index_file.seek(0)
+                index_file.write(_HEADER.pack(_MAGIC, page_count, live_bytes, generation, write_count + 1, new_flags))
+            if blob_size > _COMPACT_RATIO * live_bytes + _COMPACT_SLACK_BYTES:
+                system_logger.info('Compacting page store %s (blob=%d live=%d)', self.blob_path, blob_size, live_bytes)
+                self._write_pages(self._read_page_range(0, None))
+        return True
+
+    def delete(self):
+        # The lock file stays: unlinking it would let a waiter lock an orphaned inode.
+        with self._locked(exclusive=True):
+            for path in (self.index_path, self.blob_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # -- migration ---------------------------------------------------------
+
+    def import_legacy_json(self):
+        """Convert a `.pages.json` cache from before the page store existed. Returns the pages or None."""
+        if not os.path.exists(self.legacy_json_path):
+            return None
+        try:
+            with open(self.legacy_json_path, 'r', encoding='utf-8') as cache_file:
+                pages = json.load(cache_file).get('pages')
+        except (OSError, ValueError, AttributeError) as exc:
+            system_logger.warning('Failed to read legacy extraction cache %s: %s', self.legacy_json_path, exc)
+            return None
+        if not (isinstance(pages, list) and all(isinstance(page, str) for page in pages)):
+            return None
+        pages = self.write_pages(pages)
+        try:
+            os.remove(self.legacy_json_path)
+        except FileNotFoundError:
+            pass  # another worker migrated it concurrently
+        system_logger.info('Migrated legacy extraction cache to page store: %s (pages=%d)', self.file_path, len(pages))
+        return pages
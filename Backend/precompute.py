@@ -0,0 +1,224 @@
+# precompute.py
+"""
+Ahead-of-time quiz and summary generation.
+
+Learning Mode asks for the quiz of the page the learner is about to finish, so once
+a document is extracted (and whenever the client reports the reader's position via
+/precompute) the next PRECOMPUTE_PAGES_AHEAD pages are summarised and quizzed on a
+small thread pool, quizzes PRECOMPUTE_QUIZ_BATCH_PAGES pages per batched LLM call.
+Results land in the persistent result store, where /generate-quiz and /summarize
+pick them up. Cache keys tokenize every page, so they are computed by a planning task
+on the pool rather than in the request that schedules the pages. Work is deduplicated
+by cache key, and an endpoint that needs a page which is still being prefetched waits
+for it instead of paying for a second LLM call (wait_*_async for the ASGI serving path).
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from langchain_utils import (
+    QUIZ_MIN_WORDS,
+    generate_quizzes_cached,
+    quiz_cache_key,
+    summarize_page,
+    summary_cache_key,
+)
+from logger import get_logger
+
+ai_logger = get_logger('AI')
+
+PRECOMPUTE_ENABLED = os.environ.get('PRECOMPUTE_ENABLED', 'true').lower() == 'true'
+PRECOMPUTE_WORKERS = max(1, int(os.environ.get('PRECOMPUTE_WORKERS', '2')))
+PRECOMPUTE_PAGES_AHEAD = max(0, int(os.environ.get('PRECOMPUTE_PAGES_AHEAD', '3')))
+PRECOMPUTE_MAX_PENDING = max(1, int(os.environ.get('PRECOMPUTE_MAX_PENDING', '200')))
+# How long an endpoint waits for an in-flight prefetch before generating itself.
+PRECOMPUTE_WAIT_SEC = max(0.0, float(os.environ.get('PRECOMPUTE_WAIT_SEC', '45')))
+# Quizzes are generated this many pages per task (one batched LLM round-trip each).
+PRECOMPUTE_QUIZ_BATCH_PAGES = max(1, int(os.environ.get('PRECOMPUTE_QUIZ_BATCH_PAGES', '4')))
+
+
+class PrecomputeScheduler:
+    """Bounded pool of cache-filling tasks, at most one in flight per (kind, key)."""
+
+    def __init__(self, max_workers=PRECOMPUTE_WORKERS, max_pending=PRECOMPUTE_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='precompute')
+        self._inflight = {}
+        self._planning = 0
+        self._lock = threading.Lock()
+
+    def plan(self, fn, *args):
+        """
+        Run fn(*args) on the pool to work out and submit the actual tasks; returns False
+        when the queue is full. Plans count towards max_pending until they have run.
+        """
+        with self._lock:
+            if len(self._inflight) + self._planning >= self.max_pending:
+                return False
+            self._planning += 1
+        self._executor.submit(self._run_plan, fn, args)
+        return True
+
+    def submit(self, kind, key, fn, *args):
+        """Queue fn(*args) unless the same task is already in flight; returns False when the queue is full."""
+        with self._lock:
+            if (kind, key) in self._inflight:
+                return True
+            if len(self._inflight) >= self.max_pending:
+                return False
+            self._inflight[(kind, key)] = self._executor.submit(self._run, kind, key, fn, args)
+            return True
+
+    def submit_many(self, kind, items, fn, *args):
+        """
+        Queue one fn(list_of_items, *args) task for the {key: item} entries not already in
+        flight; each key can be waited on separately. Returns the number of keys queued
+        or already in flight, or 0 when the queue is full.
+        """
+        with self._lock:
+            fresh = {key: item for key, item in items.items() if (kind, key) not in self._inflight}
+            if not fresh:
+                return len(items)
+            if len(self._inflight) + len(fresh) > self.max_pending:
+                return 0
+            future = self._executor.submit(self._run_many, kind, list(fresh), fn, list(fresh.values()), args)
+            for key in fresh:
+                self._inflight[(kind, key)] = future
+            return len(items)
+
+    def wait(self, kind, key, timeout=PRECOMPUTE_WAIT_SEC):
+        """Block until an in-flight task for (kind, key) finishes; False if there was none or it timed out."""
+        with self._lock:
+            future = self._inflight.get((kind, key))
+        if future is None:
+            return False
+        done, _ = wait([future], timeout=timeout)
+        return bool(done)
+
+    async def wait_async(self, kind, key, timeout=PRECOMPUTE_WAIT_SEC):
+        """wait() for the event loop; giving up does not cancel the prefetch."""
+        with self._lock:
+            future = self._inflight.get((kind, key))
+        if future is None:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._inflight) + self._planning
+
+    def _run_plan(self, fn, args):
+        try:
+            fn(*args)
+        except Exception as exc:
+            ai_logger.warning('Precompute planning failed: %s', exc)
+        finally:
+            with self._lock:
+                self._planning -= 1
+
+    def _run_many(self, kind, keys, fn, items, args):
+        try:
+            fn(items, *args)
+        except Exception as exc:
+            ai_logger.warning('Precompute %s batch of %d failed: %s', kind, len(keys), exc)
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._inflight.pop((kind, key), None)
+
+    def _run(self, kind, key, fn, args):
+        try:
+            fn(*args)
+        except Exception as exc:
+            ai_logger.warning('Precompute %s failed for key=%s: %s', kind, key[:12], exc)
+        finally:
+            with self._lock:
+                self._inflight.pop((kind, key), None)
+
+
+scheduler = PrecomputeScheduler()
+
+
+def schedule_pages(pages, start_index=0, count=PRECOMPUTE_PAGES_AHEAD,
+                   is_hard_mode=False, difficulty_level='normal', streak=0):
+    """
+    Queue summaries and quizzes for pages[start_index:start_index + count] (count=None
+    for the rest of the document). Returns at once: the pages are handed to a planning
+    task that computes their cache keys and submits the work (see _queue_pages).
+    Returns {'pages': pages handed over, 'dropped': pages refused because the queue is full}.
+    """
+    scheduled = {'pages': 0, 'dropped': 0}
+    if not PRECOMPUTE_ENABLED:
+        return scheduled
+    end = len(pages) if count is None else min(len(pages), start_index + count)
+    selected = [page_content for page_content in pages[max(0, start_index):end] if page_content]
+    if not selected:
+        return scheduled
+    if scheduler.plan(_queue_pages, selected, is_hard_mode, difficulty_level, streak):
+        scheduled['pages'] = len(selected)
+    else:
+        scheduled['dropped'] = len(selected)
+        ai_logger.warning('Precompute queue full (%d pending); dropped %d page(s)',
+                          scheduler.pending(), len(selected))
+    return scheduled
+
+
+def _queue_pages(pages, is_hard_mode, difficulty_level, streak):
+    """
+    Submit a summary task per page and quiz batches for the pages long enough to quiz,
+    skipping keys already in flight. Returns the number of summary and quiz tasks queued.
+    """
+    queued = {'summaries': 0, 'quizzes': 0, 'dropped': 0}
+    quiz_pages = {}
+    for page_content in pages:
+        word_count = len(page_content.split())
+        if word_count == 0:
+            continue
+        key = summary_cache_key(page_content)
+        if scheduler.submit('summary', key, summarize_page, page_content, key):
+            queued['summaries'] += 1
+        else:
+            queued['dropped'] += 1
+        if word_count >= QUIZ_MIN_WORDS:
+            quiz_pages[quiz_cache_key(page_content, is_hard_mode, difficulty_level, streak)] = page_content
+    # Quizzes go out in small batches, so the page the reader reaches first is ready early.
+    quiz_items = list(quiz_pages.items())
+    for batch_start in range(0, len(quiz_items), PRECOMPUTE_QUIZ_BATCH_PAGES):
+        batch = dict(quiz_items[batch_start:batch_start + PRECOMPUTE_QUIZ_BATCH_PAGES])
+        submitted = scheduler.submit_many('quiz', batch, generate_quizzes_cached, is_hard_mode, difficulty_level, streak)
+        queued['quizzes'] += submitted
+        queued['dropped'] += len(batch) - submitted
+    if queued['dropped']:
+        ai_logger.warning('Precompute queue full (%d pending); dropped %d task(s)',
+                          scheduler.pending(), queued['dropped'])
+    return queued
+
+
+def wait_for_quiz(page_content, is_hard_mode=False, difficulty_level='normal', streak=0, key=None):
+    if key is None:
+        key = quiz_cache_key(page_content, is_hard_mode, difficulty_level, streak)
+    return scheduler.wait('quiz', key)
+
+
+def wait_for_summary(page_content, key=None):
+    if key is None:
+        key = summary_cache_key(page_content)
+    return scheduler.wait('summary', key)
+
+
+async def wait_for_quiz_async(page_content, is_hard_mode=False, difficulty_level='normal', streak=0, key=None):
+    # The key tokenizes the page, so it is computed off the event loop unless the caller has it.
+    if key is None:
+        key = await asyncio.to_thread(quiz_cache_key, page_content, is_hard_mode, difficulty_level, streak)
+    return await scheduler.wait_async('quiz', key)
+
+
+async def wait_for_summary_async(page_content, key=None):
+    if key is None:
+        key = await asyncio.to_thread(summary_cache_key, page_content)
+    return await scheduler.wait_async('summary', key)
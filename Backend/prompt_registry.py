@@ -0,0 +1,109 @@
+# prompt_registry.py
+"""
+Prompt templates from prompt_library, compiled once per process.
+
+Building a ChatPromptTemplate parses its template strings, and composing
+`prompt | llm | parser` allocates a new RunnableSequence; both used to happen on
+every quiz, summary and chat call. Each prompt is registered here once at import
+and compiled once, on first use (langchain_core's prompt and parser modules take
+most of a second to import, which app startup should not pay); its chain is
+composed on first use too and reused for as long as the same model object is
+passed in.
+
+Every entry carries a version, the first 12 hex digits of a sha256 over its message
+roles and template strings, so a cache key that includes it changes exactly when a
+prompt's wording does.
+"""
+import hashlib
+import json
+import threading
+
+import prompt_library
+
+
+class RegisteredPrompt:
+    def __init__(self, name, messages, json_output=False):
+        self.name = name
+        self.messages = tuple(messages)
+        self.json_output = json_output
+        self.version = hashlib.sha256(
+            json.dumps(self.messages, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()[:12]
+        self._compiled = None
+        self._chain = None
+        self._lock = threading.Lock()
+
+    def _compile(self):
+        if self._compiled is None:
+            with self._lock:
+                if self._compiled is None:
+                    from langchain_core.prompts import ChatPromptTemplate
+                    parser = None
+                    if self.json_output:
+                        from langchain_core.output_parsers import JsonOutputParser
+                        parser = JsonOutputParser()
+                    self._compiled = (ChatPromptTemplate.from_messages(list(self.messages)), parser)
+        return self._compiled
+
+    @property
+    def template(self):
+        return self._compile()[0]
+
+    @property
+    def parser(self):
+        return self._compile()[1]
+
+    @property
+    def system_template(self):
+        return next(text for role, text in self.messages if role == 'system')
+
+    def chain(self, llm):
+        """`template | llm [| parser]`, composed once per model object."""
+        cached = self._chain
+        if cached is not None and cached[0] is llm:
+            return cached[1]
+        template, parser = self._compile()
+        with self._lock:
+            if self._chain is None or self._chain[0] is not llm:
+                runnable = template | llm
+                if parser is not None:
+                    runnable = runnable | parser
+                self._chain = (llm, runnable)
+            return self._chain[1]
+
+
+class PromptRegistry:
+    def __init__(self):
+        self._prompts = {}
+
+    def register(self, name, messages, json_output=False):
+        if name in self._prompts:
+            raise ValueError(f'prompt {name!r} is already registered')
+        prompt = self._prompts[name] = RegisteredPrompt(name, messages, json_output)
+        return prompt
+
+    def get(self, name):
+        return self._prompts[name]
+
+    def versions(self):
+        return {name: prompt.version for name, prompt in self._prompts.items()}
+
+
+registry = PromptRegistry()
+
+registry.register('quiz', [
+    ("system", prompt_library.prompt_generate_quiz_v1),
+    ("user", "Generate MCQs for the provided content."),
+], json_output=True)
+registry.register('quiz_hard', [
+    ("system", getattr(prompt_library, 'prompt_generate_quiz_hard_v1', prompt_library.prompt_generate_quiz_v1)),
+    ("user", "Generate MCQs for the provided content."),
+], json_output=True)
+registry.register('summary', [
+    ("system", prompt_library.prompt_summarize_page),
+    ("user", "{page_content}"),
+], json_output=True)
+registry.register('chat', [
+    ("system", prompt_library.prompt_chat_with_document),
+    ("human", "{user_content}"),
+])
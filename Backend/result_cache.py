@@ -0,0 +1,162 @@
+# result_cache.py
+"""
+Persistent cache for LLM results (quizzes, summaries) shared by every worker.
+
+Results live in one SQLite database under uploads/, next to the extraction cache,
+opened in WAL mode so readers in other gunicorn workers never block on a writer.
+Rows are keyed by (namespace, key, variant): callers derive `key` from a hash of
+the normalised input plus the prompt version and parameters, and may store several
+variants per key (e.g. different quizzes for the same page). Rows expire after
+RESULT_CACHE_TTL_SEC, and the least recently used rows beyond
+RESULT_CACHE_MAX_ENTRIES are evicted.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from logger import get_logger
+
+system_logger = get_logger('SYSTEM')
+
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join('uploads', 'results.sqlite3'))
+RESULT_CACHE_TTL_SEC = max(60.0, float(os.environ.get('RESULT_CACHE_TTL_SEC', str(30 * 24 * 3600))))
+RESULT_CACHE_MAX_ENTRIES = max(1, int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '50000')))
+# Expired and excess rows are pruned once every this many writes.
+RESULT_CACHE_PRUNE_EVERY = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    variant INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, key, variant)
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def normalize_text(text):
+    """Collapse whitespace so re-extracted or re-flowed copies of a page share a key."""
+    return ' '.join((text or '').split())
+
+
+def content_key(*parts):
+    """Stable sha256 key over JSON-serialisable parts (normalised content, prompt version, params)."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultStore:
+    def __init__(self, db_path=RESULT_CACHE_PATH, ttl_sec=RESULT_CACHE_TTL_SEC, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    def _connection(self):
+        # sqlite3 connections are per thread and must not cross a fork.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_variants(self, namespace, key):
+        """Unexpired [(variant_id, value)] for `key`, least recently written first."""
+        cutoff = time.time() - self.ttl_sec
+        rows = self._connection().execute(
+            'SELECT variant, value FROM results WHERE namespace = ? AND key = ? AND created_at >= ? ORDER BY created_at, variant',
+            (namespace, key, cutoff),
+        ).fetchall()
+        variants = []
+        for variant, value in rows:
+            try:
+                variants.append((variant, json.loads(value)))
+            except ValueError:
+                system_logger.warning('Dropping unreadable cached result: namespace=%s key=%s variant=%s',
+                                      namespace, key, variant)
+        return variants
+
+    def get(self, namespace, key):
+        """The most recent unexpired value for `key`, or None."""
+        variants = self.get_variants(namespace, key)
+        if not variants:
+            return None
+        variant, value = variants[-1]
+        self.touch(namespace, key, variant)
+        return value
+
+    def touch(self, namespace, key, variant):
+        self._connection().execute(
+            'UPDATE results SET last_used = ? WHERE namespace = ? AND key = ? AND variant = ?',
+            (time.time(), namespace, key, variant),
+        )
+
+    def put(self, namespace, key, value, variant=None):
+        """
+        Store `value` (JSON-serialisable) and return its variant id. With variant=None a
+        new variant is appended; otherwise that variant is replaced.
+        """
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if variant is None:
+                variant = conn.execute(
+                    'SELECT COALESCE(MAX(variant), -1) + 1 FROM results WHERE namespace = ? AND key = ?',
+                    (namespace, key),
+                ).fetchone()[0]
+            conn.execute(
+                'INSERT OR REPLACE INTO results (namespace, key, variant, value, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (namespace, key, variant, encoded, now, now),
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        with self._writes_lock:
+            self._writes += 1
+            prune_now = self._writes % RESULT_CACHE_PRUNE_EVERY == 0
+        if prune_now:
+            self.prune()
+        return variant
+
+    def prune(self):
+        conn = self._connection()
+        expired = conn.execute('DELETE FROM results WHERE created_at < ?', (time.time() - self.ttl_sec,)).rowcount
+        excess = conn.execute(
+            'DELETE FROM results WHERE rowid IN ('
+            'SELECT rowid FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        ).rowcount
+        if expired or excess:
+            system_logger.info('Pruned result cache %s: expired=%d evicted=%d', self.db_path, expired, excess)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
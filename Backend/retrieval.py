@@ -0,0 +1,482 @@
+# retrieval.py
+"""
+Per-document retrieval index over extracted pages.
+
+Pages are split into overlapping word windows, embedded, and stored next to the
+upload so /chat can ground answers on the whole document rather than only the page
+on screen:
+
+  <file>.index.json    header: embedder, dimension, committed chunk count and bytes,
+                       and per page the page-store record, text fingerprint and
+                       chunk count it was indexed from
+  <file>.index.f32     float32 matrix, one L2-normalised row per chunk (row-major)
+  <file>.index.jsonl   one {"page", "text"} record per chunk, in row order
+
+The matrix and chunk files are only ever appended to; the header is replaced
+atomically last and is the commit point, so readers only trust its `count` rows.
+The index is built in the background when extraction finishes. When pages gain
+text after that (deferred pages hydrated by /extract-pages), only those pages are
+embedded and appended.
+Search is a single matrix-vector product over the memory-mapped matrix plus an
+argpartition for the top k; chunks scoring at or below RETRIEVAL_MIN_SCORE are
+dropped.
+
+The default HashingEmbedder needs no model or network (signed feature hashing of
+word unigrams and bigrams). Set RETRIEVAL_EMBEDDER=openai to use OpenAI embeddings;
+an index built with a different embedder is rebuilt in the background on the next search.
+"""
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+from lazy_imports import LazyModule
+from logger import get_logger
+
+np = LazyModule('numpy')
+
+system_logger = get_logger('SYSTEM')
+ai_logger = get_logger('AI')
+
+RETRIEVAL_EMBEDDER = os.environ.get('RETRIEVAL_EMBEDDER', 'hashing').lower()
+RETRIEVAL_HASHING_DIM = max(64, int(os.environ.get('RETRIEVAL_HASHING_DIM', '1024')))
+RETRIEVAL_CHUNK_WORDS = max(20, int(os.environ.get('RETRIEVAL_CHUNK_WORDS', '150')))
+RETRIEVAL_CHUNK_OVERLAP_WORDS = max(0, min(
+    int(os.environ.get('RETRIEVAL_CHUNK_OVERLAP_WORDS', '30')), RETRIEVAL_CHUNK_WORDS // 2,
+))
+RETRIEVAL_TOP_K = max(1, int(os.environ.get('RETRIEVAL_TOP_K', '4')))
+# Chunks scoring at or below this cosine similarity are not returned: a query that
+# shares no terms with the document (or embeds to all zeros) matches nothing.
+RETRIEVAL_MIN_SCORE = max(0.0, float(os.environ.get('RETRIEVAL_MIN_SCORE', '0.05')))
+RETRIEVAL_OPENAI_MODEL = os.environ.get('RETRIEVAL_OPENAI_MODEL', 'text-embedding-3-small')
+# Loaded indexes kept in memory per worker.
+RETRIEVAL_CACHED_INDEXES = 8
+
+HEADER_SUFFIX = '.index.json'
+MATRIX_SUFFIX = '.index.f32'
+CHUNKS_SUFFIX = '.index.jsonl'
+LOCK_SUFFIX = '.index.lock'
+_FORMAT_VERSION = 2
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have he her his i if in into is it its me my '
+    'no not of on or our she so than that the their them then there these they this to was '
+    'we were what when which who will with you your'.split()
+)
+
+
+class HashingEmbedder:
+    """Signed feature hashing of unigrams and bigrams with sublinear term frequency."""
+
+    def __init__(self, dim=RETRIEVAL_HASHING_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [word for word in _TOKEN_RE.findall(text.lower()) if word not in _STOPWORDS]
+            features = Counter(words)
+            features.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+            for feature, count in features.items():
+                hashed = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if hashed & 0x80000000 else -1.0
+                matrix[row, hashed % self.dim] += sign * (1.0 + math.log(count))
+        return _normalize_rows(matrix)
+
+
+class OpenAIEmbedder:
+    def __init__(self, model=RETRIEVAL_OPENAI_MODEL):
+        from langchain_openai import OpenAIEmbeddings
+        self._client = OpenAIEmbeddings(model=model)
+        self.name = f'openai-{model}'
+        self.dim = None  # known after the first call
+
+    def embed(self, texts):
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        matrix = np.asarray(self._client.embed_documents(list(texts)), dtype=np.float32)
+        self.dim = matrix.shape[1]
+        return _normalize_rows(matrix)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = OpenAIEmbedder() if RETRIEVAL_EMBEDDER == 'openai' else HashingEmbedder()
+        return _embedder
+
+
+def chunk_page(text, words_per_chunk=RETRIEVAL_CHUNK_WORDS, overlap=RETRIEVAL_CHUNK_OVERLAP_WORDS):
+    """Split one page into overlapping windows of whole words."""
+    words = (text or '').split()
+    if not words:
+        return []
+    step = words_per_chunk - overlap
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + words_per_chunk]))
+        if start + words_per_chunk >= len(words):
+            break
+    return chunks
+
+
+class RetrievalIndex:
+    def __init__(self, header, matrix, chunks):
+        self.header = header
+        self.matrix = matrix
+        self.chunks = chunks
+
+    def search(self, query_vector, top_k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """[(score, page_index, text)] for the top_k chunks scoring above min_score, best first."""
+        count = len(self.chunks)
+        if count == 0:
+            return []
+        scores = self.matrix @ query_vector
+        top_k = min(top_k, count)
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (float(scores[row]), self.chunks[row][0], self.chunks[row][1])
+            for row in top if scores[row] > min_score
+        ]
+
+
+def _page_fingerprint(text):
+    return zlib.crc32((text or '').encode('utf-8'))
+
+
+class DocumentIndexStore:
+    """Builds, extends, persists and loads the retrieval index of one uploaded file."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.header_path = f'{file_path}{HEADER_SUFFIX}'
+        self.matrix_path = f'{file_path}{MATRIX_SUFFIX}'
+        self.chunks_path = f'{file_path}{CHUNKS_SUFFIX}'
+        self.lock_path = f'{file_path}{LOCK_SUFFIX}'
+
+    def exists(self):
+        return os.path.exists(self.header_path)
+
+    @contextmanager
+    def locked(self, exclusive):
+        # Same scheme as the page store: flock across workers, shared for readers.
+        if fcntl is None:
+            with _build_lock(self.file_path):
+                yield
+            return
+        with open(self.lock_path, 'a+b') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def read_header(self):
+        try:
+            with open(self.header_path, 'r', encoding='utf-8') as header_file:
+                header = json.load(header_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            system_logger.warning('Unreadable retrieval index header %s: %s', self.header_path, exc)
+            return None
+        if not isinstance(header, dict) or header.get('version') != _FORMAT_VERSION:
+            return None
+        return header
+
+    def _open_matrix(self, header):
+        count, dim = header['count'], header['dim']
+        if count == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.memmap(self.matrix_path, dtype=np.float32, mode='r', shape=(count, dim))
+
+    def load(self, header):
+        chunks = []
+        if header['count']:
+            with open(self.chunks_path, 'rb') as chunks_file:
+                data = chunks_file.read(header['chunksBytes'])
+            for line in data.splitlines():
+                record = json.loads(line)
+                chunks.append((record['page'], record['text']))
+        if len(chunks) != header['count']:
+            raise ValueError(f'{self.chunks_path} has {len(chunks)} chunks, header says {header["count"]}')
+        return RetrievalIndex(header, self._open_matrix(header), chunks)
+
+    def build(self, pages, embedder, records):
+        """Index `pages` from scratch and return the loaded index."""
+        chunks, page_chunks = self._chunk_pages(dict(enumerate(pages)))
+        matrix = embedder.embed([text for _, text in chunks]).astype(np.float32, copy=False)
+        dim = matrix.shape[1] if len(chunks) else (embedder.dim or 0)
+        encoded_chunks = self._encode_chunks(chunks)
+        suffix = f'.tmp.{os.getpid()}.{threading.get_ident()}'
+        with open(self.matrix_path + suffix, 'wb') as matrix_file:
+            matrix_file.write(np.ascontiguousarray(matrix).tobytes())
+        with open(self.chunks_path + suffix, 'wb') as chunks_file:
+            chunks_file.write(encoded_chunks)
+        os.replace(self.matrix_path + suffix, self.matrix_path)
+        os.replace(self.chunks_path + suffix, self.chunks_path)
+        header = {
+            'version': _FORMAT_VERSION,
+            'embedder': embedder.name,
+            'dim': dim,
+            'count': len(chunks),
+            'chunksBytes': len(encoded_chunks),
+            'pages': [
+                [offset, length, _page_fingerprint(text), page_chunks.get(page_index, 0)]
+                for page_index, ((offset, length), text) in enumerate(zip(records, pages))
+            ],
+        }
+        self._write_header(header)
+        return RetrievalIndex(header, matrix, chunks)
+
+    def append(self, index, changed, embedder, records):
+        """
+        Embed only the `changed` {page_index: text} pages, none of which had chunks yet,
+        and append them to the committed end of the matrix and chunk files.
+        """
+        header = index.header
+        chunks, page_chunks = self._chunk_pages(changed)
+        matrix = embedder.embed([text for _, text in chunks]).astype(np.float32, copy=False)
+        if chunks and header['count'] and matrix.shape[1] != header['dim']:
+            raise ValueError(f'embedding dimension changed ({header["dim"]} -> {matrix.shape[1]})')
+        encoded_chunks = self._encode_chunks(chunks)
+        dim = header['dim'] if header['count'] or not chunks else matrix.shape[1]
+        committed_matrix_bytes = header['count'] * dim * 4
+        # Bytes past the committed ends belong to an append that never reached its header.
+        with open(self.matrix_path, 'r+b') as matrix_file:
+            matrix_file.truncate(committed_matrix_bytes)
+            matrix_file.seek(committed_matrix_bytes)
+            matrix_file.write(np.ascontiguousarray(matrix).tobytes())
+        with open(self.chunks_path, 'r+b') as chunks_file:
+            chunks_file.truncate(header['chunksBytes'])
+            chunks_file.seek(header['chunksBytes'])
+            chunks_file.write(encoded_chunks)
+
+        pages = [list(entry) for entry in header['pages']]
+        pages.extend([0, 0, _page_fingerprint(''), 0] for _ in range(len(pages), len(records)))
+        for page_index, (offset, length) in enumerate(records):
+            pages[page_index][0:2] = [offset, length]
+        for page_index, text in changed.items():
+            pages[page_index][2:4] = [_page_fingerprint(text), page_chunks.get(page_index, 0)]
+        new_header = dict(
+            header,
+            dim=dim,
+            count=header['count'] + len(chunks),
+            chunksBytes=header['chunksBytes'] + len(encoded_chunks),
+            pages=pages,
+        )
+        self._write_header(new_header)
+        return RetrievalIndex(new_header, self._open_matrix(new_header), index.chunks + chunks)
+
+    def update_records(self, index, records):
+        """Record new page versions whose text turned out to be unchanged (e.g. after compaction)."""
+        pages = [list(entry) for entry in index.header['pages']]
+        for page_index, (offset, length) in enumerate(records):
+            pages[page_index][0:2] = [offset, length]
+        header = dict(index.header, pages=pages)
+        self._write_header(header)
+        return RetrievalIndex(header, index.matrix, index.chunks)
+
+    def _chunk_pages(self, pages):
+        chunks = []
+        page_chunks = {}
+        for page_index in sorted(pages):
+            page_chunk_texts = chunk_page(pages[page_index])
+            chunks.extend((page_index, chunk) for chunk in page_chunk_texts)
+            page_chunks[page_index] = len(page_chunk_texts)
+        return chunks, page_chunks
+
+    @staticmethod
+    def _encode_chunks(chunks):
+        return ''.join(
+            json.dumps({'page': page_index, 'text': text}, ensure_ascii=False) + '\n'
+            for page_index, text in chunks
+        ).encode('utf-8')
+
+    def _write_header(self, header):
+        tmp_path = f'{self.header_path}.tmp.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'w', encoding='utf-8') as header_file:
+            json.dump(header, header_file)
+        os.replace(tmp_path, self.header_path)
+
+
+_loaded = OrderedDict()   # header path -> (header mtime_ns, RetrievalIndex)
+_loaded_lock = threading.Lock()
+_build_locks = {}
+
+
+def _build_lock(file_path):
+    with _loaded_lock:
+        return _build_locks.setdefault(os.path.abspath(file_path), threading.RLock())
+
+
+def _cached_index(store):
+    try:
+        mtime_ns = os.stat(store.header_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _loaded_lock:
+        entry = _loaded.get(store.header_path)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        _loaded.move_to_end(store.header_path)
+        return entry[1]
+
+
+def _remember_index(store, index):
+    try:
+        mtime_ns = os.stat(store.header_path).st_mtime_ns
+    except FileNotFoundError:
+        return
+    with _loaded_lock:
+        _loaded[store.header_path] = (mtime_ns, index)
+        _loaded.move_to_end(store.header_path)
+        while len(_loaded) > RETRIEVAL_CACHED_INDEXES:
+            _loaded.popitem(last=False)
+
+
+def _load_current(store, embedder):
+    index = _cached_index(store)
+    if index is not None:
+        return index
+    header = store.read_header()
+    if header is None or header.get('embedder') != embedder.name:
+        return None
+    try:
+        with store.locked(exclusive=False):
+            index = store.load(header)
+    except (OSError, ValueError, KeyError) as exc:
+        system_logger.warning('Rebuilding unreadable retrieval index for %s: %s', store.file_path, exc)
+        return None
+    _remember_index(store, index)
+    return index
+
+
+def get_index(file_path, read_changed_pages, build=True):
+    """
+    Return the document's RetrievalIndex, brought up to date with the page store.
+
+    `read_changed_pages(known_records)` returns (records, {page_index: text}) for pages
+    whose store record differs from `known_records` (see PageStore.read_changed_pages),
+    or None if the document has no extracted pages. Pages that gained text since the
+    index was written, such as deferred pages hydrated by /extract-pages, are embedded
+    and appended; the index is only rebuilt when a page that already had chunks
+    changed or the embedder changed. With build=False a missing index is left missing.
+    """
+    store = DocumentIndexStore(file_path)
+    embedder = get_embedder()
+    with _build_lock(file_path):
+        index = _load_current(store, embedder)
+        if index is None and not build:
+            return None
+        known = [entry[:2] for entry in index.header['pages']] if index is not None else None
+        changes = read_changed_pages(known)
+        if changes is None:
+            return None
+        records, changed = changes
+        if index is not None:
+            header_pages = index.header['pages']
+            changed = {
+                page_index: text for page_index, text in changed.items()
+                if page_index >= len(header_pages) or header_pages[page_index][2] != _page_fingerprint(text)
+            }
+            if not changed and records == [tuple(entry[:2]) for entry in header_pages]:
+                return index
+            if len(records) < len(header_pages) or any(
+                page_index < len(header_pages) and header_pages[page_index][3]
+                for page_index in changed
+            ):
+                index = None  # a page that is already indexed changed: rebuild
+
+        with store.locked(exclusive=True):
+            if index is None:
+                if known is not None:
+                    changes = read_changed_pages(None)
+                    if changes is None:
+                        return None
+                    records, changed = changes
+                pages = [changed.get(page_index, '') for page_index in range(len(records))]
+                index = store.build(pages, embedder, records)
+                ai_logger.info('Retrieval index built for %s (pages=%d chunks=%d embedder=%s)',
+                               file_path, len(pages), len(index.chunks), embedder.name)
+            elif changed:
+                previous_count = len(index.chunks)
+                index = store.append(index, changed, embedder, records)
+                ai_logger.info('Retrieval index extended for %s: pages=%s new_chunks=%d',
+                               file_path, sorted(page_index + 1 for page_index in changed),
+                               len(index.chunks) - previous_count)
+            else:
+                index = store.update_records(index, records)
+        _remember_index(store, index)
+        return index
+
+
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='retrieval-index')
+_refresh_pending = {}   # file path -> build flag of the queued refresh
+
+
+def refresh_index_async(file_path, read_changed_pages, build=False):
+    """
+    Bring the index up to date in the background after pages were written, so /chat
+    never pays for embedding them. With build=False (pages hydrated or appended) a
+    document without an index is left alone; build=True (extraction finished, or a
+    chat found no index) builds it.
+    """
+    key = os.path.abspath(file_path)
+    with _loaded_lock:
+        if key in _refresh_pending:
+            _refresh_pending[key] = _refresh_pending[key] or build
+            return
+        _refresh_pending[key] = build
+
+    def run():
+        with _loaded_lock:
+            build_missing = _refresh_pending.pop(key, build)
+        try:
+            get_index(file_path, read_changed_pages, build=build_missing)
+        except Exception as exc:
+            system_logger.warning('Background retrieval index refresh failed for %s: %s', file_path, exc)
+
+    _refresh_executor.submit(run)
+
+
+def search_document(file_path, query, read_changed_pages, top_k=RETRIEVAL_TOP_K):
+    """
+    [(score, page_index, text)] most relevant to `query`, or [] if nothing in the
+    document matches. A document without an index yet gets [] and the index is built
+    in the background rather than in the caller's request.
+    """
+    index = get_index(file_path, read_changed_pages, build=False)
+    if index is None:
+        refresh_index_async(file_path, read_changed_pages, build=True)
+        return []
+    if not index.chunks:
+        return []
+    query_vector = get_embedder().embed([query])[0]
+    if query_vector.shape[0] != index.matrix.shape[1]:
+        return []
+    return index.search(query_vector, top_k)
@@ -0,0 +1,278 @@
+# search_index.py
+"""
+Lexical BM25 search over a document's pages.
+
+Each extracted document gets a compact inverted index stored next to its page store:
+
+  <file>.search.npz   terms (sorted) as one UTF-8 blob plus byte offsets, per-term
+                      posting offsets, postings as parallel int32 arrays of page
+                      indices and term frequencies, page lengths, and the page-store
+                      signature, page records and page text fingerprints the index
+                      was built from
+
+Postings are laid out term by term in flat arrays, so a query term costs one
+dictionary lookup and one slice; scoring is a vectorised BM25 update per term over a
+page-sized score array, then an argpartition for the top k. Loaded indexes are kept in
+a small per-worker LRU. When the page store's signature changes, only the pages whose
+store record changed are read; the index is rebuilt if one of their texts differs,
+otherwise it is just restamped. Stores still being extracted are not indexed.
+"""
+import io
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+from lazy_imports import LazyModule
+from logger import get_logger
+
+np = LazyModule('numpy')
+
+system_logger = get_logger('SYSTEM')
+
+SEARCH_BM25_K1 = float(os.environ.get('SEARCH_BM25_K1', '1.2'))
+SEARCH_BM25_B = float(os.environ.get('SEARCH_BM25_B', '0.75'))
+SEARCH_MAX_RESULTS = max(1, int(os.environ.get('SEARCH_MAX_RESULTS', '50')))
+SEARCH_SNIPPET_CHARS = max(40, int(os.environ.get('SEARCH_SNIPPET_CHARS', '200')))
+# Loaded indexes kept in memory per worker.
+SEARCH_CACHED_INDEXES = 16
+
+INDEX_SUFFIX = '.search.npz'
+_FORMAT_VERSION = 2
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def page_fingerprint(text):
+    return zlib.crc32((text or '').encode('utf-8'))
+
+
+def _encode_terms(terms):
+    """(blob, offsets): the terms as one UTF-8 byte array and the int64 byte offset of each."""
+    encoded = [term.encode('utf-8') for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_terms(blob, offsets):
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])]
+
+
+class LexicalIndex:
+    def __init__(self, term_blob, term_offsets, offsets, postings_pages, postings_tf, page_lengths,
+                 signature, records, fingerprints):
+        self.term_blob = term_blob
+        self.term_offsets = term_offsets
+        self.offsets = offsets
+        self.postings_pages = postings_pages
+        self.postings_tf = postings_tf
+        self.page_lengths = page_lengths
+        self.signature = signature
+        self.records = records
+        self.fingerprints = fingerprints
+        self.term_ids = {term: term_id for term_id, term in enumerate(_decode_terms(term_blob, term_offsets))}
+        page_count = len(page_lengths)
+        self.average_length = float(page_lengths.mean()) if page_count and page_lengths.any() else 1.0
+        # Per-page BM25 length normalisation, computed once instead of per query.
+        self._length_norm = (
+            SEARCH_BM25_K1 * (1 - SEARCH_BM25_B + SEARCH_BM25_B * page_lengths / self.average_length)
+        ).astype(np.float32)
+
+    @property
+    def page_count(self):
+        return len(self.page_lengths)
+
+    @property
+    def term_count(self):
+        return len(self.term_ids)
+
+    def restamped(self, signature, records):
+        """This index for a store version whose page texts are unchanged."""
+        return LexicalIndex(
+            self.term_blob, self.term_offsets, self.offsets, self.postings_pages, self.postings_tf,
+            self.page_lengths, signature, np.array(records, dtype=np.int64).reshape(-1, 2), self.fingerprints,
+        )
+
+    @classmethod
+    def build(cls, pages, signature, records):
+        counts = [Counter(tokenize(text)) for text in pages]
+        terms = sorted(set().union(*counts)) if counts else []
+        term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        posting_terms = np.fromiter(
+            (term_ids[term] for page_counts in counts for term in page_counts), dtype=np.int64,
+        )
+        postings_tf = np.fromiter((tf for page_counts in counts for tf in page_counts.values()), dtype=np.int32)
+        page_lengths = np.array([sum(page_counts.values()) for page_counts in counts], dtype=np.int32)
+        postings_pages = np.repeat(
+            np.arange(len(counts), dtype=np.int32), [len(page_counts) for page_counts in counts],
+        )
+        # Group postings by term; the stable sort keeps each term's pages in page order.
+        order = np.argsort(posting_terms, kind='stable')
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=offsets[1:])
+        return cls(
+            *_encode_terms(terms), offsets, postings_pages[order], postings_tf[order], page_lengths, signature,
+            np.array(records, dtype=np.int64).reshape(-1, 2),
+            np.array([page_fingerprint(text) for text in pages], dtype=np.uint32),
+        )
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """[(page_index, score, matched_terms)] best first; pages matching no query term are left out."""
+        query_terms = [term for term in dict.fromkeys(tokenize(query)) if term in self.term_ids]
+        if not query_terms or not self.page_count:
+            return []
+        scores = np.zeros(self.page_count, dtype=np.float32)
+        for term in query_terms:
+            term_id = self.term_ids[term]
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            pages = self.postings_pages[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            document_frequency = end - start
+            idf = np.log(1 + (self.page_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            scores[pages] += idf * tf * (SEARCH_BM25_K1 + 1) / (tf + self._length_norm[pages])
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        limit = min(limit, len(matched))
+        top = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(page_index), float(scores[page_index]), query_terms) for page_index in top]
+
+    def save(self, path):
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            version=np.array([_FORMAT_VERSION]),
+            signature=np.array(self.signature, dtype=np.int64),
+            term_blob=self.term_blob,
+            term_offsets=self.term_offsets,
+            offsets=self.offsets,
+            postings_pages=self.postings_pages,
+            postings_tf=self.postings_tf,
+            page_lengths=self.page_lengths,
+            records=self.records,
+            fingerprints=self.fingerprints,
+        )
+        tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'wb') as index_file:
+            index_file.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version'][0]) != _FORMAT_VERSION:
+                return None
+            return cls(
+                data['term_blob'], data['term_offsets'], data['offsets'], data['postings_pages'],
+                data['postings_tf'], data['page_lengths'], tuple(int(value) for value in data['signature']),
+                data['records'], data['fingerprints'],
+            )
+
+
+def make_snippet(text, terms, max_chars=SEARCH_SNIPPET_CHARS):
+    """A window of `text` around the first occurrence of any of `terms`, whitespace-collapsed."""
+    text = ' '.join((text or '').split())
+    if len(text) <= max_chars:
+        return text
+    position = None
+    for term in terms:
+        match = re.search(r'(?<!\w)' + re.escape(term), text, re.IGNORECASE)
+        if match and (position is None or match.start() < position):
+            position = match.start()
+    start = max(0, (position or 0) - max_chars // 4)
+    end = min(len(text), start + max_chars)
+    start = max(0, end - max_chars)
+    snippet = text[start:end]
+    if start > 0:
+        snippet = '…' + snippet.split(' ', 1)[-1]
+    if end < len(text):
+        snippet = snippet.rsplit(' ', 1)[0] + '…'
+    return snippet
+
+
+_loaded = OrderedDict()   # index path -> LexicalIndex
+_loaded_lock = threading.Lock()
+_build_locks = {}
+
+
+def _build_lock(path):
+    with _loaded_lock:
+        return _build_locks.setdefault(path, threading.Lock())
+
+
+def _remember(path, index):
+    with _loaded_lock:
+        _loaded[path] = index
+        _loaded.move_to_end(path)
+        while len(_loaded) > SEARCH_CACHED_INDEXES:
+            _loaded.popitem(last=False)
+
+
+def get_lexical_index(file_path, read_changed_pages, store_state):
+    """
+    The document's LexicalIndex for the page store in `store_state` ((signature,
+    complete) from PageStore.state()), or None if the document is not fully extracted.
+
+    `read_changed_pages(known_records)` returns (records, {page_index: client text})
+    for pages whose store record differs from `known_records`, as
+    PageStore.read_changed_pages does. A store write that left every page's text as
+    it was (a page rewritten with the same text, a compaction) only restamps the
+    index; it is rebuilt when a text changed or the page count did.
+    """
+    if store_state is None or not store_state[1]:
+        return None
+    path = os.path.abspath(f'{file_path}{INDEX_SUFFIX}')
+    signature = tuple(store_state[0])
+    with _loaded_lock:
+        index = _loaded.get(path)
+        if index is not None and index.signature == signature:
+            _loaded.move_to_end(path)
+            return index
+    with _build_lock(path):
+        with _loaded_lock:
+            index = _loaded.get(path)
+        if index is None:
+            try:
+                index = LexicalIndex.load(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as exc:
+                system_logger.warning('Rebuilding unreadable search index %s: %s', path, exc)
+        if index is not None and index.signature != signature:
+            index = _restamp_if_unchanged(index, read_changed_pages, signature)
+            if index is not None:
+                index.save(path)
+        if index is None:
+            changes = read_changed_pages(None)
+            if changes is None:
+                return None
+            records, texts = changes
+            pages = [texts.get(page_index, '') for page_index in range(len(records))]
+            index = LexicalIndex.build(pages, signature, records)
+            index.save(path)
+            system_logger.info('Search index built for %s (pages=%d terms=%d postings=%d)',
+                               file_path, index.page_count, index.term_count, len(index.postings_pages))
+        _remember(path, index)
+        return index
+
+
+def _restamp_if_unchanged(index, read_changed_pages, signature):
+    """`index` restamped for `signature` if no page text changed since it was built, else None."""
+    changes = read_changed_pages(index.records.tolist())
+    if changes is None:
+        return None
+    records, texts = changes
+    if len(records) != index.page_count or any(
+        page_fingerprint(text) != int(index.fingerprints[page_index]) for page_index, text in texts.items()
+    ):
+        return None
+    return index.restamped(signature, records)
@@ -0,0 +1,96 @@
+# single_flight.py
+"""
+Request coalescing for expensive work that many requests ask for at once.
+
+When a popular document is opened by several readers together, their /extract,
+/summarize and /generate-quiz calls arrive within the same second and would each
+run the same extraction or LLM call. A SingleFlight group lets the first caller for
+a key (operation, content hash, parameters) do the work while later callers with the
+same key wait for its result (or exception) instead of starting their own.
+
+Sync callers (Flask threads) and async callers (the ASGI event loop) share one map of
+in-flight calls, so a request on either path can join work started on the other.
+Async work runs as its own task: a leader whose request is cancelled or times out
+does not cancel the call its followers are waiting on. Coalescing is per process;
+results that should outlive the call belong in the result store.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from logger import get_logger
+
+system_logger = get_logger('SYSTEM')
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._followers = 0
+
+    def claim(self, key):
+        """
+        (future, is_leader). The leader must call release(key, future, ...) when done;
+        everyone else waits on `future`.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._followers += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self._leaders += 1
+            return future, True
+
+    def release(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """(fn(*args, **kwargs), shared), running fn only if no call for `key` is in flight."""
+        future, leader = self.claim(key)
+        if not leader:
+            system_logger.info('Single-flight %s: joined in-flight call %s', self.name, _describe(key))
+            return future.result(), True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            self.release(key, future, error=exc)
+            raise
+        self.release(key, future, result)
+        return result, False
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """Async do() for a coroutine function."""
+        future, leader = self.claim(key)
+        if leader:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda done: self._settle(key, future, done))
+        else:
+            system_logger.info('Single-flight %s: joined in-flight call %s', self.name, _describe(key))
+        return await asyncio.shield(asyncio.wrap_future(future)), not leader
+
+    def _settle(self, key, future, task):
+        if task.cancelled():
+            self.release(key, future, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self.release(key, future, error=task.exception())
+        else:
+            self.release(key, future, task.result())
+
+    def stats(self):
+        with self._lock:
+            return {'inFlight': len(self._calls), 'leaders': self._leaders, 'followers': self._followers}
+
+
+def _describe(key):
+    # Keys hold content hashes; the first 12 characters are enough for the logs.
+    return tuple(part[:12] if isinstance(part, str) and len(part) > 12 else part for part in key)
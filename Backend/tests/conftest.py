@@ -0,0 +1,58 @@
+# conftest.py
+"""Shared test setup: import the backend modules from Backend/ without network or API keys."""
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Module-level config is read at import, so these must be set before any backend import.
+_SCRATCH = tempfile.mkdtemp(prefix='docsensei-tests-')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ['RESULT_CACHE_PATH'] = os.path.join(_SCRATCH, 'results.sqlite3')
+os.environ['PRECOMPUTE_ENABLED'] = 'false'
+os.environ['LLM_BACKEND'] = 'fake'
+os.environ['LANGSMITH_TRACING'] = 'false'
+os.environ['FAKE_LLM_LATENCY_MS'] = '0'
+os.environ['FAKE_LLM_JITTER_MS'] = '0'
+os.environ['FAKE_LLM_TOKENS_PER_SEC'] = '0'
+
+import context_packer  # noqa: E402
+
+# Tests never download tiktoken's encoding; token counts use the estimate instead.
+context_packer._encoder_retry_at = float('inf')
+
+# Pages in the `upload` fixture's fake document.
+TOTAL_PAGES = 4
+
+
+@pytest.fixture
+def upload(tmp_path, monkeypatch):
+    """A fake upload whose extraction pauses after its first incremental flush."""
+    import app as backend
+
+    monkeypatch.setitem(backend.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(backend, 'RETRIEVAL_ENABLED', False)
+    monkeypatch.setattr(backend, 'PRECOMPUTE_ON_EXTRACT', False)
+    monkeypatch.setattr(backend, 'EXTRACTION_CACHE_FLUSH_PAGES', 2)
+    (tmp_path / 'doc.pdf').write_bytes(b'%PDF-1.4 test')
+
+    state = {'runs': 0, 'flushed': threading.Event(), 'resume': threading.Event()}
+
+    def fake_iter_extracted_pages(file_path, time_budget_sec=None):
+        state['runs'] += 1
+        for idx in range(TOTAL_PAGES):
+            if idx == 2:
+                # iter_and_cache_extraction flushed pages 0-1 before asking for page 2.
+                state['flushed'].set()
+                assert state['resume'].wait(10)
+            yield idx, f'page {idx + 1} text', TOTAL_PAGES
+
+    monkeypatch.setattr(backend, 'iter_extracted_pages', fake_iter_extracted_pages)
+    state['file_path'] = str(tmp_path / 'doc.pdf')
+    state['url'] = 'http://localhost/uploads/doc.pdf'
+    return state
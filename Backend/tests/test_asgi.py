@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+
+import asgi
+
+
+async def _call(path, payload):
+    """(status, decoded body) for one POST through the ASGI app."""
+    body = json.dumps(payload).encode('utf-8')
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'headers': [], 'query_string': b''}
+    await asgi.app(scope, receive, send)
+    status = sent[0]['status']
+    return status, b''.join(message.get('body', b'') for message in sent[1:]).decode('utf-8')
+
+
+PAGE = (
+    'Photosynthesis converts light energy into chemical energy inside chloroplasts. '
+    'Chlorophyll absorbs mostly blue and red wavelengths of visible light. '
+    'The Calvin cycle fixes carbon dioxide into three-carbon sugars using ATP. '
+    'Oxygen is released as a byproduct when water molecules are split apart. '
+) * 3
+
+
+def _record_threads(monkeypatch, names):
+    calls = {}
+    for name in names:
+        original = getattr(asgi, name)
+
+        def wrapper(*args, __name=name, __original=original, **kwargs):
+            calls[__name] = threading.get_ident()
+            return __original(*args, **kwargs)
+
+        monkeypatch.setattr(asgi, name, wrapper)
+    return calls
+
+
+def test_quiz_parse_and_cache_key_run_off_the_event_loop(monkeypatch):
+    calls = _record_threads(monkeypatch, ('parse_quiz_request', 'quiz_cache_key'))
+    status, body = asyncio.run(_call('/generate-quiz', {'pageContent': PAGE}))
+    assert status == 200
+    assert json.loads(body)['questions']
+    assert set(calls) == {'parse_quiz_request', 'quiz_cache_key'}
+    assert threading.get_ident() not in calls.values()
+
+
+def test_summary_parse_and_cache_key_run_off_the_event_loop(monkeypatch):
+    calls = _record_threads(monkeypatch, ('parse_summary_request', 'summary_cache_key'))
+    status, body = asyncio.run(_call('/summarize', {'pages': [PAGE], 'pageNumber': 1}))
+    assert status == 200
+    assert json.loads(body)['bullets']
+    assert set(calls) == {'parse_summary_request', 'summary_cache_key'}
+    assert threading.get_ident() not in calls.values()
+
+
+def test_thin_quiz_page_is_answered_without_the_model():
+    status, body = asyncio.run(_call('/generate-quiz', {'pageContent': 'Chapter 3'}))
+    assert status == 200
+    assert json.loads(body)['valid'] is False
+
+
+def test_chat_stream_stops_when_the_client_disconnects(monkeypatch):
+    state = {'yielded': 0, 'closed': False}
+
+    async def endless_stream(*args):
+        try:
+            while True:
+                state['yielded'] += 1
+                yield 'token '
+                await asyncio.sleep(0.01)
+        finally:
+            state['closed'] = True
+
+    monkeypatch.setattr(asgi, 'astream_chat_with_document', endless_stream)
+    monkeypatch.setattr(asgi, '_llm_slots', None)
+
+    async def run():
+        gone = asyncio.Event()
+        messages = [{'type': 'http.request', 'body': json.dumps({'message': 'hi', 'stream': True}).encode(),
+                     'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if sum(b'"token"' in item.get('body', b'') for item in sent) == 3:
+                gone.set()
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/chat', 'headers': [], 'query_string': b''}
+        await asyncio.wait_for(asgi.app(scope, receive, send), 5)
+        return sent, asgi._get_llm_slots()
+
+    sent, slots = asyncio.run(run())
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    assert body.count(b'"token"') == 3
+    assert b'event: done' not in body and b'event: error' not in body
+    assert state['closed'] is True
+    assert state['yielded'] <= 4
+    assert not slots.locked()
+
+
+def test_chat_stream_completes(monkeypatch):
+    async def short_stream(*args):
+        for token in ('Hello', ' there'):
+            yield token
+
+    monkeypatch.setattr(asgi, 'astream_chat_with_document', short_stream)
+    monkeypatch.setattr(asgi, '_llm_slots', None)
+    status, body = asyncio.run(_call('/chat', {'message': 'hi', 'stream': True}))
+    assert status == 200
+    assert body.count('"token"') == 2
+    assert 'event: done\ndata: {"response": "Hello there"}' in body
@@ -0,0 +1,73 @@
+import types
+
+import pytest
+
+import context_packer
+import langchain_utils
+from context_packer import ContextPacker, count_tokens, truncate_to_tokens
+
+
+class _Encoder:
+    """Whitespace tokenizer standing in for cl100k_base."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def encode_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+@pytest.fixture
+def encoder_loads(monkeypatch):
+    """tiktoken.get_encoding that fails while `state['offline']`; counts load attempts."""
+    state = {'offline': True, 'attempts': 0, 'now': 1000.0}
+
+    def get_encoding(name):
+        state['attempts'] += 1
+        if state['offline']:
+            raise OSError('no network')
+        return _Encoder()
+
+    monkeypatch.setattr(context_packer, 'tiktoken', types.SimpleNamespace(get_encoding=get_encoding))
+    monkeypatch.setattr(context_packer, 'time', types.SimpleNamespace(monotonic=lambda: state['now']))
+    monkeypatch.setattr(context_packer, '_encoder', None)
+    monkeypatch.setattr(context_packer, '_encoder_retry_at', None)
+    return state
+
+
+def test_failed_encoder_load_is_retried_after_the_retry_window(encoder_loads):
+    assert count_tokens('x' * 40) == 10
+    assert langchain_utils._count_tokens_batch(['some page text']) == [None]
+    assert count_tokens('x' * 40) == 10
+    assert encoder_loads['attempts'] == 1
+
+    encoder_loads['offline'] = False
+    encoder_loads['now'] += context_packer.TOKEN_ENCODER_RETRY_SEC - 1
+    assert langchain_utils._count_tokens_batch(['some page text']) == [None]
+    assert encoder_loads['attempts'] == 1
+
+    encoder_loads['now'] += 1
+    assert langchain_utils._count_tokens_batch(['some page text']) == [3]
+    assert count_tokens('one two') == 2
+    assert encoder_loads['attempts'] == 2
+
+
+def test_truncate_keeps_whole_sentences(encoder_loads):
+    encoder_loads['offline'] = False
+    text = 'First sentence here. Second sentence follows. Third one is cut.'
+    cut, tokens = truncate_to_tokens(text, 7)
+    assert cut == 'First sentence here. Second sentence follows.'
+    assert tokens == 6
+
+
+def test_packer_respects_budget_and_section_caps(encoder_loads):
+    encoder_loads['offline'] = False
+    packer = ContextPacker(20)
+    packer.add_fixed('system', 'one two three four')
+    packer.add_text('page', 'alpha beta gamma. ' * 10, max_tokens=9)
+    assert packer.usage['system'] == 4
+    assert packer.usage['page'] <= 9
+    assert sum(packer.usage.values()) <= 20
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from document_handles import DocumentHandlePool
+
+fitz = pytest.importorskip('fitz')
+
+
+def _write_pdf(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+    doc.close()
+
+
+def test_handles_are_reused_until_the_file_changes(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    _write_pdf(path, ['one'])
+    pool = DocumentHandlePool(max_size=2)
+
+    with pool.open(str(path)) as handle:
+        assert handle.fitz_doc().page_count == 1
+    with pool.open(str(path)) as again:
+        assert again is handle
+
+    _write_pdf(path, ['one', 'two'])
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    with pool.open(str(path)) as fresh:
+        assert fresh is not handle
+        assert fresh.fitz_doc().page_count == 2
+    assert handle.retired and handle._fitz_doc is None
+
+
+def test_evicted_handle_closes_on_its_last_release(tmp_path):
+    paths = []
+    for name in ('a', 'b', 'c'):
+        paths.append(str(tmp_path / f'{name}.pdf'))
+        _write_pdf(paths[-1], [name])
+    pool = DocumentHandlePool(max_size=2)
+
+    with pool.open(paths[0]) as borrowed:
+        borrowed.fitz_doc()
+        with pool.open(paths[1]), pool.open(paths[2]):
+            pass
+        # Evicted while borrowed: still usable until it is handed back.
+        assert borrowed.retired and borrowed.fitz_doc().page_count == 1
+    assert borrowed._fitz_doc is None
+    with pool.open(paths[0]) as reopened:
+        assert reopened is not borrowed
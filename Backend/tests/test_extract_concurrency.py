@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import app as backend
+from conftest import TOTAL_PAGES
+
+
+def _post_extract(url, results, key, **extra):
+    with backend.app.test_client() as client:
+        response = client.post('/extract', json={'fileUrl': url, **extra})
+        results[key] = (response.status_code, response.get_data(as_text=True), response.get_json(silent=True))
+
+
+def _wait_for_followers(count):
+    deadline = time.monotonic() + 5
+    while backend.extraction_flights.stats()['followers'] < count:
+        assert time.monotonic() < deadline, 'second caller never joined the extraction in flight'
+        time.sleep(0.01)
+
+
+def test_partial_flush_is_not_served_as_cached(upload):
+    results = {}
+    first = threading.Thread(target=_post_extract, args=(upload['url'], results, 'first'))
+    first.start()
+    assert upload['flushed'].wait(5)
+
+    # The store now holds two of four pages; it must not be served as a finished extraction.
+    assert backend.get_page_store(upload['file_path']).read_pages() == ['page 1 text', 'page 2 text', '', '']
+    assert backend.load_extraction_cache(upload['file_path']) is None
+
+    followers = backend.extraction_flights.stats()['followers']
+    second = threading.Thread(target=_post_extract, args=(upload['url'], results, 'second'))
+    second.start()
+    _wait_for_followers(followers + 1)
+    upload['resume'].set()
+    first.join(10)
+    second.join(10)
+
+    expected = [f'page {idx + 1} text' for idx in range(TOTAL_PAGES)]
+    for key in ('first', 'second'):
+        status, _, payload = results[key]
+        assert status == 200
+        assert payload == {'pages': expected, 'cached': False}
+    assert upload['runs'] == 1
+
+    # Once the final flush has landed the store is a cached result.
+    assert backend.load_extraction_cache(upload['file_path']) == expected
+    _post_extract(upload['url'], results, 'third')
+    assert results['third'][2] == {'pages': expected, 'cached': True}
+
+
+def test_streamed_caller_waits_for_extraction_in_flight(upload):
+    results = {}
+    first = threading.Thread(target=_post_extract, args=(upload['url'], results, 'first'))
+    first.start()
+    assert upload['flushed'].wait(5)
+
+    followers = backend.extraction_flights.stats()['followers']
+    second = threading.Thread(target=_post_extract, args=(upload['url'], results, 'second'), kwargs={'stream': True})
+    second.start()
+    _wait_for_followers(followers + 1)
+    upload['resume'].set()
+    first.join(10)
+    second.join(10)
+
+    status, body, _ = results['second']
+    assert status == 200
+    lines = [line for line in body.splitlines() if line]
+    assert len(lines) == TOTAL_PAGES + 1
+    assert '"page 4 text"' in lines[TOTAL_PAGES - 1]
+    assert upload['runs'] == 1
+
+
+def test_crashed_extraction_leaves_store_incomplete(upload, monkeypatch):
+    upload['resume'].set()
+    store = backend.get_page_store(upload['file_path'])
+    store.write_pages(['page 1 text', '', '', ''], complete=False)
+    assert backend.load_extraction_cache(upload['file_path']) is None
+
+    pages, shared = backend.extract_document_pages(upload['file_path'])
+    assert pages == [f'page {idx + 1} text' for idx in range(TOTAL_PAGES)]
+    assert shared is False
+    assert store.state()[1] is True
+
+
+def test_truncated_page_index_is_re_extracted(upload):
+    upload['resume'].set()
+    pages, _ = backend.extract_document_pages(upload['file_path'])
+    store = backend.get_page_store(upload['file_path'])
+    with open(store.index_path, 'r+b') as index_file:
+        index_file.truncate(os.path.getsize(store.index_path) - 5)
+    backend.hot_pages.invalidate(os.path.abspath(upload['file_path']))
+
+    with backend.app.test_client() as client:
+        response = client.post('/extract-page', json={'fileUrl': upload['url'], 'pageNumber': 2})
+        assert response.status_code == 200
+        response = client.post('/extract', json={'fileUrl': upload['url']})
+        assert response.status_code == 200
+        assert response.get_json() == {'pages': pages, 'cached': False}
+        response = client.post('/extract-pages', json={'fileUrl': upload['url'], 'startPage': 1, 'batchSize': 2})
+        assert response.status_code == 200
+    assert store.read_pages() == pages
@@ -0,0 +1,50 @@
+import json
+
+import app as backend
+
+PAGES = ['First page\nwith a line break', 'Ünïcödé — “quoted” text', '', 'Last page\r\n\ttabbed']
+
+
+def _stream(url):
+    with backend.app.test_client() as client:
+        response = client.post('/extract', json={'fileUrl': url, 'stream': True})
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        body = response.get_data(as_text=True)
+    # One JSON record per line, each line terminated, even for pages with line breaks in them.
+    assert body.endswith('\n')
+    return [json.loads(line) for line in body[:-1].split('\n')]
+
+
+def _fake_pages(monkeypatch, pages):
+    def fake_iter_extracted_pages(file_path, time_budget_sec=None):
+        for idx, text in enumerate(pages):
+            yield idx, text, len(pages)
+
+    monkeypatch.setattr(backend, 'iter_extracted_pages', fake_iter_extracted_pages)
+
+
+def test_stream_frames_one_page_per_line_then_done(upload, monkeypatch):
+    _fake_pages(monkeypatch, PAGES)
+
+    records = _stream(upload['url'])
+    assert records[:-1] == [
+        {'type': 'page', 'pageNumber': idx + 1, 'totalPages': len(PAGES), 'text': text}
+        for idx, text in enumerate(PAGES)
+    ]
+    assert records[-1] == {'type': 'done', 'totalPages': len(PAGES), 'cached': False}
+
+    # The finished extraction is cached and replayed with the same framing.
+    cached = _stream(upload['url'])
+    assert cached[:-1] == records[:-1]
+    assert cached[-1] == {'type': 'done', 'totalPages': len(PAGES), 'cached': True}
+
+
+def test_done_record_carries_a_page_error(upload, monkeypatch):
+    pages = ['page 1 text', '[Error extracting page 2: broken xref]']
+    _fake_pages(monkeypatch, pages)
+
+    records = _stream(upload['url'])
+    assert [record['type'] for record in records] == ['page', 'page', 'done']
+    assert records[-1] == {'type': 'done', 'totalPages': 2, 'cached': False, 'error': pages[1]}
+    assert backend.load_extraction_cache(upload['file_path']) is None
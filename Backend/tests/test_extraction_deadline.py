@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import Future
+
+import fitz
+import pytest
+
+import langchain_utils
+from document_handles import open_document
+
+PAGE_TEXT = 'The mitochondria is the powerhouse of the cell and produces most of its ATP supply.'
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    """Pages 1-3 have a text layer, page 4 is blank (needs the OCR fallback)."""
+    path = tmp_path / 'doc.pdf'
+    doc = fitz.open()
+    for _ in range(3):
+        doc.new_page().insert_text((72, 72), PAGE_TEXT)
+    doc.new_page()
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture
+def ocr_calls(monkeypatch):
+    calls = []
+
+    def submit_page_ocr(handle, idx, total_pages, deadline=None):
+        calls.append((idx, deadline))
+        future = Future()
+        future.set_result('ocr text')
+        return future
+
+    monkeypatch.setattr(langchain_utils, '_submit_page_ocr', submit_page_ocr)
+    return calls
+
+
+def _extract(pdf_path, start, end, deadline):
+    with open_document(pdf_path) as handle:
+        return list(langchain_utils._iter_fitz_range(handle, start, end, 4, deadline))
+
+
+def test_expired_deadline_stops_before_reading_more_pages(pdf_path, ocr_calls):
+    expired = time.monotonic() - 1
+    # The document's first page is always attempted.
+    assert [idx for idx, _, _ in _extract(pdf_path, 0, 4, expired)] == [0]
+    assert _extract(pdf_path, 1, 4, expired) == []
+    assert ocr_calls == []
+
+
+def test_ocr_fallback_is_capped_by_the_extraction_deadline(pdf_path, ocr_calls):
+    deadline = time.monotonic() + 60
+    pages = _extract(pdf_path, 0, 4, deadline)
+    assert [idx for idx, _, _ in pages] == [0, 1, 2, 3]
+    assert pages[3] == (3, 'ocr text', True)
+    assert ocr_calls == [(3, deadline)]
+
+
+def test_process_pool_worker_honours_wall_clock_deadline(pdf_path, ocr_calls):
+    assert [idx for idx, _, _ in langchain_utils._extract_page_range(pdf_path, 1, 4, time.time() - 1)] == []
+    pages = langchain_utils._extract_page_range(pdf_path, 1, 4, time.time() + 60)
+    assert [idx for idx, _, _ in pages] == [1, 2, 3]
+    (idx, deadline), = ocr_calls
+    assert idx == 3 and 50 < deadline - time.monotonic() <= 60
+
+
+def test_extraction_pool_workers_are_not_forked_from_the_server(pdf_path):
+    pool = langchain_utils._get_extraction_pool()
+    try:
+        assert pool._mp_context.get_start_method() in ('forkserver', 'spawn')
+        pages = pool.submit(langchain_utils._extract_page_range, pdf_path, 0, 3, time.time() + 60).result(60)
+    finally:
+        langchain_utils._reset_extraction_pool()
+    assert [idx for idx, _, _ in pages] == [0, 1, 2]
+    assert all(PAGE_TEXT in text and not used_fallback for _, text, used_fallback in pages)
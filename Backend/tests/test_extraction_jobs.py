@@ -0,0 +1,88 @@
+import threading
+import time
+
+import app as backend
+from conftest import TOTAL_PAGES
+from extraction_jobs import JOB_DONE, JOB_FAILED, JOB_RUNNING, ExtractionJob, ExtractionJobQueue
+
+EXPECTED = [f'page {idx + 1} text' for idx in range(TOTAL_PAGES)]
+
+
+def _wait_until(condition, message):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, message
+        time.sleep(0.01)
+
+
+def test_queue_reports_progress_and_failure():
+    def runner(job):
+        job.record_progress(3, 2)
+        if job.id == 'bad':
+            raise RuntimeError('[Error boom]')
+
+    queue = ExtractionJobQueue(runner, max_workers=1)
+    good = queue.submit('good', '/tmp/good.pdf')
+    bad = queue.submit('bad', '/tmp/bad.pdf')
+    assert good.wait(5) and bad.wait(5)
+    assert good.to_dict()['status'] == JOB_DONE
+    assert good.to_dict()['pagesPending'] == 1
+    assert bad.to_dict()['status'] == JOB_FAILED
+    assert bad.to_dict()['error'] == '[Error boom]'
+    assert queue.active_job('good') is None
+
+
+def test_cached_status_counts_blank_pages_as_done():
+    status = backend.cached_extraction_status('doc.pdf', ['text', '', ''])
+    assert status['pagesDone'] == 3
+    assert status['pagesPending'] == 0
+
+
+def test_job_joins_request_extraction_in_flight(upload):
+    results = {}
+
+    def post_extract():
+        with backend.app.test_client() as client:
+            results['response'] = client.post('/extract', json={'fileUrl': upload['url']}).get_json()
+
+    request_thread = threading.Thread(target=post_extract)
+    request_thread.start()
+    assert upload['flushed'].wait(5)
+
+    followers = backend.extraction_flights.stats()['followers']
+    job = ExtractionJob('doc.pdf', upload['file_path'])
+    job_thread = threading.Thread(target=backend.run_extraction_job, args=(job,))
+    job_thread.start()
+    _wait_until(lambda: backend.extraction_flights.stats()['followers'] > followers, 'job did not join the flight')
+    upload['resume'].set()
+    request_thread.join(10)
+    job_thread.join(10)
+
+    assert upload['runs'] == 1
+    assert results['response'] == {'pages': EXPECTED, 'cached': False}
+    assert job.to_dict()['pagesDone'] == TOTAL_PAGES
+
+
+def test_blocking_extract_returns_job_status_when_wait_expires(upload, monkeypatch):
+    monkeypatch.setattr(backend, 'EXTRACTION_JOB_WAIT_SEC', 0.05)
+    queue = ExtractionJobQueue(backend.run_extraction_job, max_workers=1)
+    monkeypatch.setattr(backend, 'extraction_jobs', queue)
+    with backend.app.test_client() as client:
+        accepted = client.post('/extract', json={'fileUrl': upload['url'], 'background': True})
+        assert accepted.status_code == 202
+        assert upload['flushed'].wait(5)
+
+        response = client.post('/extract', json={'fileUrl': upload['url']})
+        assert response.status_code == 202
+        payload = response.get_json()
+        assert payload['status'] == JOB_RUNNING
+        assert payload['statusUrl'].endswith('/extract-status/doc.pdf')
+
+        upload['resume'].set()
+        assert queue.get('doc.pdf').wait(5)
+        response = client.post('/extract', json={'fileUrl': upload['url']})
+        assert response.get_json() == {'pages': EXPECTED, 'cached': True}
+        status = client.get('/extract-status/doc.pdf').get_json()
+        assert status['status'] == JOB_DONE
+        assert status['pagesPending'] == 0
+    assert upload['runs'] == 1
@@ -0,0 +1,46 @@
+import fake_llm
+import langchain_utils
+
+PAGE = (
+    'Mitochondria release energy from glucose through cellular respiration. '
+    'Ribosomes assemble proteins from amino acids using messenger templates. '
+    'The nucleus stores chromosomes and controls which genes are expressed. '
+    'Chloroplasts capture sunlight and convert it into chemical energy for plants. '
+)
+
+
+def test_quiz_replies_parse_as_quizzes():
+    assert isinstance(langchain_utils.get_llm(), fake_llm.FakeChatModel)
+    for is_hard_mode in (False, True):
+        quiz = langchain_utils.mcq_quiz_generator(PAGE, is_hard_mode)
+        assert 'error' not in quiz and quiz['valid'] is True
+        assert len(quiz['questions']) == 3
+        for question in quiz['questions']:
+            assert set(question) == {'question', 'options', 'correctAnswer', 'explanation'}
+            assert len(question['options']) == 4 and question['correctAnswer'] in range(4)
+            assert question['options'][question['correctAnswer']] not in question['question']
+
+
+def test_quiz_replies_are_deterministic_and_batch_like_single_calls():
+    quiz = langchain_utils.mcq_quiz_generator(PAGE)
+    assert langchain_utils.mcq_quiz_generator(PAGE) == quiz
+    assert langchain_utils.mcq_quiz_generator_batch([PAGE, 'Too short.']) == [
+        quiz, langchain_utils.mcq_quiz_generator('Too short.'),
+    ]
+
+
+def test_summary_replies_parse_as_summaries():
+    summary = langchain_utils._generate_summary(PAGE)
+    assert 'error' not in summary
+    assert {'title', 'bullets', 'is_content_page', 'one_liner'} <= set(summary)
+    assert isinstance(summary['title'], str) and summary['title']
+    assert all(isinstance(bullet, str) for bullet in summary['bullets']) and len(summary['bullets']) >= 2
+    assert summary['is_content_page'] is True
+    assert summary['one_liner'].startswith('Mitochondria release energy')
+
+
+def test_chat_replies_quote_the_context_and_stream_the_same_text():
+    reply = langchain_utils.chat_with_document('Where are proteins assembled?', PAGE, 'doc.pdf', [])
+    assert 'Ribosomes assemble proteins' in reply
+    streamed = ''.join(langchain_utils.stream_chat_with_document('Where are proteins assembled?', PAGE, 'doc.pdf', []))
+    assert streamed == reply
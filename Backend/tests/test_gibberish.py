@@ -0,0 +1,101 @@
+import random
+import re
+import string
+
+import pytest
+
+import langchain_utils
+
+_TOKEN_RE = re.compile(r'[A-Za-z]{1,4}|\d{1,3}|\s+|.', re.DOTALL)
+
+
+class StubEncoder:
+    """Deterministic stand-in for cl100k_base (tests run offline): short letter runs are tokens."""
+
+    def encode(self, text):
+        if '<|endoftext|>' in text:
+            raise ValueError('disallowed special token')
+        return _TOKEN_RE.findall(text)
+
+    def encode_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+
+def _per_page_verdict(text, enc):
+    """The per-page classifier the batch replaced, as it was."""
+    if not text or len(text) < 20:
+        return False
+    if text.count('\ufffd') > len(text) * 0.05:
+        return True
+    try:
+        tokens = enc.encode(text)
+        if len(tokens) == 0:
+            return True
+        density = len(text) / len(tokens)
+        if density < 1.5:
+            return True
+        alpha_chars = [c for c in text if c.isalpha()]
+        if not alpha_chars:
+            return False
+        upper_ratio = sum(1 for c in alpha_chars if c.isupper()) / len(alpha_chars)
+        space_ratio = text.count(' ') / len(text)
+        if upper_ratio > 0.8 and density < 3.0:
+            return True
+        if space_ratio < 0.05 and density < 2.5:
+            return True
+        if density < 2.0:
+            return True
+        return False
+    except Exception:
+        return False
+
+
+def _texts():
+    rng = random.Random(7)
+    prose = 'The mitochondria release energy from glucose through cellular respiration. ' * 6
+    texts = [
+        '', 'short', prose, prose.upper(), 'CHAPTER ONE INTRODUCTION TO CELL BIOLOGY',
+        ''.join(rng.choice(string.ascii_letters) for _ in range(400)),
+        ''.join(rng.choice(string.ascii_uppercase + ' ') for _ in range(300)),
+        ''.join(rng.choice('!@#$%^&*()[]{}') for _ in range(120)),
+        'Ünïcödé prose about élan vital and naïve café culture in Zürich. ' * 4,
+        'ΑΒΓΔ ΕΖΗΘ ΙΚΛΜ ΝΞΟΠ ' * 10,
+        'Broken text layer ' + '\ufffd' * 7 + ' here.',
+        '1234 5678 9012 3456 7890 ' * 8,
+        'Text with a marker <|endoftext|> that the encoder refuses to encode.',
+    ]
+    for _ in range(40):
+        alphabet = rng.choice([string.ascii_letters, string.ascii_lowercase + ' ', string.printable, 'aeiou ', 'XYZ'])
+        texts.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 300))))
+    return texts
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    encoder = StubEncoder()
+    monkeypatch.setattr(langchain_utils, '_get_token_encoder', lambda: encoder)
+    return encoder
+
+
+def test_batch_verdicts_match_the_per_page_classifier(encoder):
+    texts = _texts()
+    expected = [_per_page_verdict(text, encoder) for text in texts]
+    assert langchain_utils._score_pages_gibberish(texts) == expected
+    assert [langchain_utils._is_text_gibberish(text) for text in texts] == expected
+    # Every rule is exercised, not just the clean-text path.
+    assert expected.count(True) >= 5 and expected.count(False) >= 5
+
+
+def test_unencodable_text_does_not_change_the_other_verdicts(encoder):
+    texts = _texts()
+    clean = [text for text in texts if '<|endoftext|>' not in text]
+    verdicts = dict(zip(texts, langchain_utils._score_pages_gibberish(texts)))
+    assert langchain_utils._score_pages_gibberish(clean) == [verdicts[text] for text in clean]
+
+
+def test_without_an_encoder_only_replacement_characters_are_flagged(monkeypatch):
+    monkeypatch.setattr(langchain_utils, '_get_token_encoder', lambda: None)
+    texts = _texts()
+    assert langchain_utils._score_pages_gibberish(texts) == [
+        bool(text) and len(text) >= 20 and text.count('\ufffd') > len(text) * 0.05 for text in texts
+    ]
@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+pytest.importorskip('fitz')
+pytest.importorskip('uvicorn')
+
+ENDPOINTS = {
+    'POST /upload', 'POST /extract-page', 'POST /extract-pages', 'POST /extract',
+    'POST /generate-quiz', 'POST /summarize', 'POST /chat', 'POST /chat [stream]',
+}
+ENDPOINT_KEYS = {'count', 'errors', 'p50Ms', 'p95Ms', 'p99Ms', 'throughputRps', 'rssMedianMb', 'rssPeakMb'}
+
+
+def test_load_test_smoke(tmp_path):
+    output = tmp_path / 'results.json'
+    # With --seed 1, eight LLM requests draw every kind in the default mix.
+    subprocess.run(
+        [sys.executable, os.path.join('benchmarks', 'load_test.py'), '--concurrency', '2', '--pages', '2',
+         '--copies', '1', '--page-requests', '1', '--batch-size', '2', '--llm-requests', '8', '--seed', '1',
+         '--fake-latency-ms', '0', '--fake-jitter-ms', '0', '--fake-tokens-per-sec', '0', '--output', str(output)],
+        cwd=BACKEND_DIR, check=True, timeout=240, capture_output=True,
+    )
+    results = json.loads(output.read_text())
+
+    assert set(results['endpoints']) == ENDPOINTS
+    for endpoint, row in results['endpoints'].items():
+        assert ENDPOINT_KEYS <= set(row), endpoint
+        assert row['count'] >= 1 and row['errors'] == 0, endpoint
+        assert 0 < row['p50Ms'] <= row['p95Ms'] <= row['p99Ms'], endpoint
+        assert row['throughputRps'] > 0 and row['rssPeakMb'] > 0, endpoint
+    assert results['meta']['idleRssMb'] > 0
+    assert [phase['name'] for phase in results['phases']] == ['upload', 'pages', 'extract', 'llm']
+    assert 'hotPages' in results['cacheStats']
@@ -0,0 +1,52 @@
+import ocr_pool
+
+
+class _Image:
+    def getextrema(self):
+        return 0, 255
+
+
+def _fake_tesseract(monkeypatch, calls):
+    def image_to_string(image, timeout=None):
+        calls.append('string')
+        return ' line one\nline two \n'
+
+    def image_to_data(image, output_type=None, timeout=None):
+        calls.append('data')
+        return {'text': ['line', 'one'], 'conf': ['30', '40'], 'block_num': [1, 1], 'par_num': [1, 1],
+                'line_num': [1, 1]}
+
+    monkeypatch.setattr(ocr_pool, 'pytesseract', type('pytesseract', (), {
+        'image_to_string': staticmethod(image_to_string),
+        'image_to_data': staticmethod(image_to_data),
+        'Output': type('Output', (), {'DICT': 'dict'}),
+    }))
+
+
+def test_default_ocr_is_a_single_image_to_string_pass(monkeypatch):
+    calls = []
+    _fake_tesseract(monkeypatch, calls)
+    assert ocr_pool.OCR_ADAPTIVE_DPI is False
+    rerenders = []
+    text = ocr_pool._run_ocr(_Image(), '1/1', None, lambda scale: rerenders.append(scale) or _Image())
+    assert text == 'line one\nline two'
+    assert calls == ['string']
+    assert rerenders == []
+
+
+def test_adaptive_dpi_retries_low_confidence_pages(monkeypatch):
+    calls = []
+    _fake_tesseract(monkeypatch, calls)
+    monkeypatch.setattr(ocr_pool, 'OCR_ADAPTIVE_DPI', True)
+    rerenders = []
+    text = ocr_pool._run_ocr(_Image(), '1/1', None, lambda scale: rerenders.append(scale) or _Image())
+    assert text == 'line one'
+    assert calls == ['data', 'data']
+    assert rerenders == [ocr_pool.OCR_HIGH_RES_SCALE]
+
+
+def test_exhausted_deadline_skips_ocr(monkeypatch):
+    calls = []
+    _fake_tesseract(monkeypatch, calls)
+    assert ocr_pool._run_ocr(_Image(), '1/1', 0.0, None) == ''
+    assert calls == []
@@ -0,0 +1,33 @@
+import sys
+
+from page_cache import HotPageCache
+
+
+def test_range_is_served_only_under_its_signature():
+    cache = HotPageCache(max_bytes=1024 * 1024)
+    cache.put_range('doc', (1, 1), 0, ['a', 'b', 'c'], 3)
+    assert cache.get_range('doc', (1, 1), 1, None) == (['b', 'c'], 3)
+    assert cache.get_range('doc', (1, 1), 0, 5) == (['a', 'b', 'c'], 3)
+    # A write bumps the store's write count; the stale pages are dropped on sight.
+    assert cache.get_range('doc', (1, 2), 0, 1) is None
+    assert cache.get_range('doc', (1, 1), 0, 1) is None
+    assert cache.stats()['pages'] == 0
+
+
+def test_partial_ranges_miss():
+    cache = HotPageCache(max_bytes=1024 * 1024)
+    cache.put_range('doc', (1, 1), 2, ['c'], 4)
+    assert cache.get_range('doc', (1, 1), 2, 3) == (['c'], 4)
+    assert cache.get_range('doc', (1, 1), 1, 3) is None
+
+
+def test_least_recently_used_pages_are_evicted():
+    page = 'x' * 100
+    cache = HotPageCache(max_bytes=2 * sys.getsizeof(page))
+    cache.put_range('a', (1, 1), 0, [page], 1)
+    cache.put_range('b', (1, 1), 0, [page], 1)
+    assert cache.get_range('a', (1, 1), 0, 1) is not None
+    cache.put_range('c', (1, 1), 0, [page], 1)
+    assert cache.get_range('b', (1, 1), 0, 1) is None
+    assert cache.get_range('a', (1, 1), 0, 1) is not None
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,126 @@
+import os
+import struct
+
+import pytest
+
+import page_store
+from page_store import PageStore, PageStoreError
+
+UNRESOLVED = '[[unresolved]]'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PageStore(str(tmp_path / 'doc.pdf'), placeholders=('', UNRESOLVED))
+
+
+def test_missing_store(store):
+    assert store.signature() is None
+    assert store.read_pages() is None
+    assert store.page_count() is None
+    assert store.update_pages({0: 'x'}) is False
+
+
+def test_write_and_read_range(store):
+    store.write_pages(['one', '', 'three'])
+    assert store.page_count() == 3
+    assert store.read_pages() == ['one', '', 'three']
+    assert store.read_page_range(1, 10) == ['', 'three']
+    assert store.read_page(5) is None
+
+
+def test_update_keeps_more_informative_text(store):
+    store.write_pages(['one', UNRESOLVED, ''])
+    store.update_pages({0: '', 1: '', 2: UNRESOLVED})
+    assert store.read_pages() == ['one', UNRESOLVED, UNRESOLVED]
+    store.update_pages({1: 'two', 2: 'three'})
+    assert store.read_pages() == ['one', 'two', 'three']
+
+
+def test_write_merges_with_stored_text(store):
+    store.write_pages(['one', '', 'three'])
+    assert store.write_pages(['', 'two', UNRESOLVED]) == ['one', 'two', 'three']
+    assert store.read_pages() == ['one', 'two', 'three']
+
+
+def test_update_out_of_range(store):
+    store.write_pages(['one'])
+    with pytest.raises(IndexError):
+        store.update_pages({3: 'x'})
+
+
+def test_signature_changes_on_same_size_update(store, monkeypatch):
+    store.write_pages(['aaaa', 'bbbb'])
+    before = store.signature()
+    # The index keeps its size on an in-place update, and a coarse clock keeps its mtime.
+    monkeypatch.setattr(page_store.os, 'stat', lambda *args, **kwargs: pytest.fail('signature must not stat'))
+    store.update_pages({0: 'cccc'})
+    after = store.signature()
+    assert after != before
+    store.update_pages({1: 'dddd'})
+    assert store.signature() not in (before, after)
+
+
+def test_signature_changes_on_rewrite(store):
+    store.write_pages(['a'])
+    first = store.signature()
+    store.write_pages(['a'])
+    assert store.signature() != first
+
+
+def test_signature_of_unreadable_store_is_none(store):
+    store.write_pages(['old'])
+    # An index in the previous format (no write count) is unreadable, not misread.
+    with open(store.index_path, 'r+b') as index_file:
+        index_file.write(struct.pack('<8s', b'DSPAGES2'))
+    assert store.signature() is None
+    with pytest.raises(PageStoreError):
+        store.read_pages()
+    # A full write replaces the unreadable store.
+    store.write_pages(['fresh'])
+    assert store.read_pages() == ['fresh']
+
+
+def test_compaction_preserves_pages(store, monkeypatch):
+    monkeypatch.setattr(page_store, '_COMPACT_SLACK_BYTES', 0)
+    store.write_pages(['x' * 100, 'y'])
+    for round_number in range(5):
+        store.update_pages({0: str(round_number) * 100})
+    assert store.read_pages() == ['4' * 100, 'y']
+    assert store.signature() is not None
+
+
+def test_incomplete_mark(store):
+    store.write_pages(['one', ''], complete=False)
+    signature, complete = store.state()
+    assert complete is False
+    store.update_pages({1: 'two'})
+    assert store.state()[1] is False
+    # Completing with nothing left to write still rewrites the header.
+    store.update_pages({}, complete=True)
+    assert store.state()[1] is True
+    assert store.state()[0] != signature
+    assert store.read_pages() == ['one', 'two']
+
+
+@pytest.mark.parametrize('reader', ['read_pages', 'read_changed_pages'])
+def test_truncated_index_is_a_page_store_error(store, reader):
+    store.write_pages(['one', 'two', 'three'])
+    with open(store.index_path, 'r+b') as index_file:
+        index_file.truncate(os.path.getsize(store.index_path) - 5)
+    with pytest.raises(PageStoreError):
+        getattr(store, reader)()
+    with pytest.raises(PageStoreError):
+        store.update_pages({2: 'THREE'})
+    # A full write replaces the truncated store.
+    store.write_pages(['one', 'two', 'three'])
+    assert store.read_pages() == ['one', 'two', 'three']
+
+
+def test_record_past_the_end_of_the_blob_is_a_page_store_error(store):
+    store.write_pages(['one', 'two'])
+    with open(store.blob_path, 'r+b') as blob_file:
+        blob_file.truncate(os.path.getsize(store.blob_path) - 2)
+    with pytest.raises(PageStoreError):
+        store.read_page(1)
+    assert store.read_page(0) == 'one'
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+import langchain_utils
+import precompute
+from precompute import PrecomputeScheduler
+from result_cache import ResultStore
+
+PAGE = 'Enzymes lower the activation energy of reactions inside the cell. ' * 12
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / 'results.sqlite3'), ttl_sec=60, max_entries=100)
+    monkeypatch.setattr(langchain_utils, 'get_result_store', lambda: store)
+    monkeypatch.setattr(precompute, 'PRECOMPUTE_ENABLED', True)
+    return store
+
+
+def _wait_until_inflight(kind, key):
+    deadline = time.monotonic() + 5
+    while (kind, key) not in precompute.scheduler._inflight:
+        assert time.monotonic() < deadline, f'{kind} task was never queued'
+        time.sleep(0.01)
+
+
+def test_scheduler_runs_one_task_per_key():
+    scheduler = PrecomputeScheduler(max_workers=2, max_pending=4)
+    release = threading.Event()
+    calls = []
+
+    def task(*args):
+        assert release.wait(5)
+        calls.append(args)
+
+    assert scheduler.submit('summary', 'k', task, 'page')
+    assert scheduler.submit('summary', 'k', task, 'page')
+    assert scheduler.submit_many('quiz', {'a': 'page a', 'b': 'page b'}, task) == 2
+    # Only the key that is not in flight yet gets a new task.
+    assert scheduler.submit_many('quiz', {'b': 'page b', 'c': 'page c'}, task) == 2
+    assert scheduler.pending() == 4
+    assert not scheduler.submit('summary', 'other', task, 'page')
+    assert scheduler.submit_many('quiz', {'d': 'page d'}, task) == 0
+
+    # wait() gives up after its timeout, and is True once the task has run.
+    assert scheduler.wait('quiz', 'c', timeout=0.05) is False
+    threading.Timer(0.05, release.set).start()
+    assert scheduler.wait('quiz', 'c', timeout=5)
+    deadline = time.monotonic() + 5
+    while scheduler.pending():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert sorted(calls, key=repr) == sorted([('page',), (['page a', 'page b'],), (['page c'],)], key=repr)
+    assert scheduler.wait('summary', 'missing') is False
+
+
+def test_waiting_request_gets_the_precomputed_summary(store, monkeypatch):
+    release = threading.Event()
+    generated = []
+
+    def fake_summary(page_content):
+        assert release.wait(5)
+        generated.append(page_content)
+        return {'title': 'Enzymes', 'bullets': ['b'], 'is_content_page': True, 'one_liner': 'o'}
+
+    monkeypatch.setattr(langchain_utils, '_generate_summary', fake_summary)
+    monkeypatch.setattr(precompute, 'QUIZ_MIN_WORDS', 10 ** 6)
+
+    assert precompute.schedule_pages([PAGE], count=1) == {'pages': 1, 'dropped': 0}
+    key = langchain_utils.summary_cache_key(PAGE)
+    _wait_until_inflight('summary', key)
+    threading.Timer(0.05, release.set).start()
+
+    assert precompute.wait_for_summary(PAGE, key=key)
+    assert langchain_utils.summarize_page(PAGE, key=key)['title'] == 'Enzymes'
+    assert generated == [PAGE]
+
+
+def test_waiting_request_gets_the_precomputed_quiz(store, monkeypatch):
+    release = threading.Event()
+    batches = []
+
+    def fake_batch(page_contents, is_hard_mode, difficulty_level, streak):
+        assert release.wait(5)
+        batches.append(list(page_contents))
+        return [{'questions': [{'question': 'q'}], 'valid': True} for _ in page_contents]
+
+    monkeypatch.setattr(langchain_utils, 'mcq_quiz_generator_batch', fake_batch)
+    monkeypatch.setattr(langchain_utils, '_generate_summary', lambda page_content: {'title': 't'})
+    monkeypatch.setattr(langchain_utils, 'mcq_quiz_generator', lambda *args: pytest.fail('quiz generated twice'))
+
+    precompute.schedule_pages([PAGE], count=1)
+    key = langchain_utils.quiz_cache_key(PAGE)
+    _wait_until_inflight('quiz', key)
+    threading.Timer(0.05, release.set).start()
+
+    assert precompute.wait_for_quiz(PAGE, key=key)
+    quiz, variant_id, cached = langchain_utils.generate_quiz_cached(PAGE, key=key)
+    assert (quiz['questions'], variant_id, cached) == ([{'question': 'q'}], 0, True)
+    assert batches == [[PAGE]]
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import subprocess
+import sys
+
+import pytest
+
+import langchain_utils
+import prompt_registry
+from conftest import BACKEND_DIR
+from prompt_registry import PromptRegistry, RegisteredPrompt
+
+MESSAGES = [('system', 'Summarise {page_content}.'), ('user', '{page_content}')]
+
+
+def test_version_is_a_hash_of_roles_and_wording():
+    version = RegisteredPrompt('summary', MESSAGES).version
+    expected = hashlib.sha256(json.dumps([list(message) for message in MESSAGES]).encode('utf-8')).hexdigest()[:12]
+    assert version == expected
+    assert RegisteredPrompt('other name', list(MESSAGES), json_output=True).version == version
+    assert RegisteredPrompt('summary', [('system', 'Summarise {page_content}!'), MESSAGES[1]]).version != version
+    assert RegisteredPrompt('summary', [('human', MESSAGES[0][1]), MESSAGES[1]]).version != version
+
+
+def test_versions_are_stable_across_processes():
+    script = 'import json, prompt_registry; print(json.dumps(prompt_registry.registry.versions()))'
+    output = subprocess.run(
+        [sys.executable, '-c', script], cwd=BACKEND_DIR, env={'PYTHONHASHSEED': '123', 'PATH': ''},
+        capture_output=True, text=True, check=True,
+    ).stdout
+    assert json.loads(output) == prompt_registry.registry.versions()
+    assert set(json.loads(output)) == {'quiz', 'quiz_hard', 'summary', 'chat'}
+
+
+def test_cache_keys_follow_the_prompt_version(monkeypatch):
+    page = 'Enzymes lower the activation energy of reactions. ' * 10
+    key = langchain_utils.summary_cache_key(page)
+    assert langchain_utils.summary_cache_key(page) == key
+
+    registry = PromptRegistry()
+    registry.register('summary', [('system', 'A reworded summary prompt.'), ('user', '{page_content}')])
+    monkeypatch.setattr(langchain_utils, 'prompt_registry', registry)
+    assert langchain_utils.summary_cache_key(page) != key
+
+
+def test_register_twice_is_an_error():
+    registry = PromptRegistry()
+    registry.register('chat', MESSAGES)
+    with pytest.raises(ValueError):
+        registry.register('chat', MESSAGES)
+
+
+def test_chain_is_composed_once_per_model():
+    from langchain_core.runnables import RunnableLambda
+
+    prompt = RegisteredPrompt('chat', MESSAGES)
+    first_llm = RunnableLambda(lambda prompt_value: 'first')
+    second_llm = RunnableLambda(lambda prompt_value: 'second')
+    chain = prompt.chain(first_llm)
+    assert prompt.chain(first_llm) is chain
+    assert prompt.chain(second_llm) is not chain
+    assert prompt.chain(second_llm).invoke({'page_content': 'x'}) == 'second'
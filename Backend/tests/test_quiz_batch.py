@@ -0,0 +1,79 @@
+import pytest
+
+import app as backend
+import langchain_utils
+from result_cache import ResultStore
+
+
+def _page(topic):
+    return f'The {topic} is described in detail on this page of the chapter. ' * 10
+
+
+PAGES = [_page('membrane'), _page('nucleus'), _page('ribosome'), 'Chapter 2']
+
+
+def _question(answer):
+    return {'question': 'Which one?', 'choices': {'A': 'a', 'B': 'b', 'C': 'c', 'D': 'd'}, 'answer': answer}
+
+
+class FakeQuizChain:
+    """Stands in for the quiz chain; `replies` maps a word of the page to its parsed reply."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.batches = []
+
+    def batch(self, inputs, config=None, return_exceptions=False):
+        self.batches.append([page_input['page_content'] for page_input in inputs])
+        replies = []
+        for page_input in inputs:
+            reply = next(reply for word, reply in self.replies.items() if word in page_input['page_content'])
+            if isinstance(reply, Exception) and not return_exceptions:
+                raise reply
+            replies.append(reply() if callable(reply) else reply)
+        return replies
+
+
+@pytest.fixture
+def chain(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / 'results.sqlite3'), ttl_sec=60, max_entries=100)
+    monkeypatch.setattr(langchain_utils, 'get_result_store', lambda: store)
+    chain = FakeQuizChain({
+        'membrane': lambda: {'questions': [_question('B')], 'valid': True},
+        # The parser could not read this page's reply.
+        'nucleus': ValueError('Invalid json output'),
+        # One question has no usable answer letter and is dropped.
+        'ribosome': lambda: {'questions': [_question('E'), _question('A')], 'valid': True},
+    })
+    monkeypatch.setattr(langchain_utils, '_quiz_chain', lambda is_hard_mode: chain)
+    monkeypatch.setattr(langchain_utils, 'mcq_quiz_generator', lambda *args: pytest.fail('per-page quiz call'))
+    return chain
+
+
+def _post_batch(page_numbers):
+    with backend.app.test_client() as client:
+        response = client.post('/generate-quiz-batch', json={'pages': PAGES, 'pageNumbers': page_numbers})
+    assert response.status_code == 200
+    return {quiz['pageNumber']: quiz for quiz in response.get_json()['quizzes']}
+
+
+def test_batch_is_one_call_and_failures_stay_per_page(chain):
+    quizzes = _post_batch([1, 2, 3, 4])
+
+    assert len(chain.batches) == 1 and len(chain.batches[0]) == 3
+    assert quizzes[1]['questions'][0]['correctAnswer'] == 1
+    assert quizzes[1]['cached'] is False
+    assert 'Invalid json output' in quizzes[2]['error']
+    assert [question['correctAnswer'] for question in quizzes[3]['questions']] == [0]
+    assert quizzes[4]['valid'] is False and quizzes[4]['result'] == 'Not a quizable page'
+
+
+def test_cached_pages_are_left_out_of_the_batch(chain):
+    _post_batch([1, 3])
+    chain.replies['nucleus'] = lambda: {'questions': [_question('C')], 'valid': True}
+
+    quizzes = _post_batch([1, 2, 3])
+    assert len(chain.batches) == 2
+    assert len(chain.batches[1]) == 1 and 'nucleus' in chain.batches[1][0]
+    assert (quizzes[1]['cached'], quizzes[3]['cached'], quizzes[2]['cached']) == (True, True, False)
+    assert quizzes[2]['questions'][0]['correctAnswer'] == 2
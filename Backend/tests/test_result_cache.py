@@ -0,0 +1,111 @@
+import pytest
+
+import langchain_utils
+import result_cache
+from result_cache import ResultStore, content_key, normalize_text
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path / 'results.sqlite3'), ttl_sec=60, max_entries=100)
+    monkeypatch.setattr(langchain_utils, 'get_result_store', lambda: store)
+    return store
+
+
+def test_keys_ignore_whitespace_layout():
+    assert normalize_text(' a\n b\t c ') == 'a b c'
+    assert content_key('quiz', 'v1', normalize_text('a  b')) == content_key('quiz', 'v1', normalize_text('a\nb'))
+    assert content_key('quiz', 'v1', 'a b') != content_key('quiz', 'v2', 'a b')
+
+
+def test_variants_append_replace_and_expire(store, monkeypatch):
+    assert store.put('quiz', 'k', {'n': 0}) == 0
+    assert store.put('quiz', 'k', {'n': 1}) == 1
+    assert store.put('quiz', 'k', {'n': 2}, variant=0) == 0
+    assert sorted(store.get_variants('quiz', 'k')) == [(0, {'n': 2}), (1, {'n': 1})]
+    assert store.get('quiz', 'other') is None
+
+    now = result_cache.time.time()
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now + 61)
+    assert store.get_variants('quiz', 'k') == []
+    store.prune()
+    monkeypatch.undo()
+    assert store.get_variants('quiz', 'k') == []
+
+
+def test_prune_keeps_the_most_recently_used(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.sqlite3'), ttl_sec=60, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        store.put('summary', key, {'key': key}, variant=0)
+    store.touch('summary', 'a', 0)
+    store.prune()
+    assert store.get('summary', 'a') == {'key': 'a'}
+    assert store.get('summary', 'c') == {'key': 'c'}
+    assert store.get('summary', 'b') is None
+
+
+PAGE = 'Enzymes lower the activation energy of reactions. ' * 20
+
+
+def test_quiz_variants_rotate_through_unseen_then_replace_oldest(store, monkeypatch):
+    generated = []
+
+    def fake_generator(page_content, is_hard_mode, difficulty_level, streak):
+        generated.append(len(generated))
+        return {'questions': [{'question': f'q{generated[-1]}'}], 'valid': True}
+
+    monkeypatch.setattr(langchain_utils, 'mcq_quiz_generator', fake_generator)
+    monkeypatch.setattr(langchain_utils, 'QUIZ_CACHE_MAX_VARIANTS', 2)
+
+    quiz, first, cached = langchain_utils.generate_quiz_cached(PAGE)
+    assert (first, cached) == (0, False)
+    # A learner who has not seen variant 0 gets it from the cache.
+    assert langchain_utils.generate_quiz_cached(PAGE) == (quiz, 0, True)
+
+    _, second, cached = langchain_utils.generate_quiz_cached(PAGE, exclude_variants=[0])
+    assert (second, cached) == (1, False)
+    # Both variants seen and the key is full: the oldest variant is regenerated in place.
+    replaced, variant, cached = langchain_utils.generate_quiz_cached(PAGE, exclude_variants=[0, 1])
+    assert (variant, cached) == (0, False)
+    assert replaced['questions'][0]['question'] == 'q2'
+    assert len(generated) == 3
+
+
+def test_failed_quizzes_are_not_cached(store, monkeypatch):
+    monkeypatch.setattr(langchain_utils, 'mcq_quiz_generator', lambda *args: {'error': 'model down'})
+    assert langchain_utils.generate_quiz_cached(PAGE) == ({'error': 'model down'}, None, False)
+    key = langchain_utils.quiz_cache_key(PAGE)
+    assert store.get_variants('quiz', key) == []
+
+
+def test_quiz_key_depends_on_the_prompt_parameters_it_uses():
+    normal = langchain_utils.quiz_cache_key(PAGE, streak=0)
+    assert langchain_utils.quiz_cache_key(PAGE, is_hard_mode=True) != normal
+    assert langchain_utils.quiz_cache_key(' \n'.join(PAGE.split(' ')), streak=0) == normal
+
+
+def test_summaries_are_served_from_the_shared_store(store, monkeypatch):
+    generated = []
+
+    def fake_summary(page_content):
+        generated.append(page_content)
+        return {'title': 'Enzymes', 'bullets': ['Lower activation energy.'], 'is_content_page': True}
+
+    monkeypatch.setattr(langchain_utils, '_generate_summary', fake_summary)
+    first = langchain_utils.summarize_page(PAGE)
+    # A re-flowed copy of the page shares the key, and a second store instance (another worker) sees it.
+    assert langchain_utils.summarize_page(PAGE.replace('. ', '.\n')) == first
+    other_worker = ResultStore(store.db_path)
+    assert other_worker.get('summary', langchain_utils.summary_cache_key(PAGE)) == first
+    assert len(generated) == 1
+
+
+def test_failed_summaries_are_not_cached(store, monkeypatch):
+    monkeypatch.setattr(langchain_utils, '_generate_summary', lambda page: {'error': 'model down'})
+    assert langchain_utils.summarize_page(PAGE) == {'error': 'model down'}
+    assert store.get('summary', langchain_utils.summary_cache_key(PAGE)) is None
+
+
+def test_minimal_pages_skip_the_model(store, monkeypatch):
+    monkeypatch.setattr(langchain_utils, '_generate_summary', lambda page: pytest.fail('model called'))
+    assert langchain_utils.summarize_page('Chapter 3')['is_content_page'] is False
@@ -0,0 +1,112 @@
+import app as backend
+import retrieval
+from context_packer import CHAT_CURRENT_PAGE_TOKENS, count_tokens
+
+PAGES = [
+    'Photosynthesis converts sunlight into chemical energy stored in glucose inside chloroplasts.',
+    'The mitochondria release energy from glucose through cellular respiration.',
+    'Tectonic plates drift slowly across the mantle and cause earthquakes.',
+]
+
+
+def _read_pages(pages):
+    records = [(page_index, len(text)) for page_index, text in enumerate(pages)]
+
+    def read_changed_pages(known):
+        return records, {
+            page_index: text for page_index, text in enumerate(pages)
+            if known is None or page_index >= len(known) or tuple(known[page_index]) != records[page_index]
+        }
+
+    return read_changed_pages
+
+
+def _drain_refreshes():
+    retrieval._refresh_executor.submit(lambda: None).result(10)
+
+
+def test_search_drops_chunks_that_do_not_match(tmp_path):
+    file_path = str(tmp_path / 'doc.pdf')
+    read_changed_pages = _read_pages(PAGES)
+    retrieval.get_index(file_path, read_changed_pages)
+
+    results = retrieval.search_document(file_path, 'earthquakes tectonic plates', read_changed_pages)
+    assert [page_index for _, page_index, _ in results] == [2]
+    assert all(score > retrieval.RETRIEVAL_MIN_SCORE for score, _, _ in results)
+    # No shared terms, and a query of stopwords only (an all-zero vector), match nothing.
+    assert retrieval.search_document(file_path, 'quantum chromodynamics', read_changed_pages) == []
+    assert retrieval.search_document(file_path, 'what is the', read_changed_pages) == []
+
+
+def test_search_without_index_builds_it_in_the_background(tmp_path):
+    file_path = str(tmp_path / 'doc.pdf')
+    read_changed_pages = _read_pages(PAGES)
+
+    assert retrieval.search_document(file_path, 'glucose energy', read_changed_pages) == []
+    _drain_refreshes()
+    assert retrieval.DocumentIndexStore(file_path).exists()
+    assert retrieval.search_document(file_path, 'glucose energy', read_changed_pages)
+
+
+def test_finished_extraction_builds_the_index(upload, monkeypatch):
+    monkeypatch.setattr(backend, 'RETRIEVAL_ENABLED', True)
+    upload['resume'].set()
+    backend.extract_document_pages(upload['file_path'])
+    _drain_refreshes()
+
+    file_path = upload['file_path']
+    index = retrieval.get_index(file_path, lambda known: backend.read_changed_client_pages(file_path, known), build=False)
+    assert index is not None
+    assert sorted({page_index for page_index, _ in index.chunks}) == [0, 1, 2, 3]
+
+
+def test_retrieval_context_keeps_the_current_page(monkeypatch):
+    page = ' '.join(f'Sentence {number} about the current page.' for number in range(120))
+    passages = [(0.9, page_index, f'Passage {page_index} text.') for page_index in range(3)]
+    monkeypatch.setattr(backend, 'search_document', lambda *args, **kwargs: passages)
+
+    context = backend.build_retrieval_context('doc.pdf', 'question', page)
+    page_part, passages_part = context.split('Relevant passages from the document:')
+    assert count_tokens(page_part) >= CHAT_CURRENT_PAGE_TOKENS * 0.8
+    assert all(f'[Page {page_index + 1}] Passage {page_index} text.' in passages_part for page_index in range(3))
+
+
+def test_chat_without_matching_passages_uses_the_page(upload, monkeypatch):
+    monkeypatch.setattr(backend, 'RETRIEVAL_ENABLED', True)
+    monkeypatch.setattr(backend, 'search_document', lambda *args, **kwargs: [])
+
+    args, error = backend.parse_chat_request({
+        'message': 'question', 'context': 'page on screen', 'fileUrl': upload['url'],
+    })
+    assert error is None
+    assert args == ('question', 'page on screen', 'document', [])
+
+
+def test_hydrated_page_is_appended_without_a_rebuild(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'doc.pdf')
+    pages = [PAGES[0], '', PAGES[2]]
+    embedded = []
+    embedder = retrieval.HashingEmbedder()
+    monkeypatch.setattr(embedder, 'embed', lambda texts, embed=embedder.embed: embedded.append(list(texts)) or embed(texts))
+    monkeypatch.setattr(retrieval, 'get_embedder', lambda: embedder)
+    builds = []
+    build = retrieval.DocumentIndexStore.build
+    monkeypatch.setattr(retrieval.DocumentIndexStore, 'build', lambda self, *args: builds.append(1) or build(self, *args))
+
+    index = retrieval.get_index(file_path, _read_pages(pages))
+    assert index.matrix.shape[0] == 2 and len(builds) == 1
+
+    embedded.clear()
+    hydrated = list(pages)
+    hydrated[1] = PAGES[1]
+    index = retrieval.get_index(file_path, _read_pages(hydrated))
+    assert embedded == [[PAGES[1]]]
+    assert len(builds) == 1
+    assert index.matrix.shape[0] == 3
+    assert [page_index for page_index, _ in index.chunks] == [0, 2, 1]
+
+    # A fresh load reads the appended rows back from disk.
+    retrieval._loaded.clear()
+    reloaded = retrieval.get_index(file_path, _read_pages(hydrated), build=False)
+    assert reloaded.matrix.shape[0] == 3
+    assert reloaded.search(embedder.embed(['mitochondria respiration'])[0])[0][1] == 1
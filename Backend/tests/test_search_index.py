@@ -0,0 +1,93 @@
+import os
+
+import app as backend
+import search_index
+from search_index import LexicalIndex
+
+PAGES = [
+    'The cell membrane controls what enters the cell.',
+    'Mitochondria mitochondria mitochondria: the powerhouse of the cell.',
+    'Mitochondria appear once in this much longer page about plate tectonics, earthquakes, '
+    'volcanoes, mountain ranges, ocean trenches and the slow drift of continents.',
+    'Ünïcödé tërms and a ' + 'x' * 500 + ' token.',
+]
+
+
+def _build(pages=PAGES, signature=(1, 1)):
+    return LexicalIndex.build(pages, signature, [(page_index, len(text)) for page_index, text in enumerate(pages)])
+
+
+def test_bm25_ranks_by_term_frequency_and_length():
+    index = _build()
+    assert [page_index for page_index, _, _ in index.search('mitochondria')] == [1, 2]
+    # A rare term outweighs a common one.
+    assert index.search('membrane cell')[0][0] == 0
+    assert index.search('photosynthesis') == []
+    assert index.search('cell', limit=1)[0][2] == ['cell']
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = _build()
+    path = str(tmp_path / 'doc.pdf.search.npz')
+    index.save(path)
+    loaded = LexicalIndex.load(path)
+
+    assert loaded.signature == (1, 1)
+    assert loaded.records.tolist() == index.records.tolist()
+    assert loaded.term_ids == index.term_ids
+    for query in ('mitochondria', 'ünïcödé', 'x' * 500, 'earthquakes cell'):
+        assert loaded.search(query) == index.search(query)
+    # Terms are stored back to back, so one long token does not widen every other term.
+    assert loaded.term_blob.nbytes == sum(len(term.encode('utf-8')) for term in index.term_ids)
+
+
+def _search_index(file_path):
+    return search_index.get_lexical_index(
+        file_path, lambda known: backend.read_changed_client_pages(file_path, known),
+        backend.get_page_store(file_path).state(),
+    )
+
+
+def test_store_writes_restamp_or_rebuild_the_index(upload, monkeypatch):
+    upload['resume'].set()
+    backend.extract_document_pages(upload['file_path'])
+    builds = []
+    build = LexicalIndex.build.__func__
+    monkeypatch.setattr(LexicalIndex, 'build', classmethod(lambda cls, *args: builds.append(args) or build(cls, *args)))
+
+    index = _search_index(upload['file_path'])
+    assert len(builds) == 1
+    assert _search_index(upload['file_path']) is index
+
+    # A write that leaves the text as it was changes the signature but not the index.
+    backend.update_extraction_cache(upload['file_path'], {1: 'page 2 text'})
+    restamped = _search_index(upload['file_path'])
+    assert restamped.signature != index.signature
+    assert len(builds) == 1
+
+    backend.update_extraction_cache(upload['file_path'], {1: 'page 2 now mentions volcanoes'})
+    rebuilt = _search_index(upload['file_path'])
+    assert len(builds) == 2
+    assert [page_index for page_index, _, _ in rebuilt.search('volcanoes')] == [1]
+    assert os.path.exists(upload['file_path'] + search_index.INDEX_SUFFIX)
+
+
+def test_incomplete_store_is_not_indexed(upload):
+    backend.save_extraction_cache(upload['file_path'], ['page 1 text', '', '', ''], complete=False)
+    assert _search_index(upload['file_path']) is None
+
+
+def test_search_endpoint_errors(upload):
+    with backend.app.test_client() as client:
+        response = client.post('/search', json={'fileUrl': upload['url'], 'query': '  '})
+        assert response.status_code == 400
+        response = client.post('/search', json={'fileUrl': upload['url'], 'query': 'page'})
+        assert response.status_code == 409
+
+        upload['resume'].set()
+        backend.extract_document_pages(upload['file_path'])
+        response = client.post('/search', json={'fileUrl': upload['url'], 'query': 'page 3'})
+        assert response.status_code == 200
+        payload = response.get_json()
+        assert payload['totalPages'] == 4
+        assert payload['results'][0]['pageNumber'] == 3
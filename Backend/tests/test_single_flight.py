@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_sync_callers_share_one_call():
+    flights = SingleFlight('test')
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def work(value):
+        calls.append(value)
+        started.set()
+        assert release.wait(5)
+        return value * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('key', work, 21))) for _ in range(5)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while flights.stats()['followers'] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [21]
+    assert sorted(results) == [(42, False)] + [(42, True)] * 4
+    assert flights.stats() == {'inFlight': 0, 'leaders': 1, 'followers': 4}
+
+
+def test_followers_get_the_leaders_exception_and_the_key_is_freed():
+    flights = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        assert release.wait(5)
+        raise ValueError('boom')
+
+    def call():
+        try:
+            flights.do('key', fail)
+        except ValueError as exc:
+            errors.append(str(exc))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flights.stats()['followers'] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert errors == ['boom', 'boom']
+    assert flights.do('key', lambda: 'fresh') == ('fresh', False)
+
+
+def test_async_callers_share_one_call():
+    flights = SingleFlight('test')
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value + 1
+
+    async def run():
+        return await asyncio.gather(*(flights.ado('key', work, 1) for _ in range(4)))
+
+    results = asyncio.run(run())
+    assert calls == [1]
+    assert sorted(results) == [(2, False)] + [(2, True)] * 3
+
+
+def test_sync_caller_joins_async_call_in_flight():
+    flights = SingleFlight('test')
+    calls = []
+    sync_result = {}
+
+    async def work():
+        calls.append('async')
+        await asyncio.sleep(0.2)
+        return 'shared'
+
+    def sync_work():
+        calls.append('sync')
+        return 'own'
+
+    async def run():
+        leader = asyncio.ensure_future(flights.ado('key', work))
+        await asyncio.sleep(0.01)
+        thread = threading.Thread(target=lambda: sync_result.update(result=flights.do('key', sync_work)))
+        thread.start()
+        result = await leader
+        await asyncio.to_thread(thread.join, 5)
+        return result
+
+    assert asyncio.run(run()) == ('shared', False)
+    assert sync_result['result'] == ('shared', True)
+    assert calls == ['async']
+
+
+def test_cancelled_async_leader_does_not_cancel_followers():
+    flights = SingleFlight('test')
+
+    async def work():
+        await asyncio.sleep(0.1)
+        return 'done'
+
+    async def run():
+        leader = asyncio.ensure_future(flights.ado('key', work))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flights.ado('key', work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == ('done', True)
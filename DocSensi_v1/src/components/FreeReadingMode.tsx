@@ -153,6 +153,7 @@ export const FreeReadingMode: React.FC<FreeReadingModeProps> = ({ document, onBa
           message: message.slice(0, 2000),
           context: (currentPage?.content || '').slice(0, 4000),
           documentName: document.name,
+          fileUrl: document.fileUrl,
           history: chatMessages.slice(-6).map(m => ({ ...m, text: m.text.slice(0, 500) })),
         }),
       });